@@ -0,0 +1,113 @@
+import os
+import json
+import random
+
+TOPICS = [
+    "invoice", "contract", "warranty", "shipment", "maintenance", "insurance", "audit", "payroll",
+    "tender", "lease", "permit", "inspection", "budget", "license", "delivery", "training",
+]
+FILLER = [
+    "the", "department", "reviewed", "report", "quarterly", "customer", "process", "according", "policy",
+    "section", "approved", "request", "document", "period", "additional", "requirements", "service",
+    "responsible", "committee", "schedule", "provided", "within", "terms", "agreement", "office", "annual",
+    "records", "standard", "procedure", "information", "update", "regional", "manager", "submitted",
+]
+SYLLABLES = ["ka", "lo", "mi", "ren", "tu", "vex", "zor", "pli", "dan", "qui", "sto", "bar", "nel", "fy", "gru", "hom"]
+
+LINES_PER_PAGE = 45
+CHARS_PER_LINE = 90
+
+
+def pseudo_word(rng, syllables=3):
+    return "".join(rng.choice(SYLLABLES) for _ in range(syllables))
+
+
+def filler_sentence(rng, topic):
+    words = [rng.choice(FILLER) for _ in range(rng.randint(8, 16))]
+    words.insert(rng.randrange(len(words)), topic)
+    return " ".join(words).capitalize() + "."
+
+
+def wrap(text, width=CHARS_PER_LINE):
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    return lines
+
+
+def escape_pdf_text(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path, lines):
+    """Writes a minimal text-only PDF (Helvetica, one text object per page) that PyPDF can read."""
+    pages = [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)] or [[]]
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page_lines in pages:
+        text = "\n".join(f"({escape_pdf_text(line)}) Tj T*" for line in page_lines)
+        stream = f"BT /F1 10 Tf 12 TL 50 800 Td\n{text}\nET"
+        objects.append(f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream")
+        content_id = len(objects)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>")
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    output += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(output)
+
+
+def generate_corpus(folder, documents=50, pages=5, facts_per_document=4, seed=42):
+    """
+    Generates a synthetic PDF corpus with known answers.
+
+    Every document consists of filler sentences about one topic with a few embedded facts of the form
+    "The reference code of the <topic> file <name> is <code>." The queries ask for these codes, and a
+    retrieved chunk is relevant if it contains the code.
+
+    :param folder: Output folder for the PDFs.
+    :param documents: Number of PDFs.
+    :param pages: Approximate number of pages per PDF.
+    :param facts_per_document: Number of queries generated per PDF.
+    :return: List of queries {"question", "answer", "source"}; also written to queries.json next to the folder.
+    """
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    queries = []
+    sentences_per_page = LINES_PER_PAGE * CHARS_PER_LINE // 100
+
+    for number in range(documents):
+        topic = rng.choice(TOPICS)
+        sentences = [filler_sentence(rng, topic) for _ in range(pages * sentences_per_page)]
+        for _ in range(facts_per_document):
+            name, code = pseudo_word(rng), pseudo_word(rng, 4)
+            sentences.insert(rng.randrange(len(sentences)), f"The reference code of the {topic} file {name} is {code}.")
+            queries.append({
+                "question": f"What is the reference code of the {topic} file {name}?",
+                "answer": code,
+                "source": f"doc_{number:05d}.pdf",
+            })
+        lines = []
+        for start in range(0, len(sentences), 6):  # Paragraphs of six sentences
+            lines.extend(wrap(" ".join(sentences[start:start + 6])))
+        write_pdf(os.path.join(folder, f"doc_{number:05d}.pdf"), lines)
+
+    rng.shuffle(queries)
+    with open(os.path.join(os.path.dirname(os.path.abspath(folder)), "queries.json"), "w", encoding="utf-8") as f:
+        json.dump(queries, f, indent=1)
+    return queries
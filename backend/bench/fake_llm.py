@@ -0,0 +1,120 @@
+import re
+import time
+import asyncio
+import hashlib
+from types import SimpleNamespace
+import numpy as np
+
+REFINE_MARKER = "The following is the question you shall refine:\n"
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def fake_answer(messages, answer_tokens):
+    """
+    Deterministic reply to a chat request: refinement requests get the question back unchanged,
+    answer requests a fixed number of words derived from the prompt.
+    """
+    question = messages[-1]["content"]
+    if question.startswith(REFINE_MARKER):
+        return question[len(REFINE_MARKER):]
+    words = WORD_PATTERN.findall(messages[0]["content"]) or ["answer"]
+    seed = int(hashlib.sha1(repr(messages).encode("utf-8")).hexdigest()[:8], 16)
+    return " ".join(words[(seed + i) % len(words)] for i in range(answer_tokens))
+
+
+def split_tokens(text):
+    """Splits a reply into stream tokens (words with their trailing space)."""
+    return re.findall(r"\S+\s*", text) or [text]
+
+
+class _Completions:
+    def __init__(self, llm):
+        self.llm = llm
+
+    def create(self, model=None, messages=None, stream=False, max_tokens=None, **kwargs):
+        return self.llm._create(messages, stream, max_tokens)
+
+
+class FakeGroq:
+    """
+    Stand-in for the (sync) Groq client: chat.completions.create with a configurable time to first
+    token (latency_ms) and generation speed (tokens_per_second). Replies are deterministic.
+    """
+
+    def __init__(self, latency_ms=200, tokens_per_second=250, answer_tokens=120):
+        self.latency_ms = latency_ms
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.chat = SimpleNamespace(completions=_Completions(self))
+        self.calls = 0
+
+    def _reply(self, messages, max_tokens):
+        self.calls += 1
+        tokens = split_tokens(fake_answer(messages, self.answer_tokens))
+        return tokens[:max_tokens] if max_tokens else tokens
+
+    def _generation_seconds(self, tokens):
+        return len(tokens) / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    @staticmethod
+    def _completion(text):
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+    @staticmethod
+    def _chunk(token):
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+
+    def _create(self, messages, stream, max_tokens):
+        tokens = self._reply(messages, max_tokens)
+        time.sleep(self.latency_ms / 1000 + self._generation_seconds(tokens))
+        return self._completion("".join(tokens))
+
+
+class FakeAsyncGroq(FakeGroq):
+    """Stand-in for AsyncGroq; streamed replies yield one word per chunk at tokens_per_second."""
+
+    async def _create(self, messages, stream, max_tokens):
+        tokens = self._reply(messages, max_tokens)
+        await asyncio.sleep(self.latency_ms / 1000)
+        if stream:
+            return self._stream(tokens)
+        await asyncio.sleep(self._generation_seconds(tokens))
+        return self._completion("".join(tokens))
+
+    async def _stream(self, tokens):
+        for token in tokens:
+            if self.tokens_per_second:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            yield self._chunk(token)
+
+
+class HashEmbeddings:
+    """
+    Deterministic bag-of-words embeddings (feature hashing), a fast offline stand-in for FastEmbed.
+    Texts that share words get similar vectors, which is enough to measure retrieval on the synthetic corpus.
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+        self.model_name = f"hash-embeddings-{dim}"
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in WORD_PATTERN.findall(text.lower()):
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dim] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    # SentenceTransformer interface, used by pdfProcessor_faiss
+    def encode(self, texts, batch_size=None, convert_to_numpy=True):
+        return np.asarray(self.embed_documents(texts), dtype=np.float32)
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
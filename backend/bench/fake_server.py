@@ -0,0 +1,63 @@
+"""
+The retrieval server (server/main.py) with Groq replaced by the deterministic stub, for load tests.
+
+Configured by environment variables, so it also works with several uvicorn workers:
+    BENCH_WORKDIR               Work folder with data/ (index and PDFs), required
+    BENCH_LLM_LATENCY_MS        Time to first token of the stub (default 200)
+    BENCH_LLM_TOKENS_PER_SECOND Generation speed of the stub (default 250)
+    BENCH_FAKE_EMBEDDINGS       "true" to replace the embedding model by feature hashing
+
+Serve:    python -m uvicorn fake_server:app --app-dir bench --workers 2 --port 8080
+Prepare:  python bench/fake_server.py prepare --documents 50 --pages 5
+          (generates the synthetic corpus in BENCH_WORKDIR and indexes it)
+"""
+import os
+import sys
+import argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(os.path.dirname(BENCH_DIR), "server")
+for path in (BENCH_DIR, SERVER_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from fake_llm import FakeGroq, FakeAsyncGroq, HashEmbeddings
+
+# The server works with paths relative to the working directory
+os.chdir(os.environ["BENCH_WORKDIR"])
+os.environ.setdefault("LLM_API_KEY", "bench")
+os.environ.setdefault("SEM_CHUNK_API_KEY", "bench")
+
+from config import ServerConfig
+
+LLM_LATENCY_MS = float(os.environ.get("BENCH_LLM_LATENCY_MS", 200))
+LLM_TOKENS_PER_SECOND = float(os.environ.get("BENCH_LLM_TOKENS_PER_SECOND", 250))
+
+ServerConfig.update_config(
+    llm_model=FakeGroq(LLM_LATENCY_MS, LLM_TOKENS_PER_SECOND),
+    async_llm_model=FakeAsyncGroq(LLM_LATENCY_MS, LLM_TOKENS_PER_SECOND),
+)
+if os.environ.get("BENCH_FAKE_EMBEDDINGS", "false").lower() == "true":
+    ServerConfig.update_config(embed_model=HashEmbeddings())
+
+
+def prepare(documents, pages):
+    """Generates the corpus (unless queries.json exists) and runs the incremental ingestion."""
+    from corpus import generate_corpus
+    import pdfProcessor_chroma
+
+    if not os.path.exists(os.path.join("data", "queries.json")):
+        generate_corpus(os.path.join("data", "archive"), documents=documents, pages=pages)
+    pdfProcessor_chroma.process_pdfs_and_create_index()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prepares the work folder of the load test server.")
+    parser.add_argument("command", choices=["prepare"])
+    parser.add_argument("--documents", type=int, default=50)
+    parser.add_argument("--pages", type=int, default=5)
+    args = parser.parse_args()
+    prepare(args.documents, args.pages)
+elif __name__ != "__mp_main__":
+    # Not in the parser processes that the ingestion pipeline spawns while preparing
+    from main import app
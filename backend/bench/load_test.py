@@ -0,0 +1,211 @@
+"""
+Load test of the two-tier deployment: client -> local proxy (local/main.py) -> server (server/main.py).
+
+Starts the server (bench/fake_server.py: Groq replaced by a stub with configurable latency and token
+rate) and the local proxy with uvicorn, each with its own worker count, then runs N concurrent chat
+sessions against POST /chats/{chat_id} for every concurrency level. Each session sends its turns one
+after another, so the conversation history grows as in real use.
+
+Per level the report contains throughput, p50/p95/p99 latency, the error rate and where the time was
+spent: the server tier from the stage histograms of the server's /metrics (scraped before and after
+the level), the local tier (SQLite, HTTP hop) as the rest of the end-to-end latency. The metrics are
+kept per process, so the breakdown is only reported with a single server worker.
+
+Usage (from backend/):
+    python bench/load_test.py --concurrency 1,4,16,64 --turns 3 --server-workers 1 --local-workers 2 --fake-embeddings
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+METRIC_PATTERN = re.compile(r'^rag_stage_duration_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$')
+
+
+def start_process(args, cwd, env, log_path):
+    log = open(log_path, "w")
+    return subprocess.Popen(args, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_ready(url, process, timeout):
+    """Polls url until it answers with 200 (startup loads the models, which can take a while)."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process for {url} exited with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=5).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"{url} not ready after {timeout} s")
+
+
+def scrape_stages(server_url):
+    """Returns {stage: (sum seconds, count)} from the server's /metrics."""
+    stages = {}
+    for line in httpx.get(f"{server_url}/metrics", timeout=10).text.splitlines():
+        match = METRIC_PATTERN.match(line)
+        if match:
+            kind, stage, value = match.groups()
+            total, count = stages.get(stage, (0.0, 0))
+            stages[stage] = (total + float(value), count) if kind == "sum" else (total, count + int(float(value)))
+    return stages
+
+
+def stage_delta(before, after):
+    """Mean ms per observation for every stage observed between the two scrapes."""
+    delta = {}
+    for stage, (total, count) in after.items():
+        previous_total, previous_count = before.get(stage, (0.0, 0))
+        if count > previous_count:
+            delta[stage] = round((total - previous_total) * 1000 / (count - previous_count), 2)
+    return delta
+
+
+async def run_level(local_url, questions, sessions, turns, timeout):
+    latencies, errors = [], 0
+
+    async with httpx.AsyncClient(base_url=local_url, timeout=timeout, limits=httpx.Limits(max_connections=sessions)) as client:
+        async def session(number):
+            nonlocal errors
+            chat_id = f"load-{uuid.uuid4().hex[:12]}"
+            rng = random.Random(number)
+            for _ in range(turns):
+                started = time.perf_counter()
+                try:
+                    response = await client.post(f"/chats/{chat_id}", json={"sender": "User", "message": rng.choice(questions)})
+                    response.raise_for_status()
+                    # The proxy answers 200 with an error message when the server call failed
+                    if response.json()["message"].startswith("Error:"):
+                        raise RuntimeError(response.json()["message"])
+                except Exception as e:
+                    errors += 1
+                    print(f"Session {number}: {e}")
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(session(number) for number in range(sessions)))
+        wall = time.perf_counter() - started
+
+    return latencies, errors, wall
+
+
+def summarize(latencies, errors, wall, requests, server_stages):
+    latencies_ms = np.asarray(latencies) * 1000
+    report = {
+        "requests": requests,
+        "throughput_rps": len(latencies) / wall if wall else 0.0,
+        "error_rate": errors / requests if requests else 0.0,
+    }
+    if len(latencies_ms):
+        report.update({
+            "p50_ms": float(np.percentile(latencies_ms, 50)),
+            "p95_ms": float(np.percentile(latencies_ms, 95)),
+            "p99_ms": float(np.percentile(latencies_ms, 99)),
+            "mean_ms": float(latencies_ms.mean()),
+        })
+        server_ms = server_stages.get("total")
+        if server_ms is not None:
+            report["server_tier_ms"] = server_ms
+            report["local_tier_ms"] = round(report["mean_ms"] - server_ms, 2)
+    report["server_stages_ms"] = server_stages
+    return report
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Load test of the local proxy and the server.")
+    parser.add_argument("--workdir", default=None, help="Work folder (default: a new temporary folder)")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma separated numbers of concurrent sessions")
+    parser.add_argument("--turns", type=int, default=3, help="Messages per session")
+    parser.add_argument("--documents", type=int, default=50)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--server-port", type=int, default=8180)
+    parser.add_argument("--local-port", type=int, default=8181)
+    parser.add_argument("--server-workers", type=int, default=1)
+    parser.add_argument("--local-workers", type=int, default=1)
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=250)
+    parser.add_argument("--fake-embeddings", action="store_true", help="Use feature hashing instead of the embedding model")
+    parser.add_argument("--request-timeout", type=float, default=120)
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="rag-load-"))
+    local_workdir = os.path.join(workdir, "local")
+    os.makedirs(local_workdir, exist_ok=True)
+    server_url = f"http://127.0.0.1:{args.server_port}"
+    local_url = f"http://127.0.0.1:{args.local_port}"
+    print(f"Working in {workdir}")
+
+    env = {
+        **os.environ,
+        "BENCH_WORKDIR": workdir,
+        "BENCH_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "BENCH_LLM_TOKENS_PER_SECOND": str(args.llm_tokens_per_second),
+        "BENCH_FAKE_EMBEDDINGS": "true" if args.fake_embeddings else "false",
+        "SERVER_URL": server_url,
+    }
+    subprocess.run(
+        [sys.executable, os.path.join(BENCH_DIR, "fake_server.py"), "prepare", "--documents", str(args.documents), "--pages", str(args.pages)],
+        env=env, check=True,
+    )
+    with open(os.path.join(workdir, "data", "queries.json"), encoding="utf-8") as f:
+        questions = [query["question"] for query in json.load(f)]
+
+    uvicorn = [sys.executable, "-m", "uvicorn", "--host", "127.0.0.1", "--log-level", "warning"]
+    processes = []
+    try:
+        server = start_process(
+            uvicorn + ["fake_server:app", "--app-dir", BENCH_DIR, "--port", str(args.server_port), "--workers", str(args.server_workers)],
+            workdir, env, os.path.join(workdir, "server.log"),
+        )
+        processes.append(server)
+        wait_ready(f"{server_url}/config/models", server, args.startup_timeout)
+
+        # The proxy keeps its SQLite database in storage/ under the working directory
+        local = start_process(
+            uvicorn + ["main:app", "--app-dir", os.path.join(BACKEND_DIR, "local"), "--port", str(args.local_port), "--workers", str(args.local_workers)],
+            local_workdir, env, os.path.join(workdir, "local.log"),
+        )
+        processes.append(local)
+        wait_ready(f"{local_url}/chats", local, args.startup_timeout)
+
+        report = {"parameters": vars(args), "workdir": workdir, "levels": []}
+        for sessions in [int(level) for level in args.concurrency.split(",")]:
+            breakdown = args.server_workers == 1
+            before = scrape_stages(server_url) if breakdown else {}
+            latencies, errors, wall = asyncio.run(run_level(local_url, questions, sessions, args.turns, args.request_timeout))
+            server_stages = stage_delta(before, scrape_stages(server_url)) if breakdown else {}
+            level = {"sessions": sessions, **summarize(latencies, errors, wall, sessions * args.turns, server_stages)}
+            report["levels"].append(level)
+            print(json.dumps(level))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=30)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,271 @@
+"""
+Offline benchmark of the ingestion and retrieval pipeline.
+
+Generates a synthetic PDF corpus with known answers in a work folder, indexes it with pdfProcessor_chroma
+and pdfProcessor_faiss, and replays the generated questions through semantic_search and
+hybrid_similarity_search (on Chroma and on the server's FAISS store) and through the /query endpoint.
+Groq is replaced by a deterministic local stub (bench/fake_llm.py); with --fake-embeddings the
+embedding models are replaced by feature hashing as well, so the run needs no model downloads.
+
+Reports ingestion throughput, p50/p95/p99 latency, QPS under concurrency, memory, index sizes and
+recall@k (a query is a hit if one of the top_k chunks contains its answer). Every phase reports the
+resident memory after it (rss_mb) and its change during the phase (rss_delta_mb); the peak of the
+whole run is reported once (peak_rss_mb).
+
+Usage (from backend/):
+    python bench/run_benchmark.py --documents 200 --pages 5 --queries 200 --concurrency 8 --output report.json
+"""
+import os
+import gc
+import sys
+import json
+import time
+import pickle
+import asyncio
+import argparse
+import resource
+import tempfile
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+SERVER_DIR = os.path.join(BACKEND_DIR, "server")
+for path in (BENCH_DIR, SERVER_DIR, os.path.dirname(BACKEND_DIR)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from corpus import generate_corpus
+from fake_llm import FakeGroq, FakeAsyncGroq, HashEmbeddings
+
+
+def peak_rss_mb():
+    """Highest resident memory of the process so far (MB); it never goes down, so it is only reported for the whole run."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def rss_mb():
+    """Current resident memory of the process (MB), from psutil if installed, else from /proc/self/statm."""
+    gc.collect()
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2 ** 20
+    except ImportError:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def memory_report(rss_before):
+    """Resident memory after a phase and its change since rss_before (MB)."""
+    rss = rss_mb()
+    return {"rss_mb": round(rss, 1), "rss_delta_mb": round(rss - rss_before, 1)}
+
+
+def folder_size_mb(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total / 1e6
+
+
+def latency_summary(latencies_s):
+    latencies = np.asarray(latencies_s) * 1000
+    if not len(latencies):
+        return {}
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "mean_ms": float(latencies.mean()),
+    }
+
+
+def is_hit(query, contents):
+    return any(query["answer"] in content for content in contents)
+
+
+def bench_retriever(name, search, queries, concurrency):
+    """
+    Replays the queries sequentially (latency) and on a thread pool (QPS).
+
+    :param search: Callable question -> list of result dicts with "content".
+    """
+    rss_before = rss_mb()
+    latencies, hits = [], 0
+    for query in queries:
+        started = time.perf_counter()
+        results = search(query["question"])
+        latencies.append(time.perf_counter() - started)
+        hits += is_hit(query, [result["content"] for result in results])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda query: search(query["question"]), queries))
+    wall = time.perf_counter() - started
+
+    report = {**latency_summary(latencies), "qps": len(queries) / wall, "recall": hits / len(queries), **memory_report(rss_before)}
+    print(f"{name}: {json.dumps(report)}")
+    return report
+
+
+async def bench_endpoint(app, queries, concurrency, top_k):
+    """Sends the queries to POST /query with the given concurrency and collects latency, errors and stage timings."""
+    import httpx
+
+    rss_before = rss_mb()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, hits, errors, stage_totals = [], 0, 0, {}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=120) as client:
+        async def send(query):
+            nonlocal hits, errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.post("/query", json={"message": query["question"], "content": "", "top_k": top_k, "timings": True})
+                    response.raise_for_status()
+                except Exception as e:
+                    errors += 1
+                    print(f"Request failed: {e}")
+                    return
+                latencies.append(time.perf_counter() - started)
+                body = response.json()
+                hits += is_hit(query, body["content"])
+                for stage, ms in body.get("timings", {}).items():
+                    stage_totals[stage] = stage_totals.get(stage, 0.0) + ms
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(query) for query in queries))
+        wall = time.perf_counter() - started
+
+    answered = len(latencies)
+    report = {
+        **latency_summary(latencies),
+        "qps": answered / wall if wall else 0.0,
+        "recall": hits / len(queries),
+        "error_rate": errors / len(queries),
+        "mean_stage_ms": {stage: total / answered for stage, total in sorted(stage_totals.items())} if answered else {},
+        **memory_report(rss_before),
+    }
+    print(f"/query: {json.dumps(report)}")
+    return report
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Offline ingestion and retrieval benchmark.")
+    parser.add_argument("--workdir", default=None, help="Work folder (default: a new temporary folder)")
+    parser.add_argument("--documents", type=int, default=50)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=100, help="Number of queries replayed (at most 4 per document)")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--faiss-index-type", default="flat")
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=250)
+    parser.add_argument("--fake-embeddings", action="store_true", help="Use feature hashing instead of the embedding models")
+    parser.add_argument("--skip-faiss-ingestion", action="store_true")
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="rag-bench-"))
+    output = os.path.abspath(args.output) if args.output else None
+    report = {"parameters": vars(args), "workdir": workdir}
+    print(f"Working in {workdir}")
+
+    # The pipeline works with paths relative to the working directory
+    archive = os.path.join(workdir, "data", "archive")
+    queries = generate_corpus(archive, documents=args.documents, pages=args.pages)[:args.queries]
+    if not os.path.exists(os.path.join(workdir, "data", "input_pdf")):
+        os.symlink(archive, os.path.join(workdir, "data", "input_pdf"))
+    os.chdir(workdir)
+    os.environ.setdefault("LLM_API_KEY", "bench")
+    os.environ.setdefault("SEM_CHUNK_API_KEY", "bench")
+
+    started = time.perf_counter()
+    from config import ServerConfig
+    report["startup_seconds"] = time.perf_counter() - started
+    ServerConfig.update_config(
+        llm_model=FakeGroq(args.llm_latency_ms, args.llm_tokens_per_second),
+        async_llm_model=FakeAsyncGroq(args.llm_latency_ms, args.llm_tokens_per_second),
+    )
+    if args.fake_embeddings:
+        ServerConfig.update_config(embed_model=HashEmbeddings())
+
+    # Ingestion through the Chroma pipeline
+    import pdfProcessor_chroma
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    pdfProcessor_chroma.process_pdfs_and_create_index()
+    seconds = time.perf_counter() - started
+    chunks = ServerConfig.vectorstore._collection.count()
+    report["ingestion_chroma"] = {
+        "documents": args.documents, "chunks": chunks, "seconds": seconds,
+        "chunks_per_second": chunks / seconds if seconds else 0.0, **memory_report(rss_before),
+        "index_mb": folder_size_mb(os.path.join("data", "indexes", "chroma")),
+    }
+    print(f"Chroma ingestion: {json.dumps(report['ingestion_chroma'])}")
+
+    # Ingestion through the FAISS script
+    if not args.skip_faiss_ingestion:
+        try:
+            pdfProcessor_faiss = importlib.import_module("backend.src.pdfProcessor_faiss")
+            if args.fake_embeddings:
+                pdfProcessor_faiss.embedding_model = HashEmbeddings()
+            rss_before = rss_mb()
+            started = time.perf_counter()
+            pdfProcessor_faiss.process_pdfs_and_create_index()
+            seconds = time.perf_counter() - started
+            with open(pdfProcessor_faiss.METADATA_FILE, "rb") as f:
+                faiss_chunks = len(pickle.load(f))
+            report["ingestion_faiss"] = {
+                "chunks": faiss_chunks, "seconds": seconds,
+                "chunks_per_second": faiss_chunks / seconds if seconds else 0.0, **memory_report(rss_before),
+            }
+            print(f"FAISS ingestion: {json.dumps(report['ingestion_faiss'])}")
+        except Exception as e:
+            report["ingestion_faiss"] = {"error": str(e)}
+            print(f"FAISS ingestion skipped: {e}")
+
+    # Retrieval
+    from retrievers import semantic_search, hybrid_similarity_search
+    embed_model = ServerConfig.embed_model
+    vectorstore = ServerConfig.vectorstore
+    bm25_retriever = ServerConfig.bm25_retriever
+    top_k = args.top_k
+    retrievers = {
+        "chroma_semantic": lambda question: semantic_search(question, vectorstore, embed_model, top_k=top_k),
+        "chroma_hybrid": lambda question: hybrid_similarity_search(question, "", embed_model, vectorstore, bm25_retriever, top_k=top_k),
+    }
+    try:
+        from faiss_store import FaissVectorStore
+        faiss_path = os.path.join("data", "indexes", "faiss")
+        rss_before = rss_mb()
+        started = time.perf_counter()
+        FaissVectorStore.build_from_chroma(faiss_path, vectorstore, index_type=args.faiss_index_type)
+        seconds = time.perf_counter() - started
+        faiss_store = FaissVectorStore(faiss_path)
+        report["faiss_build"] = {"seconds": seconds, "index_mb": folder_size_mb(faiss_path), **memory_report(rss_before)}
+        retrievers["faiss_semantic"] = lambda question: semantic_search(question, faiss_store, embed_model, top_k=top_k)
+        retrievers["faiss_hybrid"] = lambda question: hybrid_similarity_search(question, "", embed_model, faiss_store, bm25_retriever, top_k=top_k)
+    except Exception as e:
+        report["faiss_build"] = {"error": str(e)}
+        print(f"FAISS store skipped: {e}")
+
+    report["retrieval"] = {name: bench_retriever(name, search, queries, args.concurrency) for name, search in retrievers.items()}
+
+    # End to end through the API (LLM stubbed)
+    import main as server_main
+    report["query_endpoint"] = asyncio.run(bench_endpoint(server_main.app, queries, args.concurrency, top_k))
+    report["rss_mb"] = round(rss_mb(), 1)
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {output}")
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,4 +1,16 @@
+import os
+
 class ModelConfig:
     """Stores and manages model configurations locally."""
-    server_url = "http://localhost:8080"
-    use_hybrid = False
\ No newline at end of file
+    server_url = os.environ.get("SERVER_URL", "http://localhost:8080")
+    use_hybrid = False
+
+    # Connection to the server
+    server_connect_timeout = float(os.environ.get("SERVER_CONNECT_TIMEOUT", 5))
+    server_read_timeout = float(os.environ.get("SERVER_READ_TIMEOUT", 120))
+    server_max_retries = int(os.environ.get("SERVER_MAX_RETRIES", 2))
+    server_retry_backoff = float(os.environ.get("SERVER_RETRY_BACKOFF", 0.5))
+    server_max_connections = int(os.environ.get("SERVER_MAX_CONNECTIONS", 100))
+    circuit_failure_threshold = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", 5))
+    circuit_reset_timeout = float(os.environ.get("CIRCUIT_RESET_TIMEOUT", 30))
+    model_config_refresh_seconds = float(os.environ.get("MODEL_CONFIG_REFRESH_SECONDS", 300))
@@ -1,6 +1,8 @@
-from sqlalchemy import Column, String, Text, Integer, DateTime, JSON, create_engine, ForeignKey
+from sqlalchemy import Column, String, Text, Integer, DateTime, JSON, create_engine, ForeignKey, Index, event, inspect, select, text
 from sqlalchemy.orm import declarative_base, sessionmaker
 import datetime
+import hashlib
+import json
 import os
 
 # Ensure storage folder exists
@@ -9,23 +11,163 @@ if not os.path.exists("storage"):
 
 # SQLite Database Connection
 DATABASE_URL = "sqlite:///storage/chat_database.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# cached_statements: size of the driver's per connection cache of prepared statements
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False, "cached_statements": 256})
+
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL lets the chat list be read while a message is written; NORMAL sync is safe with WAL."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
 
 Base = declarative_base()
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+# Chat session, one row per chat
+class Chat(Base):
+    __tablename__ = "chats"
+
+    id = Column(String, primary_key=True)  # Unique chat session ID
+    title = Column(String)  # Chat session title
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    last_activity = Column(DateTime, default=datetime.datetime.now, index=True)  # Orders the chat list
+
 # Chat Message Model
 class ChatMessage(Base):
     __tablename__ = "chat_history"
 
-    id = Column(Integer, primary_key=True, index=True)
-    chat_id = Column(String, index=True)  # Unique chat session ID
-    title = Column(String)  # Chat session title
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(String, ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
     sender = Column(String)  # "User" or "AI"
     message = Column(Text)
     sources = Column(Text, nullable=True)  # Store multiple sources as a JSON string
-    content = Column(Text, nullable=True)  # Store multiple retrieved paragraphs as JSON string
-    timestamp = Column(DateTime, default=datetime.datetime.now())
+    chunk_ids = Column(Text, nullable=True)  # IDs of the retrieved paragraphs (chunks table) as JSON string
+    timestamp = Column(DateTime, default=datetime.datetime.now)  # Evaluated per row
+
+    # Messages of a chat in order; the implicit rowid breaks ties between equal timestamps
+    __table_args__ = (Index("ix_chat_history_chat_id_timestamp", "chat_id", "timestamp"),)
+
+# Retrieved paragraph, stored once and referenced by the messages that cite it
+class Chunk(Base):
+    __tablename__ = "chunks"
+    # IDs of deleted chunks are never reused: clients cache the texts by ID (GET /chunks/{id} is immutable)
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = Column(Integer, primary_key=True)
+    digest = Column(String, unique=True, nullable=False)  # SHA-1 of the text
+    text = Column(Text)
+
+def store_chunks(db, texts):
+    """
+    Stores the texts that are not stored yet and returns the chunk IDs in the order of texts.
+    db can be a Session or a Connection.
+    """
+    if not texts:
+        return []
+    digests = [hashlib.sha1(text.encode("utf-8")).hexdigest() for text in texts]
+    db.execute(
+        Chunk.__table__.insert().prefix_with("OR IGNORE"),
+        [{"digest": digest, "text": text} for digest, text in zip(digests, texts)],
+    )
+    rows = db.execute(select(Chunk.id, Chunk.digest).where(Chunk.digest.in_(set(digests)))).all()
+    ids = {row.digest: row.id for row in rows}
+    return [ids[digest] for digest in digests]
+
+def delete_unreferenced_chunks(db):
+    """Deletes the chunks no message refers to anymore (e.g. after a chat was deleted)."""
+    db.execute(text("""
+        DELETE FROM chunks WHERE id NOT IN (
+            SELECT DISTINCT chunk.value FROM chat_history, json_each(chat_history.chunk_ids) AS chunk
+            WHERE chat_history.chunk_ids IS NOT NULL
+        )
+    """))
+
+def move_content_to_chunks(connection, source_table):
+    """Replaces the copied paragraphs of the content column of source_table by chunk IDs in chat_history."""
+    rows = connection.execute(text(f"SELECT id, content FROM {source_table} WHERE content IS NOT NULL")).all()
+    updates = [
+        {"id": row.id, "chunk_ids": json.dumps(store_chunks(connection, json.loads(row.content)))}
+        for row in rows
+    ]
+    if updates:
+        connection.execute(text("UPDATE chat_history SET chunk_ids = :chunk_ids WHERE id = :id"), updates)
+
+def rebuild_chunks(connection):
+    """Recreates the chunks table with AUTOINCREMENT, keeping the IDs."""
+    connection.execute(text("ALTER TABLE chunks RENAME TO chunks_v2"))
+    Chunk.__table__.create(bind=connection)
+    connection.execute(text("INSERT INTO chunks (id, digest, text) SELECT id, digest, text FROM chunks_v2"))
+    connection.execute(text("DROP TABLE chunks_v2"))
+
+SCHEMA_VERSION = 3
+
+def migrate(engine):
+    """
+    Creates the tables and migrates older databases, keeping their data.
+
+    Version 0 (no user_version) stored the chat title in every message row and had no chats table:
+    the chats are created from the messages (title of the first message, first and last timestamp)
+    and chat_history is rebuilt without the title column.
+    Version 1 copied the retrieved paragraphs into every AI message (content column): they are moved
+    to the chunks table and the messages keep their IDs.
+    Version 2 created the chunks table without AUTOINCREMENT, so SQLite reused the IDs of deleted
+    chunks: the table is recreated with it.
+    """
+    migrated = False
+    with engine.begin() as connection:
+        # pysqlite runs DDL outside of transactions, so the migration opens one explicitly
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+        version = connection.execute(text("PRAGMA user_version")).scalar()
+        existing = "chat_history" in inspect(connection).get_table_names()
+        legacy = version == 0 and existing
+        if legacy:
+            connection.execute(text("ALTER TABLE chat_history RENAME TO chat_history_v0"))
+            for index in ("ix_chat_history_chat_id", "ix_chat_history_id"):
+                connection.execute(text(f"DROP INDEX IF EXISTS {index}"))
+
+        if version == 1 and existing:
+            connection.execute(text("ALTER TABLE chat_history ADD COLUMN chunk_ids TEXT"))
+        if version == 2 and existing:
+            rebuild_chunks(connection)
+
+        Base.metadata.create_all(bind=connection)
+
+        if legacy:
+            connection.execute(text("""
+                INSERT INTO chats (id, title, created_at, last_activity)
+                SELECT chat_id,
+                       (SELECT title FROM chat_history_v0 AS first WHERE first.chat_id = messages.chat_id ORDER BY id LIMIT 1),
+                       MIN(timestamp), MAX(timestamp)
+                FROM chat_history_v0 AS messages
+                WHERE chat_id IS NOT NULL
+                GROUP BY chat_id
+            """))
+            connection.execute(text("""
+                INSERT INTO chat_history (id, chat_id, sender, message, sources, timestamp)
+                SELECT id, chat_id, sender, message, sources, timestamp
+                FROM chat_history_v0
+                WHERE chat_id IS NOT NULL
+            """))
+            move_content_to_chunks(connection, "chat_history_v0")
+            connection.execute(text("DROP TABLE chat_history_v0"))
+        elif version == 1 and existing:
+            move_content_to_chunks(connection, "chat_history")
+            connection.execute(text("ALTER TABLE chat_history DROP COLUMN content"))
+
+        if existing and version < SCHEMA_VERSION:
+            migrated = True
+            print(f"Migrated chat database from schema version {version} to {SCHEMA_VERSION}")
+
+        connection.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+
+    if migrated:
+        # Gives the pages of the replaced tables back (VACUUM cannot run inside the transaction)
+        with engine.connect() as connection:
+            connection.exec_driver_sql("VACUUM")
 
 # Create tables
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+migrate(engine)
@@ -1,18 +1,62 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query, Header, Response
+from fastapi.responses import StreamingResponse, JSONResponse
 from sqlalchemy.orm import Session
-import requests
-from database import SessionLocal, ChatMessage
+from sqlalchemy import tuple_
+from typing import Optional
+import httpx
+import asyncio
+import datetime
+import contextlib
+import hashlib
+from database import SessionLocal, Chat, ChatMessage, Chunk, store_chunks, delete_unreferenced_chunks
 import json
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from sqlalchemy.sql import func
 from config import ModelConfig
+from server_client import ServerClient, CircuitOpenError
 
 class MessageRequest(BaseModel):
     sender: str
     message: str
-    
-app = FastAPI()
+
+REMOTE_SERVER_URL = ModelConfig.server_url  # Change later on
+MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 500
+
+# One connection pool for all calls to the server
+server_client = ServerClient(
+    REMOTE_SERVER_URL,
+    connect_timeout=ModelConfig.server_connect_timeout,
+    read_timeout=ModelConfig.server_read_timeout,
+    max_retries=ModelConfig.server_max_retries,
+    backoff=ModelConfig.server_retry_backoff,
+    max_connections=ModelConfig.server_max_connections,
+    failure_threshold=ModelConfig.circuit_failure_threshold,
+    reset_timeout=ModelConfig.circuit_reset_timeout,
+)
+
+# Model settings of the server, refreshed in the background
+model_config = {}
+
+async def refresh_model_config():
+    """Fetches the model settings from the server now and then every model_config_refresh_seconds."""
+    global model_config
+    while True:
+        try:
+            model_config = await server_client.get("/config/models")
+            print("Using model:", model_config.get("llm_model"))
+        except (httpx.HTTPError, CircuitOpenError, ValueError) as e:
+            print("Error fetching model config:", e)
+        await asyncio.sleep(ModelConfig.model_config_refresh_seconds)
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    refresh_task = asyncio.create_task(refresh_model_config())
+    yield
+    refresh_task.cancel()
+    await server_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -22,8 +66,6 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
-REMOTE_SERVER_URL = ModelConfig.server_url  # Change later on
-
 # Get database session
 def get_db():
     db = SessionLocal()
@@ -32,99 +74,164 @@ def get_db():
     finally:
         db.close()
 
-def get_model_config():
-    """Fetch model settings from the server."""
-    try:
-        response = requests.get(f"{REMOTE_SERVER_URL}/config/models")
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print("Error fetching model config:", e)
-        return {}
-
-# Fetch model settings before making a request
-model_config = get_model_config()
-print("Using model:", model_config.get("llm_model"))
+# Connection state of the server client
+@app.get("/status")
+def get_status():
+    return {"server": server_client.stats(), "model_config": model_config}
 
 # Get all chat sessions
 @app.get("/chats")
 def get_chats(db: Session = Depends(get_db)):
-    subquery = (
-        db.query(ChatMessage.chat_id, ChatMessage.timestamp)
-        .order_by(func.max(ChatMessage.timestamp).desc())
-        .distinct(ChatMessage.chat_id)
-        .subquery()
-    )
-    
-    chats = (
-        db.query(ChatMessage.chat_id, ChatMessage.title)
-        .join(subquery, ChatMessage.chat_id == subquery.c.chat_id)
-        .order_by(subquery.c.timestamp.desc())
-        .distinct()
-        .all()
-    )
-    
+    # One row per chat, read in the order of the last_activity index
+    chats = db.query(Chat.id, Chat.title).order_by(Chat.last_activity.desc()).all()
+
     # Convert list of tuples to structured JSON
-    chat_list = [{"id": chat.chat_id, "title": chat.title or "Untitled Chat"} for chat in chats]
-    
-    return chat_list if chat_list else []
+    return [{"id": chat.id, "title": chat.title or "Untitled Chat"} for chat in chats]
 
 # Get messages from a chat
 @app.get("/chats/{chat_id}")
-def get_chat(chat_id: str, db: Session = Depends(get_db)):
-    messages = db.query(ChatMessage).filter(ChatMessage.chat_id == chat_id).order_by(ChatMessage.timestamp).all()
+def get_chat(
+    chat_id: str,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: int = Query(MESSAGE_PAGE_SIZE, ge=1, le=MAX_MESSAGE_PAGE_SIZE),
+    include_content: bool = False,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """
+    Returns a page of messages, oldest first: the newest limit messages, or the ones before/after the
+    message with the given ID (the IDs of the first and last message are the cursors to page further).
+    The retrieved paragraphs are only included with include_content, otherwise messages carry their
+    chunk_ids (text at GET /chunks/{chunk_id}).
+    The ETag changes with every new message or title change, so a client can poll with If-None-Match.
+    """
+    chat = db.get(Chat, chat_id)
+    if chat is None:
+        return []
+
+    etag = 'W/"' + hashlib.sha1(f"{chat.title}|{chat.last_activity}|{before}|{after}|{limit}|{include_content}".encode("utf-8")).hexdigest() + '"'
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    # Keyset pagination in the order of the (chat_id, timestamp) index; the ID breaks ties
+    order_key = tuple_(ChatMessage.timestamp, ChatMessage.id)
+    query = db.query(ChatMessage).filter(ChatMessage.chat_id == chat_id)
+    for cursor, newer in ((after, True), (before, False)):
+        if cursor is None:
+            continue
+        anchor = db.query(ChatMessage.timestamp, ChatMessage.id).filter(ChatMessage.id == cursor, ChatMessage.chat_id == chat_id).first()
+        if anchor is None:
+            raise HTTPException(status_code=404, detail="Message not found")
+        query = query.filter(order_key > tuple_(*anchor) if newer else order_key < tuple_(*anchor))
 
-    return [
-        {   
-            "title": msg.title,
+    if after is not None:
+        messages = query.order_by(ChatMessage.timestamp, ChatMessage.id).limit(limit).all()
+    else:
+        messages = query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(limit).all()[::-1]
+
+    chunk_ids = {msg.id: json.loads(msg.chunk_ids) if msg.chunk_ids else [] for msg in messages}
+    if include_content:
+        wanted = {chunk_id for ids in chunk_ids.values() for chunk_id in ids}
+        texts = dict(db.query(Chunk.id, Chunk.text).filter(Chunk.id.in_(wanted)).all()) if wanted else {}
+
+    page = []
+    for msg in messages:
+        item = {
+            "id": msg.id,
+            "title": chat.title,
             "sender": msg.sender,
             "message": msg.message,
             "sources": json.loads(msg.sources) if msg.sources else [],
-            "content": json.loads(msg.content) if msg.content else []
+            "chunk_ids": chunk_ids[msg.id],
         }
-        for msg in messages
-    ]
+        if include_content:
+            item["content"] = [texts.get(chunk_id, "") for chunk_id in chunk_ids[msg.id]]
+        page.append(item)
 
-# Send message & forward to remote API
-@app.post("/chats/{chat_id}")
-def send_message(chat_id: str, request: MessageRequest, db: Session = Depends(get_db)):
-    sender = request.sender
-    message = request.message
+    return JSONResponse(page, headers={"ETag": etag})
+
+# Get a retrieved paragraph
+@app.get("/chunks/{chunk_id}")
+def get_chunk(chunk_id: int, db: Session = Depends(get_db)):
+    chunk = db.get(Chunk, chunk_id)
+    if chunk is None:
+        raise HTTPException(status_code=404, detail="Chunk not found")
+    # Chunks never change, clients may cache them
+    return JSONResponse({"id": chunk.id, "text": chunk.text}, headers={"Cache-Control": "private, max-age=31536000, immutable"})
 
-    # Check if there are existing messages for the chat ID
-    existing_messages = db.query(ChatMessage).filter(ChatMessage.chat_id == chat_id).all()
+def recent_messages(chat_id: str, db: Session, limit: int = 4):
+    """The last messages of a chat, oldest first (reads only these rows through the (chat_id, timestamp) index)."""
+    rows = (
+        db.query(ChatMessage.message)
+        .filter(ChatMessage.chat_id == chat_id)
+        .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+        .limit(limit)
+        .all()
+    )
+    return [row.message for row in reversed(rows)]
 
-    if existing_messages:
-        # Use the title of the first message in the chat history
-        title = existing_messages[0].title
-        chat_content = " ".join([msg.message for msg in existing_messages[-4:]]) if len(existing_messages) >= 4 else " ".join([msg.message for msg in existing_messages])
+def save_user_message(chat_id: str, sender: str, message: str, db: Session):
+    """Stores the user message and returns the recent chat content for the query."""
+    chat = db.get(Chat, chat_id)
+
+    if chat is not None:
+        chat_content = " ".join(recent_messages(chat_id, db))
     else:
         # Set the title using the first three words of the new message
         try:
             title = " ".join(message.split(" ")[:3])
         except:
             title = message
+        chat = Chat(id=chat_id, title=title)
+        db.add(chat)
         
         chat_content = ""    
         
     # Save user message
-    new_message = ChatMessage(chat_id=chat_id, title=title, sender=sender, message=message)
-    db.add(new_message)
+    now = datetime.datetime.now()
+    chat.last_activity = now
+    db.add(ChatMessage(chat_id=chat_id, sender=sender, message=message, timestamp=now))
     db.commit()
     print("ID: " + chat_id)
-    print("title: " + title)
+    print("title: " + chat.title)
     print("sender: " + sender)
     print("message: " + message)
     print("chat_content: " + chat_content)
 
+    return chat_content
+
+def save_ai_message(chat_id: str, ai_message: str, retrieved_sources, retrieved_content, db: Session):
+    # Store AI response with sources
+    now = datetime.datetime.now()
+    ai_response = ChatMessage(
+        chat_id=chat_id,
+        sender="AI",
+        message=ai_message,
+        sources=json.dumps(retrieved_sources),  # Store as JSON string
+        chunk_ids=json.dumps(store_chunks(db, retrieved_content)),  # Paragraphs are stored once, by ID
+        timestamp=now,
+    )
+    db.add(ai_response)
+    db.query(Chat).filter(Chat.id == chat_id).update({"last_activity": now})
+    db.commit()
+    return ai_response.id
+
+# Send message & forward to remote API
+@app.post("/chats/{chat_id}")
+async def send_message(chat_id: str, request: MessageRequest, db: Session = Depends(get_db)):
+    sender = request.sender
+    message = request.message
+
+    # The database calls are blocking, they run in a thread so the event loop keeps serving other requests
+    chat_content = await asyncio.to_thread(save_user_message, chat_id, sender, message, db)
+
     # Call unified API (retrieves relevant files & generates AI response)
     try:
-        response = requests.post(
-            f"{REMOTE_SERVER_URL}/query",
+        data = await server_client.post(
+            "/query",
             json={"chat_id": chat_id, "message": message, "content": chat_content}
         )
-        response.raise_for_status()
-        data = response.json()  # Ensure response is valid JSON
         
         ai_message = data.get("response", "Error: No response from AI.")
         retrieved_sources = data.get("sources", [])
@@ -132,32 +239,82 @@ def send_message(chat_id: str, request: MessageRequest, db: Session = Depends(ge
 
         if isinstance(ai_message, list):
             ai_message = " ".join(ai_message)
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, CircuitOpenError, ValueError) as e:  # ValueError: response is not valid JSON
         print(f"Error calling API: {e}")
         ai_message = "Error: LLM service unavailable."
         retrieved_sources = []
         retrieved_content = []
 
-    # Store AI response with sources
-    ai_response = ChatMessage(
-        chat_id=chat_id,
-        title=title,
-        sender="AI",
-        message=ai_message,
-        sources=json.dumps(retrieved_sources),  # Store as JSON string
-        content=json.dumps(retrieved_content)   # Store as JSON string
-    )
-    db.add(ai_response)
-    db.commit()
+    message_id = await asyncio.to_thread(save_ai_message, chat_id, ai_message, retrieved_sources, retrieved_content, db)
+
+    return {"id": message_id, "sender": "AI", "message": ai_message, "sources": retrieved_sources, "content": retrieved_content}
 
-    return {"sender": "AI", "message": ai_message, "sources": retrieved_sources, "content": retrieved_content}
+# Send message & stream the AI response from the remote API
+@app.post("/chats/{chat_id}/stream")
+async def send_message_stream(chat_id: str, request: MessageRequest, db: Session = Depends(get_db)):
+    """
+    Forwards the newline-delimited JSON events of the server's /query/stream endpoint to the client
+    as they arrive, and stores the assembled AI message once the stream ends (also when the client
+    disconnects: the part of the answer that has arrived is kept).
+    """
+    chat_content = await asyncio.to_thread(save_user_message, chat_id, request.sender, request.message, db)
+
+    # The request's session is closed once the response starts, so the stream uses its own
+    def save(ai_message, retrieved_sources, retrieved_content):
+        stream_db = SessionLocal()
+        try:
+            save_ai_message(chat_id, ai_message, retrieved_sources, retrieved_content, stream_db)
+        finally:
+            stream_db.close()
+
+    async def event_stream():
+        tokens = []
+        retrieved_sources = []
+        retrieved_content = []
+        ai_message = None
+        try:
+            async with server_client.stream(
+                "/query/stream",
+                json={"chat_id": chat_id, "message": request.message, "content": chat_content},
+            ) as response:
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        print(f"Skipping malformed event from the server: {line!r}")
+                        continue
+                    if event.get("type") == "sources":
+                        retrieved_sources = event.get("sources", [])
+                        retrieved_content = event.get("content", [])
+                    elif event.get("type") == "token":
+                        tokens.append(event.get("token", ""))
+                    yield line + "\n"
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            print(f"Error calling API: {e}")
+            ai_message = "Error: LLM service unavailable."
+            yield json.dumps({"type": "error", "error": ai_message}) + "\n"
+        finally:
+            if ai_message is None:
+                ai_message = "".join(tokens) or "Error: No response from AI."
+            # Shielded, so the message is stored even when the disconnect cancels the stream
+            await asyncio.shield(asyncio.to_thread(save, ai_message, retrieved_sources, retrieved_content))
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.delete("/chats/{chat_id}")
 async def delete_chat(chat_id: str, db: Session = Depends(get_db)):
     # print({chat_id})
-    deleted_rows = db.query(ChatMessage).filter(ChatMessage.chat_id == chat_id).delete(synchronize_session=False)
+    db.query(ChatMessage).filter(ChatMessage.chat_id == chat_id).delete(synchronize_session=False)
+    deleted_rows = db.query(Chat).filter(Chat.id == chat_id).delete(synchronize_session=False)
     if deleted_rows == 0:
         raise HTTPException(status_code=404, detail="Chat not found")
+    delete_unreferenced_chunks(db)
     
     db.commit()
     return {"message": "Chat deleted successfully"}
@@ -165,7 +322,7 @@ async def delete_chat(chat_id: str, db: Session = Depends(get_db)):
 @app.put("/chats/{chat_id}/{title}")
 async def update_chat_title(chat_id: str, title: str, db: Session = Depends(get_db)):
     print(chat_id)
-    db.query(ChatMessage).filter(ChatMessage.chat_id == chat_id).update({"title": title})
+    db.query(Chat).filter(Chat.id == chat_id).update({"title": title})
     db.commit()
 
     return {"message": "Title updated successfully"}
\ No newline at end of file
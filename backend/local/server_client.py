@@ -0,0 +1,165 @@
+import time
+import random
+import asyncio
+import contextlib
+import httpx
+
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Responses that are worth retrying: the server is restarting or overloaded
+RETRY_STATUS_CODES = (502, 503, 504)
+# Other requests (POST /query runs the LLM) are only retried when they cannot have reached the server
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the server while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a failing server: after failure_threshold consecutive failures the circuit opens and
+    calls fail immediately for reset_timeout seconds. Then a single trial call is let through (half open);
+    its success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_running = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def end_trial(self):
+        """Lets the next call through as trial when the trial ended without a result (e.g. it was cancelled)."""
+        self.trial_running = False
+
+
+class ServerClient:
+    """
+    Shared async client for the remote server: one keep-alive connection pool (HTTP/2 if the h2 package
+    is installed), connect and read timeouts, bounded retries with exponential backoff and jitter for
+    502/503/504 and transport errors, and a circuit breaker around all of it. Non-idempotent requests
+    are only retried after errors that happen before the request is sent (connect, pool timeout).
+    """
+
+    def __init__(self, base_url, connect_timeout=5.0, read_timeout=120.0, max_retries=2, backoff=0.5,
+                 max_connections=100, failure_threshold=5, reset_timeout=30.0):
+        self.base_url = base_url
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._client = None
+
+    @property
+    def client(self):
+        # Created on first use, so that it belongs to the running event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=self.limits, http2=HTTP2_AVAILABLE)
+        return self._client
+
+    async def _backoff(self, attempt):
+        delay = self.backoff * 2 ** attempt
+        await asyncio.sleep(delay + random.uniform(0, delay / 2))
+
+    async def _send(self, request, stream=False):
+        """Sends the request with retries; returns the response or raises the last error."""
+        trial = self.breaker.state == "half_open"
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {self.base_url}")
+        try:
+            return await self._send_with_retries(request, stream)
+        finally:
+            if trial:
+                self.breaker.end_trial()
+
+    async def _send_with_retries(self, request, stream):
+        idempotent = request.method in IDEMPOTENT_METHODS
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.client.send(request, stream=stream)
+                if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                    await response.aclose()
+                    await self._backoff(attempt)
+                    continue
+                response.raise_for_status()
+            except httpx.HTTPStatusError:
+                await response.aclose()
+                # Client errors say nothing about the health of the server
+                if response.status_code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                raise
+            except httpx.TransportError as e:
+                if attempt < self.max_retries and (idempotent or isinstance(e, UNSENT_ERRORS)):
+                    print(f"Request to {request.url} failed ({e!r}), retrying")
+                    await self._backoff(attempt)
+                    continue
+                self.breaker.record_failure()
+                raise
+            self.breaker.record_success()
+            return response
+
+    async def get(self, path, **kwargs):
+        response = await self._send(self.client.build_request("GET", path, **kwargs))
+        return response.json()
+
+    async def post(self, path, json=None):
+        response = await self._send(self.client.build_request("POST", path, json=json))
+        return response.json()
+
+    @contextlib.asynccontextmanager
+    async def stream(self, path, json=None):
+        """
+        POSTs and yields the streamed response. Only establishing the stream is retried; errors while
+        reading it are raised to the caller.
+        """
+        response = await self._send(self.client.build_request("POST", path, json=json), stream=True)
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    def stats(self):
+        return {"http2": HTTP2_AVAILABLE, "circuit": self.breaker.state, "consecutive_failures": self.breaker.failures}
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
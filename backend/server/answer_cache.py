@@ -0,0 +1,172 @@
+import os
+import json
+import hashlib
+import time
+import sqlite3
+import threading
+import numpy as np
+
+
+class AnswerCache:
+    """
+    Persistent semantic cache of LLM answers.
+
+    An answer is reused when the embedding of the (refined) question is within a cosine threshold of a
+    previously answered question, the same chunks were retrieved and the question language and the chat
+    history (for questions that are searched without being refined) match.
+    Entries are stored in SQLite; the question embeddings are kept in memory as one normalized matrix,
+    so a lookup is a single matrix-vector product. Entries are evicted least-recently-used once
+    max_entries is exceeded and are dropped when the document index changes.
+    """
+
+    def __init__(self, path, threshold=0.95, max_entries=5000):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                question TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                chunk_ids TEXT NOT NULL,
+                language TEXT,
+                history TEXT NOT NULL DEFAULT '',
+                index_version INTEGER NOT NULL,
+                response TEXT NOT NULL,
+                sources TEXT NOT NULL,
+                content TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(answers)")]
+        if "history" not in columns:
+            # Caches created before the history was part of the key
+            self.conn.execute("ALTER TABLE answers ADD COLUMN history TEXT NOT NULL DEFAULT ''")
+        self.conn.commit()
+        self._index_version = None
+        self._load()
+
+    def _load(self):
+        rows = self.conn.execute("SELECT id, embedding FROM answers ORDER BY id").fetchall()
+        self._ids = np.array([row[0] for row in rows], dtype=np.int64)
+        if rows:
+            self._matrix = np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+        else:
+            self._matrix = np.zeros((0, 0), dtype=np.float32)
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _chunk_key(chunk_ids):
+        return json.dumps(sorted(chunk_ids))
+
+    @staticmethod
+    def history_key(conversation_history):
+        """Hash of the chat history ("" without history), for questions whose answer depends on it."""
+        history = " ".join(str(conversation_history or "").split())
+        return hashlib.sha1(history.encode("utf-8")).hexdigest() if history else ""
+
+    def _drop_stale(self, index_version):
+        """Removes the answers that were generated on an older version of the document index."""
+        if index_version == self._index_version:
+            return
+        deleted = self.conn.execute("DELETE FROM answers WHERE index_version != ?", (index_version,)).rowcount
+        self.conn.commit()
+        if deleted:
+            self._load()
+        self._index_version = index_version
+
+    def lookup(self, embedding, chunk_ids, language, index_version, history=""):
+        """
+        Returns the cached answer ({"response", "sources", "content"}) for a near-duplicate question, or None.
+
+        :param embedding: Embedding of the (refined) question.
+        :param chunk_ids: IDs of the retrieved chunks.
+        :param language: Detected language of the question.
+        :param index_version: Current version of the document index.
+        :param history: history_key of the chat history, or "" if the answer does not depend on it.
+        """
+        with self._lock:
+            self._drop_stale(index_version)
+            if not len(self._ids):
+                self.misses += 1
+                return None
+
+            scores = self._matrix @ self._normalize(embedding)
+            candidates = np.flatnonzero(scores >= self.threshold)
+            chunk_key = self._chunk_key(chunk_ids)
+            for row in candidates[np.argsort(-scores[candidates])]:
+                answer_id = int(self._ids[row])
+                entry = self.conn.execute(
+                    "SELECT chunk_ids, language, history, response, sources, content FROM answers WHERE id = ?", (answer_id,)
+                ).fetchone()
+                if entry is None or entry[0] != chunk_key or entry[1] != language or entry[2] != history:
+                    continue
+                self.conn.execute("UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), answer_id))
+                self.conn.commit()
+                self.hits += 1
+                return {"response": entry[3], "sources": json.loads(entry[4]), "content": json.loads(entry[5])}
+
+            self.misses += 1
+            return None
+
+    def store(self, question, embedding, chunk_ids, language, index_version, response, sources, content, history=""):
+        """Stores an answer and evicts the least recently used answers beyond max_entries."""
+        vector = self._normalize(embedding)
+        with self._lock:
+            self._drop_stale(index_version)
+            cursor = self.conn.execute(
+                "INSERT INTO answers (question, embedding, chunk_ids, language, history, index_version, response, sources, content, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    question, vector.tobytes(), self._chunk_key(chunk_ids), language, history, index_version,
+                    response, json.dumps(sources), json.dumps(content), time.time(),
+                ),
+            )
+            self.stores += 1
+
+            overflow = self.conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self.conn.execute(
+                    "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_used LIMIT ?)", (overflow,)
+                )
+                self.evictions += overflow
+                self.conn.commit()
+                self._load()
+                return
+
+            self.conn.commit()
+            self._ids = np.append(self._ids, cursor.lastrowid)
+            self._matrix = np.vstack([self._matrix, vector[None, :]]) if self._matrix.size else vector[None, :]
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute("DELETE FROM answers")
+            self.conn.commit()
+            self._load()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": int(len(self._ids)),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,323 @@
+import os
+import re
+import json
+import threading
+from collections import Counter
+from functools import lru_cache
+import numpy as np
+from scipy import sparse
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    """Lower-cases the text and splits it into word tokens."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Persisted BM25 inverted index over the chunks stored in the vectorstore.
+
+    The term frequencies are kept as a sparse (documents x terms) matrix, so a query is scored with one
+    sparse matrix-vector product instead of a Python loop over all documents. Chunks are identified by
+    the same IDs as in Chroma, which allows the index to be updated incrementally and fused with vector results.
+    """
+
+    TERM_FREQS_FILE = "term_freqs.npz"
+    ALIVE_FILE = "alive.npy"
+    META_FILE = "meta.json"
+
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.vocabulary = {}  # term -> column
+        self.ids = []  # row -> chunk ID
+        self.sources = []  # row -> source file
+        self.row_of = {}  # chunk ID -> row
+        self.alive = np.zeros(0, dtype=bool)  # False for deleted/replaced rows
+        self.term_freqs = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self._weights = None
+        self._idf = None
+        self._loaded_mtime = None
+        self._lock = threading.RLock()
+        # Query string -> (columns, counts); cleared whenever the vocabulary changes
+        self._query_terms = lru_cache(maxsize=4096)(self._lookup_query_terms)
+
+    def __len__(self):
+        return len(self.row_of)
+
+    # ------------------------------------------------------------------ updates
+
+    def add_documents(self, ids, texts, metadatas=None):
+        """
+        Adds (or replaces) chunks in the index. Only the given texts are tokenized.
+
+        :param ids: Chunk IDs (the same IDs as in the vectorstore).
+        :param texts: Chunk texts.
+        :param metadatas: Optional list of metadata dicts (used for the source).
+        """
+        metadatas = metadatas or [{}] * len(ids)
+        rows, cols, values = [], [], []
+        with self._lock:
+            first_row = len(self.ids)
+            for offset, (doc_id, text, meta) in enumerate(zip(ids, texts, metadatas)):
+                if doc_id in self.row_of:
+                    self.alive[self.row_of[doc_id]] = False
+                row = first_row + offset
+                self.row_of[doc_id] = row
+                self.ids.append(doc_id)
+                self.sources.append((meta or {}).get("source", "unknown"))
+                for term, count in Counter(tokenize(text or "")).items():
+                    col = self.vocabulary.setdefault(term, len(self.vocabulary))
+                    rows.append(offset)
+                    cols.append(col)
+                    values.append(count)
+
+            new_rows = sparse.csr_matrix(
+                (np.asarray(values, dtype=np.float32), (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))),
+                shape=(len(ids), len(self.vocabulary)),
+            )
+            existing = self.term_freqs
+            existing.resize((existing.shape[0], len(self.vocabulary)))
+            self.term_freqs = sparse.vstack([existing, new_rows], format="csr")
+            self.alive = np.concatenate([self.alive, np.ones(len(ids), dtype=bool)])
+            self._invalidate()
+
+    def delete(self, ids):
+        """Removes chunks from the index. The rows are masked and reclaimed on compaction."""
+        with self._lock:
+            for doc_id in ids:
+                row = self.row_of.pop(doc_id, None)
+                if row is not None:
+                    self.alive[row] = False
+            self._invalidate()
+
+    def dead_ratio(self):
+        """Fraction of rows that belong to deleted or replaced chunks."""
+        return 1.0 - len(self.row_of) / len(self.ids) if self.ids else 0.0
+
+    def compact(self):
+        """Drops the rows of deleted chunks and the terms that no longer occur."""
+        with self._lock:
+            keep = np.flatnonzero(self.alive)
+            term_freqs = self.term_freqs[keep]
+            used = np.unique(term_freqs.indices)
+            terms = [None] * len(self.vocabulary)
+            for term, col in self.vocabulary.items():
+                terms[col] = term
+
+            self.term_freqs = term_freqs[:, used].tocsr()
+            self.vocabulary = {terms[col]: new_col for new_col, col in enumerate(used)}
+            self.ids = [self.ids[row] for row in keep]
+            self.sources = [self.sources[row] for row in keep]
+            self.row_of = {doc_id: row for row, doc_id in enumerate(self.ids)}
+            self.alive = np.ones(len(self.ids), dtype=bool)
+            self._invalidate()
+
+    def _invalidate(self):
+        self._weights = None
+        self._idf = None
+        self._query_terms.cache_clear()
+
+    def _prepare(self):
+        """Computes the idf vector and the BM25 term weight matrix for the live documents."""
+        with self._lock:
+            if self._weights is not None:
+                return
+            tf = sparse.diags(self.alive.astype(np.float32)) @ self.term_freqs
+            tf.eliminate_zeros()
+            tf = tf.tocsr()
+            n_docs = int(self.alive.sum())
+            doc_len = np.asarray(tf.sum(axis=1)).ravel()
+            avgdl = doc_len[self.alive].mean() if n_docs else 1.0
+            avgdl = avgdl or 1.0
+
+            df = np.bincount(tf.indices, minlength=tf.shape[1]).astype(np.float32)
+            self._idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+            norm = self.k1 * (1.0 - self.b + self.b * doc_len / avgdl)
+            rows = np.repeat(np.arange(tf.shape[0]), np.diff(tf.indptr))
+            weights = tf.copy()
+            weights.data = (tf.data * (self.k1 + 1.0) / (tf.data + norm[rows])).astype(np.float32)
+            self._weights = weights.tocsc()
+
+    # ------------------------------------------------------------------ search
+
+    def _lookup_query_terms(self, query):
+        terms = [self.vocabulary[t] for t in tokenize(query) if t in self.vocabulary]
+        if not terms:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        cols, counts = np.unique(terms, return_counts=True)
+        return cols, counts.astype(np.float32)
+
+    def _snapshot(self, queries):
+        """
+        Returns the term weights, idf, ids and sources together with the query terms, all taken under the
+        lock. A concurrent reload or update replaces these attributes, so the scoring works on the snapshot
+        and never mixes two versions of the index.
+        """
+        self.reload_if_stale()
+        with self._lock:
+            self._prepare()
+            return self._weights, self._idf, self.ids, self.sources, [self._query_terms(query) for query in queries]
+
+    def get_scores(self, query):
+        """
+        Scores all documents for the query.
+
+        :param query: The query string.
+        :return: numpy array with one BM25 score per row (0 for deleted rows).
+        """
+        weights, idf, _, _, [(cols, counts)] = self._snapshot([query])
+        return self._score(weights, idf, cols, counts)
+
+    @staticmethod
+    def _score(weights, idf, cols, counts):
+        if not len(cols):
+            return np.zeros(weights.shape[0], dtype=np.float32)
+        return weights[:, cols] @ (idf[cols] * counts)
+
+    def get_scores_batch(self, queries):
+        """
+        Scores all documents for several queries with one sparse matrix product.
+
+        :param queries: List of query strings.
+        :return: numpy array of shape (documents, queries).
+        """
+        weights, idf, _, _, query_terms = self._snapshot(queries)
+        return self._score_batch(weights, idf, query_terms)
+
+    @staticmethod
+    def _score_batch(weights, idf, query_terms):
+        rows, cols, values = [], [], []
+        for q, (terms, counts) in enumerate(query_terms):
+            rows.extend(terms)
+            cols.extend([q] * len(terms))
+            values.extend(idf[terms] * counts)
+        query_matrix = sparse.csc_matrix(
+            (np.asarray(values, dtype=np.float32), (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))),
+            shape=(weights.shape[1], len(query_terms)),
+        )
+        return np.asarray((weights @ query_matrix).todense())
+
+    @staticmethod
+    def _top_k(scores, top_k, ids, sources):
+        """Selects the top_k positive scores with a partial sort (O(N) instead of O(N log N))."""
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > top_k:
+            part = np.argpartition(-scores[candidates], top_k - 1)[:top_k]
+            candidates = candidates[part]
+        best = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(ids[i], float(scores[i]), sources[i]) for i in best]
+
+    def search(self, query, top_k=5):
+        """
+        Returns the best matching chunks for the query.
+
+        :param query: The query string.
+        :param top_k: Number of results.
+        :return: List of (chunk ID, score, source) tuples, best first.
+        """
+        weights, idf, ids, sources, [(cols, counts)] = self._snapshot([query])
+        return self._top_k(self._score(weights, idf, cols, counts), top_k, ids, sources)
+
+    def search_batch(self, queries, top_k=5):
+        """
+        Returns the best matching chunks for several queries, scored in one matrix product.
+
+        :param queries: List of query strings.
+        :param top_k: Number of results per query.
+        :return: One list of (chunk ID, score, source) tuples per query.
+        """
+        if not queries:
+            return []
+        weights, idf, ids, sources, query_terms = self._snapshot(queries)
+        scores = self._score_batch(weights, idf, query_terms)
+        return [self._top_k(scores[:, q], top_k, ids, sources) for q in range(len(queries))]
+
+    # ------------------------------------------------------------------ persistence
+
+    def _meta_path(self):
+        return os.path.join(self.path, self.META_FILE)
+
+    def save(self):
+        """Writes the index to disk. Files are replaced atomically so readers never see a partial index."""
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            terms = [None] * len(self.vocabulary)
+            for term, col in self.vocabulary.items():
+                terms[col] = term
+
+            tmp = os.path.join(self.path, "tmp_" + self.TERM_FREQS_FILE)
+            sparse.save_npz(tmp, self.term_freqs)
+            os.replace(tmp, os.path.join(self.path, self.TERM_FREQS_FILE))
+
+            tmp = os.path.join(self.path, "tmp_" + self.ALIVE_FILE)
+            np.save(tmp, self.alive)
+            os.replace(tmp, os.path.join(self.path, self.ALIVE_FILE))
+
+            # The metadata file is written last and marks the index as complete
+            tmp = self._meta_path() + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"k1": self.k1, "b": self.b, "terms": terms, "ids": self.ids, "sources": self.sources}, f)
+            os.replace(tmp, self._meta_path())
+            self._loaded_mtime = os.path.getmtime(self._meta_path())
+
+    def _read(self):
+        with open(self._meta_path(), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.k1 = meta["k1"]
+        self.b = meta["b"]
+        self.vocabulary = {term: col for col, term in enumerate(meta["terms"])}
+        self.ids = meta["ids"]
+        self.sources = meta["sources"]
+        self.term_freqs = sparse.load_npz(os.path.join(self.path, self.TERM_FREQS_FILE)).tocsr()
+        self.alive = np.load(os.path.join(self.path, self.ALIVE_FILE))
+        self.row_of = {doc_id: row for row, doc_id in enumerate(self.ids) if self.alive[row]}
+        self._loaded_mtime = os.path.getmtime(self._meta_path())
+        self._invalidate()
+
+    def reload_if_stale(self):
+        """Reloads the index if another process (e.g. the PDF processor) has saved a newer version."""
+        try:
+            mtime = os.path.getmtime(self._meta_path())
+        except OSError:
+            return
+        if self._loaded_mtime is not None and mtime <= self._loaded_mtime:
+            return
+        with self._lock:
+            if self._loaded_mtime is None or mtime > self._loaded_mtime:
+                self._read()
+
+    @classmethod
+    def load(cls, path):
+        """Loads the index from disk, or returns an empty index if none was saved yet."""
+        index = cls(path)
+        if os.path.exists(index._meta_path()):
+            index._read()
+        return index
+
+    @classmethod
+    def load_or_build(cls, path, vectorstore, batch_size=5000):
+        """
+        Loads the persisted index. Only if there is none yet, it is built once from the chunks
+        in the vectorstore and saved, so later startups do not tokenize the corpus again.
+        """
+        index = cls.load(path)
+        if os.path.exists(index._meta_path()):
+            return index
+
+        offset = 0
+        while True:
+            batch = vectorstore.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+            if not batch["ids"]:
+                break
+            index.add_documents(batch["ids"], batch["documents"], batch["metadatas"])
+            offset += len(batch["ids"])
+
+        if len(index):
+            index.save()
+            print(f"Built BM25 index with {len(index)} chunks.")
+        return index
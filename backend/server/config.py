@@ -1,35 +1,190 @@
 import os
+import asyncio
+import httpx
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from groq import Groq
-from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
-from langchain_chroma import Chroma
-from rank_bm25 import BM25Okapi
+from bm25_index import BM25Index
+from embedding_batcher import EmbeddingBatcher
+from cache import LRUCache
+from answer_cache import AnswerCache
+from refinement import QuestionRefiner
+from context_builder import TokenCounter, ContextBuilder
+from reranker import CrossEncoderReranker
+from retrievers import BM25Retriever
+from startup import LazyComponent, DeferredEmbeddings, Startup
 
 # Load environment variables from .env file
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
 
+# Loaders of the components that are slow to create (model downloads, index loading, heavy imports).
+# They run concurrently in the background at startup (see Startup), or on first access.
+
+def load_llm_model():
+    from groq import Groq
+    return Groq(api_key=ServerConfig.LLM_API_KEY)
+
+def load_async_llm_model():
+    from groq import AsyncGroq
+    max_llm_concurrency = ServerConfig.max_llm_concurrency
+    return AsyncGroq(
+        api_key=ServerConfig.LLM_API_KEY,
+        # Shared keep-alive connection pool for all requests
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=2 * max_llm_concurrency, max_keepalive_connections=max_llm_concurrency),
+            timeout=httpx.Timeout(60.0, connect=5.0),
+        ),
+    )
+
+def load_embed_model():
+    from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
+    return FastEmbedEmbeddings(model_name="BAAI/bge-base-en-v1.5")
+
+def load_vectorstore():
+    if ServerConfig.vector_backend == "faiss":
+        from faiss_store import FaissVectorStore
+        return FaissVectorStore(
+            os.path.join('data/indexes', 'faiss'), nprobe=ServerConfig.faiss_nprobe, ef_search=ServerConfig.faiss_ef_search,
+            rerank_factor=ServerConfig.faiss_rerank_factor
+        )
+    from langchain_chroma import Chroma
+    # Queries pass their own embeddings, so the index opens without waiting for the model
+    return Chroma(persist_directory=os.path.join('data/indexes', 'chroma'), embedding_function=DeferredEmbeddings(lambda: ServerConfig.embed_model))
+
+def load_bm25_retriever():
+    vectorstore = ServerConfig.vectorstore
+    return BM25Retriever(BM25Index.load_or_build(os.path.join('data/indexes', 'bm25'), vectorstore), vectorstore)
+
+def load_embed_batcher():
+    return EmbeddingBatcher(
+        ServerConfig.embed_model,
+        max_batch_size=int(os.environ.get("EMBED_MAX_BATCH", 32)),
+        max_wait_ms=float(os.environ.get("EMBED_MAX_WAIT_MS", 3)),
+        executor=ServerConfig.embed_executor,
+    )
+
+def load_token_counter():
+    return TokenCounter(os.environ.get("CONTEXT_TOKENIZER"))
+
+def load_context_builder():
+    return ContextBuilder(
+        ServerConfig.token_counter,
+        context_window=int(os.environ.get("LLM_CONTEXT_WINDOW", 8192)),
+        answer_tokens=ServerConfig.answer_max_tokens,
+        history_tokens=int(os.environ.get("HISTORY_MAX_TOKENS", 1024)),
+    )
+
 class ServerConfig:
     """Stores and manages model configurations on the server."""
 
     LLM_API_KEY = os.environ.get("LLM_API_KEY")
 
-    # Default models (can be changed via API)
-    llm_model = Groq(api_key=LLM_API_KEY)
-    embed_model = FastEmbedEmbeddings(model_name="BAAI/bge-base-en-v1.5")
-    vectorstore = Chroma(persist_directory=os.path.join('data/indexes', 'chroma'), embedding_function=embed_model)
-    bm25_retriever = "BM250 retriever" # BM25Okapi(tokenized_corpus)
+    # Default models (can be changed via API), loaded lazily
+    llm_model = LazyComponent(load_llm_model)
+    embed_model = LazyComponent(load_embed_model)
+    vectorstore = LazyComponent(load_vectorstore)
+    bm25_retriever = LazyComponent(load_bm25_retriever)
+    # Vector search backend: "chroma" or "faiss" (build the FAISS index with `python faiss_store.py`)
+    vector_backend = os.environ.get("VECTOR_BACKEND", "chroma")
+    faiss_nprobe = int(os.environ.get("FAISS_NPROBE", 16))  # IVF lists probed per query
+    faiss_ef_search = int(os.environ.get("FAISS_EF_SEARCH", 64))  # HNSW search depth
+    faiss_rerank_factor = int(os.environ.get("FAISS_RERANK_FACTOR", 4))  # Candidates per result re-ranked in full precision (quantized indexes)
     use_hybrid = False
+    top_k = 5  # Number of chunks handed to the LLM
+    fetch_k = 5  # Number of candidates fetched from the vectorstore before scoring
+
+    # Async request path
+    max_llm_concurrency = int(os.environ.get("MAX_LLM_CONCURRENCY", 8))  # Cap on in-flight LLM calls
+    embed_workers = int(os.environ.get("EMBED_WORKERS", 2))  # Threads for CPU-bound query embedding
+    async_llm_model = LazyComponent(load_async_llm_model)
+    llm_semaphore = asyncio.Semaphore(max_llm_concurrency)
+    embed_executor = ThreadPoolExecutor(max_workers=embed_workers, thread_name_prefix="embed")
+    # Concurrent query embeddings are collected for a few ms and embedded as one batch
+    embed_batcher = LazyComponent(load_embed_batcher)
+
+    # Caches for query embeddings and retrieval results
+    cache_ttl_seconds = int(os.environ.get("CACHE_TTL_SECONDS", 3600))
+    embedding_cache = LRUCache(
+        max_entries=int(os.environ.get("EMBED_CACHE_SIZE", 10000)),
+        max_bytes=int(os.environ.get("EMBED_CACHE_MB", 64)) * 1024 * 1024,
+        ttl_seconds=cache_ttl_seconds,
+    )
+    results_cache = LRUCache(
+        max_entries=int(os.environ.get("RESULTS_CACHE_SIZE", 2000)),
+        max_bytes=int(os.environ.get("RESULTS_CACHE_MB", 64)) * 1024 * 1024,
+        ttl_seconds=cache_ttl_seconds,
+    )
+
+    # Question refinement before the semantic search: "always", "history" or "heuristic"
+    question_refiner = QuestionRefiner(
+        policy=os.environ.get("REFINEMENT_POLICY", "heuristic"),
+        cache=LRUCache(max_entries=int(os.environ.get("REFINEMENT_CACHE_SIZE", 5000)), ttl_seconds=cache_ttl_seconds),
+    )
+
+    # Optional cross-encoder re-ranking of rerank_fetch_k candidates down to top_k
+    rerank_fetch_k = int(os.environ.get("RERANK_FETCH_K", 20))
+    reranker = CrossEncoderReranker(
+        model_name=os.environ.get("RERANK_MODEL", "Xenova/ms-marco-MiniLM-L-6-v2"),
+        max_latency_ms=float(os.environ.get("RERANK_MAX_LATENCY_MS", 150)),
+        batch_size=int(os.environ.get("RERANK_BATCH_SIZE", 32)),
+    ) if os.environ.get("RERANK_ENABLED", "false").lower() == "true" else None
+
+    # Token budget of the answer prompt (llama3-8b-8192); CONTEXT_TOKENIZER is a tokenizer.json path or hub name
+    # (without it, tokens are estimated conservatively from characters, see TokenCounter)
+    answer_max_tokens = int(os.environ.get("ANSWER_MAX_TOKENS", 1024))  # Reserved for the answer
+    token_counter = LazyComponent(load_token_counter)
+    context_builder = LazyComponent(load_context_builder)
+
+    # Optional semantic answer cache: reuses answers of near-duplicate questions with the same retrieved chunks
+    answer_cache = AnswerCache(
+        os.path.join('data/cache', 'answers.db'),
+        threshold=float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.95)),
+        max_entries=int(os.environ.get("ANSWER_CACHE_SIZE", 5000)),
+    ) if os.environ.get("ANSWER_CACHE_ENABLED", "false").lower() == "true" else None
 
     @classmethod
-    def update_config(cls, llm_model=None, embed_model=None, vectorstore=None, bm25_retriever=None, use_hybrid=None):
-        """Allows dynamic updates to the model configuration."""
+    def update_config(cls, llm_model=None, embed_model=None, vectorstore=None, bm25_retriever=None, use_hybrid=None, async_llm_model=None,
+                      faiss_nprobe=None, faiss_ef_search=None, reranker=None):
+        """
+        Allows dynamic updates to the model configuration.
+        vectorstore may be a Chroma vectorstore or a FaissVectorStore; faiss_nprobe and faiss_ef_search
+        tune the search of a FaissVectorStore.
+        """
         if llm_model:
             cls.llm_model = llm_model
+        if async_llm_model:
+            cls.async_llm_model = async_llm_model
+            if cls.answer_cache:
+                cls.answer_cache.clear()
         if embed_model:
             cls.embed_model = embed_model
+            cls.embed_batcher.embed_model = embed_model
+            cls.results_cache.clear()
+            if cls.answer_cache:
+                cls.answer_cache.clear()
         if vectorstore:
             cls.vectorstore = vectorstore
+            cls.results_cache.clear()
+            if cls.answer_cache:
+                cls.answer_cache.clear()
+        if faiss_nprobe or faiss_ef_search:
+            cls.faiss_nprobe = faiss_nprobe or cls.faiss_nprobe
+            cls.faiss_ef_search = faiss_ef_search or cls.faiss_ef_search
+            if hasattr(cls.vectorstore, "set_search_params"):
+                cls.vectorstore.set_search_params(nprobe=cls.faiss_nprobe, ef_search=cls.faiss_ef_search)
+            cls.results_cache.clear()
+        if reranker:
+            cls.reranker = reranker
+            cls.results_cache.clear()
+            if cls.answer_cache:
+                cls.answer_cache.clear()
         if bm25_retriever:
             cls.bm25_retriever = bm25_retriever
-        if use_hybrid:
-            cls.use_hybrid = use_hybrid
\ No newline at end of file
+        if use_hybrid is not None:
+            cls.use_hybrid = use_hybrid
+
+# Background loading of the lazy components, started by the server's lifespan; failed ones are retried
+startup = Startup(
+    ServerConfig,
+    retry_backoff=float(os.environ.get("COMPONENT_RETRY_SECONDS", 5)),
+    max_retry_backoff=float(os.environ.get("COMPONENT_MAX_RETRY_SECONDS", 300)),
+)
@@ -0,0 +1,146 @@
+import os
+import re
+from functools import lru_cache
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+# Pieces the Llama 3 tokenizer never merges: runs of letters, groups of up to three digits, punctuation marks
+PRETOKEN_PATTERN = re.compile(r"[^\W\d_]+|\d{1,3}|[^\w\s]|_", re.UNICODE)
+CHARS_PER_TOKEN = 3
+MESSAGE_OVERHEAD_TOKENS = 4  # Role and separator tokens the chat template adds per message
+
+
+class TokenCounter:
+    """
+    Counts tokens with a local Hugging Face `tokenizers` tokenizer (a tokenizer.json file or a hub name,
+    e.g. the tokenizer.json of Llama 3 for llama3-8b-8192).
+    Without a tokenizer, or if it cannot be loaded, the count is a conservative estimate: one token per
+    three characters (Llama 3 averages about four on English prose, fewer on German), but at least one
+    per pre-token, so that numbers and punctuation-heavy text are not undercounted.
+    Counts of repeated texts (chunks, system prompt) are cached.
+    """
+
+    def __init__(self, tokenizer=None, cache_size=20000):
+        self.name = None
+        self._tokenizer = None
+        if tokenizer:
+            try:
+                from tokenizers import Tokenizer
+                self._tokenizer = Tokenizer.from_file(tokenizer) if os.path.exists(tokenizer) else Tokenizer.from_pretrained(tokenizer)
+                self.name = tokenizer
+            except Exception as e:
+                print(f"Could not load tokenizer '{tokenizer}', estimating tokens from characters: {e}")
+        self.count = lru_cache(maxsize=cache_size)(self._count)
+
+    def _count(self, text):
+        if not text:
+            return 0
+        if self._tokenizer is not None:
+            return len(self._tokenizer.encode(text, add_special_tokens=False).ids)
+        return max(-(-len(text) // CHARS_PER_TOKEN), len(PRETOKEN_PATTERN.findall(text)))
+
+    def tail(self, text, max_tokens):
+        """Returns the end of the text that fits into max_tokens (the oldest part is cut off)."""
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        if self._tokenizer is not None:
+            offsets = self._tokenizer.encode(text, add_special_tokens=False).offsets
+            start = offsets[-max_tokens][0]
+        else:
+            start = max(0, len(text) - CHARS_PER_TOKEN * max_tokens)
+            # Dense text has more tokens per character: cut off the share of the excess
+            count = self._count(text[start:])
+            while count > max_tokens:
+                start += max(1, (len(text) - start) * (count - max_tokens) // count)
+                count = self._count(text[start:])
+        # Do not start in the middle of a word
+        space = text.find(" ", start)
+        return text[space + 1:] if 0 <= space < len(text) - 1 else text[start:]
+
+    def messages(self, messages):
+        """Number of prompt tokens of a chat conversation."""
+        return sum(self.count(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def shingles(text, size=5):
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class ContextBuilder:
+    """
+    Assembles the context of the answer prompt within the LLM's context window.
+
+    The window is split into the answer reserve, the fixed prompt (system prompt template and question),
+    the chat history (at most history_tokens, truncated from the oldest end) and the retrieved chunks.
+    Chunks are taken in order of relevance; chunks that mostly repeat an already selected chunk
+    (overlapping splits, the same passage from vector and keyword search) are skipped, and chunks
+    that do not fit into the remaining budget are left out.
+    """
+
+    def __init__(self, token_counter, context_window=8192, answer_tokens=1024, history_tokens=1024, max_overlap=0.8):
+        self.counter = token_counter
+        self.context_window = context_window
+        self.answer_tokens = answer_tokens
+        self.history_tokens = history_tokens
+        self.max_overlap = max_overlap
+
+    def _truncate_history(self, conversation_history, max_tokens):
+        if isinstance(conversation_history, str):
+            return self.counter.tail(conversation_history, max_tokens)
+        # List of messages: drop the oldest ones until the rest fits
+        kept, used = [], 0
+        for message in reversed(conversation_history or []):
+            text = message.get("content", "") if isinstance(message, dict) else str(message)
+            tokens = self.counter.count(text)
+            if used + tokens > max_tokens:
+                break
+            kept.append(message)
+            used += tokens
+        return list(reversed(kept))
+
+    def _history_text(self, conversation_history):
+        if isinstance(conversation_history, str):
+            return conversation_history
+        return " ".join(message.get("content", "") if isinstance(message, dict) else str(message) for message in conversation_history)
+
+    def build(self, results, conversation_history, fixed_tokens):
+        """
+        Selects the history and chunks that fit the token budget.
+
+        :param results: Retrieved results ({"id", "content", "source", "score"}), best first.
+        :param conversation_history: Chat history (string or list of messages).
+        :param fixed_tokens: Tokens of the prompt without history and context (template and question).
+        :return: Tuple (selected results, truncated history, dict with the token accounting).
+        """
+        available = self.context_window - self.answer_tokens - fixed_tokens
+        history = self._truncate_history(conversation_history, min(self.history_tokens, max(available, 0)))
+        history_tokens = self.counter.count(self._history_text(history))
+        budget = available - history_tokens
+
+        selected, seen, used = [], [], 0
+        duplicates = over_budget = 0
+        for result in sorted(results, key=lambda result: result.get("score", 0.0), reverse=True):
+            chunk_shingles = shingles(result["content"])
+            if chunk_shingles and any(len(chunk_shingles & other) / len(chunk_shingles) >= self.max_overlap for other in seen):
+                duplicates += 1
+                continue
+            tokens = self.counter.count(result["content"]) + 1  # Separator
+            if used + tokens > budget:
+                over_budget += 1
+                continue
+            selected.append(result)
+            seen.append(chunk_shingles)
+            used += tokens
+
+        return selected, history, {
+            "budget_tokens": max(available, 0),
+            "history_tokens": history_tokens,
+            "context_tokens": used,
+            "chunks_used": len(selected),
+            "chunks_duplicate": duplicates,
+            "chunks_over_budget": over_budget,
+        }
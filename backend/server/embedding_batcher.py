@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+
+def embed_query_batch(embed_model, texts):
+    """
+    Embeds several queries with one forward pass of the embedding model.
+    FastEmbed models are called through their query embedding so the vectors are identical
+    to embed_query; other models fall back to embed_documents.
+    """
+    model = getattr(embed_model, "_model", None)
+    if model is not None and hasattr(model, "query_embed"):
+        return [vector.tolist() for vector in model.query_embed(texts)]
+    return embed_model.embed_documents(texts)
+
+
+class EmbeddingBatcher:
+    """
+    Micro-batching front end for the embedding model.
+
+    Concurrent embed_query calls are collected for a short window (max_wait_ms) or until max_batch_size
+    queries are waiting, and are then embedded as one batch on the embedding executor. Every caller
+    gets its own vector back through a future.
+    """
+
+    BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, float("inf"))
+
+    def __init__(self, embed_model, max_batch_size=32, max_wait_ms=3.0, executor=None):
+        self.embed_model = embed_model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.executor = executor
+        self._pending = []  # (text, future, enqueue time)
+        self._batch_full = asyncio.Event()
+        self._worker = None
+        self._batch_tasks = set()  # Keeps references to running batch tasks
+        self._in_flight = 0
+
+        # Metrics
+        self.queries_total = 0
+        self.batches_total = 0
+        self.max_batch_seen = 0
+        self.queue_wait_seconds_total = 0.0
+        self.embed_seconds_total = 0.0
+        self.batch_size_counts = {bucket: 0 for bucket in self.BATCH_SIZE_BUCKETS}
+
+    async def embed_query(self, text):
+        """Embeds one query; the call is batched with other queries arriving at the same time."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future, time.perf_counter()))
+        self.queries_total += 1
+        if len(self._pending) >= self.max_batch_size:
+            self._batch_full.set()
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._collect())
+        return await future
+
+    async def _collect(self):
+        while self._pending:
+            # Wait for more queries to arrive, unless the batch is already full
+            if len(self._pending) < self.max_batch_size:
+                self._batch_full.clear()
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.max_wait)
+                except asyncio.TimeoutError:
+                    pass
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:len(batch)]
+            # The executor bounds how many batches are embedded at once; keep collecting meanwhile
+            task = asyncio.get_running_loop().create_task(self._embed_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _embed_batch(self, batch):
+        texts = [text for text, _, _ in batch]
+        started = time.perf_counter()
+        self._record_batch(batch, started)
+        self._in_flight += 1
+        try:
+            vectors = await asyncio.get_running_loop().run_in_executor(
+                self.executor, embed_query_batch, self.embed_model, texts
+            )
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._in_flight -= 1
+            self.embed_seconds_total += time.perf_counter() - started
+
+        for (_, future, _), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+    def _record_batch(self, batch, started):
+        size = len(batch)
+        self.batches_total += 1
+        self.max_batch_seen = max(self.max_batch_seen, size)
+        self.queue_wait_seconds_total += sum(started - enqueued for _, _, enqueued in batch)
+        for bucket in self.BATCH_SIZE_BUCKETS:
+            if size <= bucket:
+                self.batch_size_counts[bucket] += 1
+                break
+
+    def stats(self):
+        """Returns queue depth and batch-size metrics of the batcher."""
+        return {
+            "queue_depth": len(self._pending),
+            "batches_in_flight": self._in_flight,
+            "queries_total": self.queries_total,
+            "batches_total": self.batches_total,
+            "mean_batch_size": self.queries_total / self.batches_total if self.batches_total else 0.0,
+            "max_batch_size": self.max_batch_seen,
+            "batch_size_histogram": {f"<={bucket}": count for bucket, count in self.batch_size_counts.items()},
+            "mean_queue_wait_ms": 1000.0 * self.queue_wait_seconds_total / self.queries_total if self.queries_total else 0.0,
+            "embed_seconds_total": self.embed_seconds_total,
+        }
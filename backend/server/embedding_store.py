@@ -0,0 +1,176 @@
+import os
+import re
+import json
+import hashlib
+import numpy as np
+
+KEY_SIZE = 20  # Bytes of a SHA-1 digest
+INITIAL_CAPACITY = 1024  # Rows allocated when a store is created
+
+
+def text_key(text):
+    """Content address of a chunk text."""
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+
+class EmbeddingStore:
+    """
+    Persistent, content-addressed cache of chunk embeddings for one embedding model.
+
+    The vectors live in a memory-mapped array (vectors.bin), row i belongs to the i-th key in keys.bin
+    (SHA-1 of the chunk text) and meta.json records model, dimension, dtype and the number of valid rows.
+    Only looked-up rows are read from disk, so re-indexing an edited PDF embeds only its changed chunks.
+    Rows are appended and never rewritten; the store is meant for a single writer (the ingestion script).
+    """
+
+    def __init__(self, folder, model_name, dtype="float32"):
+        """
+        :param folder: Root folder of the stores; every model gets its own subfolder.
+        :param model_name: Name of the embedding model, part of the cache key.
+        :param dtype: Storage type of the vectors, "float32" or "float16".
+        """
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"Unsupported embedding store dtype '{dtype}', expected 'float32' or 'float16'")
+        self.model_name = model_name
+        self.path = os.path.join(folder, re.sub(r"[^\w.-]+", "_", model_name))
+        self.dtype = np.dtype(dtype)
+        self.dim = None
+        self.count = 0
+        self._rows = {}  # text key -> row
+        self._new_keys = []  # keys appended since the last save
+        self._vectors = None
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    @property
+    def _vectors_file(self):
+        return os.path.join(self.path, "vectors.bin")
+
+    @property
+    def _keys_file(self):
+        return os.path.join(self.path, "keys.bin")
+
+    @property
+    def _meta_file(self):
+        return os.path.join(self.path, "meta.json")
+
+    def _reset(self):
+        for file_path in (self._meta_file, self._keys_file, self._vectors_file):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def _load(self):
+        if not os.path.exists(self._meta_file):
+            self._reset()  # Leftovers of a run that never saved
+            return
+        with open(self._meta_file, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["model_name"] != self.model_name or meta["dtype"] != self.dtype.name:
+            print(f"Embedding store {self.path} was written for another model or dtype, starting a new one.")
+            self._reset()
+            return
+        with open(self._keys_file, "r+b") as f:
+            keys = f.read()
+            # Rows written after the last saved meta.json are dropped (interrupted run)
+            self.count = min(meta["count"], len(keys) // KEY_SIZE)
+            f.truncate(self.count * KEY_SIZE)
+        self.dim = meta["dim"]
+        self._rows = {keys[i * KEY_SIZE:(i + 1) * KEY_SIZE]: i for i in range(self.count)}
+        self._open(max(self.count, 1))
+
+    def _open(self, capacity):
+        """Maps the vector file, growing it to at least capacity rows."""
+        os.makedirs(self.path, exist_ok=True)
+        row_bytes = self.dim * self.dtype.itemsize
+        size = os.path.getsize(self._vectors_file) if os.path.exists(self._vectors_file) else 0
+        if size < capacity * row_bytes:
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._vectors = None
+            with open(self._vectors_file, "ab") as f:
+                f.truncate(capacity * row_bytes)
+            size = capacity * row_bytes
+        self._vectors = np.memmap(self._vectors_file, dtype=self.dtype, mode="r+", shape=(size // row_bytes, self.dim))
+
+    def __len__(self):
+        return self.count
+
+    def get_many(self, texts):
+        """
+        Looks up the embeddings of the given texts.
+
+        :return: Tuple (float32 array with one row per text, indices of the texts that are not cached;
+                 their rows are left uninitialised).
+        """
+        keys = [text_key(text) for text in texts]
+        rows = [self._rows.get(key) for key in keys]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        if self.dim is None:
+            return None, missing
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        found = [i for i, row in enumerate(rows) if row is not None]
+        if found:
+            vectors[found] = self._vectors[[rows[i] for i in found]]
+        return vectors, missing
+
+    def put_many(self, texts, vectors):
+        """Appends the embeddings of texts that are not stored yet."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._open(INITIAL_CAPACITY)
+        new_rows = []
+        for text, vector in zip(texts, vectors):
+            key = text_key(text)
+            if key in self._rows:
+                continue
+            self._rows[key] = self.count + len(new_rows)
+            self._new_keys.append(key)
+            new_rows.append(vector)
+        if not new_rows:
+            return
+        if self.count + len(new_rows) > len(self._vectors):
+            self._open(max(2 * len(self._vectors), self.count + len(new_rows)))
+        self._vectors[self.count:self.count + len(new_rows)] = np.stack(new_rows)
+        self.count += len(new_rows)
+
+    def embed(self, texts, embed_fn):
+        """
+        Returns the float32 embeddings of the texts; only the texts that are not cached are passed
+        to embed_fn (a callable list of texts -> list/array of vectors) and then stored.
+        """
+        vectors, missing = self.get_many(texts)
+        if not missing:
+            return vectors if vectors is not None else np.zeros((0, 0), dtype=np.float32)
+        missing_texts = [texts[i] for i in missing]
+        computed = np.asarray(embed_fn(missing_texts), dtype=np.float32)
+        self.put_many(missing_texts, computed)
+        if vectors is None:
+            vectors = np.empty((len(texts), computed.shape[1]), dtype=np.float32)
+        vectors[missing] = computed
+        return vectors
+
+    def save(self):
+        """Flushes the vectors, appends the new keys and then records the row count."""
+        if self._vectors is None:
+            return
+        self._vectors.flush()
+        with open(self._keys_file, "ab") as f:
+            f.write(b"".join(self._new_keys))
+        self._new_keys = []
+        tmp = self._meta_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"model_name": self.model_name, "dim": self.dim, "dtype": self.dtype.name, "count": self.count}, f)
+        os.replace(tmp, self._meta_file)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": self.count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
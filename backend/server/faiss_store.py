@@ -0,0 +1,437 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import threading
+import numpy as np
+import faiss
+
+FAISS_INDEX_TYPES = ("flat", "hnsw", "sq16", "sq8", "pq", "ivfpq")
+# Index types that store compressed codes; their candidates are re-ranked with the full-precision vectors
+QUANTIZED_INDEX_TYPES = ("sq16", "sq8", "pq", "ivfpq")
+
+
+class StringColumn:
+    """
+    Column of strings stored as one UTF-8 blob plus an offsets array. Both files are memory-mapped,
+    so a lookup only touches the requested rows.
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        return bytes(self.data[self.offsets[row]:self.offsets[row + 1]]).decode("utf-8")
+
+    @staticmethod
+    def write(path, values):
+        encoded = [value.encode("utf-8") for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        with open(path + ".bin", "wb") as f:
+            f.write(b"".join(encoded))
+        np.save(path + ".offsets.npy", offsets)
+
+    @classmethod
+    def open(cls, path):
+        offsets = np.load(path + ".offsets.npy", mmap_mode="r")
+        # np.memmap cannot map an empty file
+        data = np.memmap(path + ".bin", dtype=np.uint8, mode="r") if offsets[-1] else np.zeros(0, dtype=np.uint8)
+        return cls(data, offsets)
+
+
+def normalize_rows(vectors):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def index_factory_string(index_type, count, dim, nlist=None, pq_m=None, hnsw_m=32):
+    """
+    faiss.index_factory description of an index type, with defaults derived from the corpus size.
+    Per vector, flat/hnsw store dim float32 values, sq16 dim float16 values, sq8 dim bytes and
+    pq/ivfpq pq_m codes of at most one byte.
+    """
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "hnsw":
+        return f"HNSW{hnsw_m}"
+    if index_type == "sq16":
+        return "SQfp16"
+    if index_type == "sq8":
+        return "SQ8"
+    if index_type in ("pq", "ivfpq"):
+        pq_m = pq_m or next(m for m in (96, 64, 48, 32, 24, 16, 8, 4, 2, 1) if dim % m == 0)
+        # 256 centroids per sub-quantizer need about 10k training points, smaller corpora use 16
+        pq_bits = 8 if count >= 39 * 256 else 4
+        if index_type == "pq":
+            return f"PQ{pq_m}x{pq_bits}"
+        # About 4 * sqrt(n) lists, with at least 39 training points per list
+        nlist = nlist or max(1, min(int(4 * np.sqrt(count)), count // 39))
+        return f"IVF{nlist},PQ{pq_m}x{pq_bits}"
+    raise ValueError(f"Unknown FAISS index type '{index_type}', expected one of {FAISS_INDEX_TYPES}")
+
+
+def create_index(vectors, index_type="flat", nlist=None, pq_m=None, hnsw_m=32):
+    """
+    Creates, trains and fills a FAISS index on normalized vectors (inner product = cosine similarity).
+
+    :return: Tuple (index, index type, factory description). Too small corpora fall back from
+             the PQ types to a flat index, as their codebooks cannot be trained.
+    """
+    count, dim = vectors.shape
+    if index_type in ("pq", "ivfpq") and count < 1000:
+        print(f"Only {count} vectors, too few to train {index_type}; building a flat index instead.")
+        index_type = "flat"
+    description = index_factory_string(index_type, count, dim, nlist=nlist, pq_m=pq_m, hnsw_m=hnsw_m)
+    index = faiss.index_factory(dim, description, faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index, index_type, description
+
+
+def rerank_exact(query, rows, vectors, k):
+    """
+    Re-scores candidate rows with the full-precision vectors and returns the best k.
+
+    :return: Tuple (rows, vectors of these rows), best first.
+    """
+    if not rows:
+        return rows, np.zeros((0, vectors.shape[1]), dtype=np.float32)
+    candidates = np.asarray(vectors[rows], dtype=np.float32)
+    order = np.argsort(-(candidates @ query))[:k]
+    return [rows[i] for i in order], candidates[order]
+
+
+class LoadedIndex:
+    """
+    One version of a FAISS index folder: the index, vectors, side files and the ID lookup. It is never
+    modified after loading (except the search parameters), so a query that holds a LoadedIndex sees
+    consistent row IDs and columns even while the store swaps in a rebuilt folder.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        index_file = os.path.join(path, "index.faiss")
+        try:
+            self.index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            # Index types without mmap support are read into memory
+            self.index = faiss.read_index(index_file)
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.ids = StringColumn.open(os.path.join(path, "ids"))
+        self.documents = StringColumn.open(os.path.join(path, "documents"))
+        self.sources = StringColumn.open(os.path.join(path, "sources"))
+        self._row_of = None
+
+    @property
+    def index_type(self):
+        return self.meta["index_type"]
+
+    @property
+    def row_of(self):
+        """Chunk ID -> row, built on first use."""
+        if self._row_of is None:
+            self._row_of = {self.ids[row]: row for row in range(len(self.ids))}
+        return self._row_of
+
+    def set_search_params(self, nprobe, ef_search):
+        if self.index_type == "ivfpq":
+            faiss.extract_index_ivf(self.index).nprobe = nprobe
+        if self.index_type == "hnsw":
+            self.index.hnsw.efSearch = ef_search
+
+    def metadata(self, row):
+        return {"source": self.sources[row], "chunk_id": self.ids[row]}
+
+
+class FaissVectorStore:
+    """
+    Read-only vector store on a FAISS index, an alternative to Chroma for the server's search path.
+
+    Layout of the index folder:
+    - index.faiss: the FAISS index (flat, IVF-PQ or HNSW; inner product on normalized vectors),
+      loaded with IO_FLAG_MMAP so its codes stay on disk until they are touched
+    - vectors.npy: the normalized full-precision vectors, memory-mapped, returned for candidate scoring
+    - ids / documents / sources: columnar string side files (see StringColumn)
+    - meta.json: index type, dimension, number of vectors and build parameters
+
+    nprobe (IVF) and efSearch (HNSW) trade recall for latency and can be changed at runtime.
+    Quantized index types (sq16, sq8, pq, ivfpq) keep only compressed codes in memory; they fetch
+    rerank_factor times more candidates, which are re-ranked exactly with the memory-mapped vectors.
+    The index is reloaded when it was rebuilt on disk (e.g. by the PDF processor): the new version is
+    loaded completely and then replaces the current LoadedIndex in one assignment.
+    """
+
+    def __init__(self, path, nprobe=16, ef_search=64, rerank_factor=4):
+        self.path = path
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.rerank_factor = rerank_factor
+        self._lock = threading.Lock()
+        self._loaded_mtime = None
+        self._read()
+
+    def _meta_path(self):
+        return os.path.join(self.path, "meta.json")
+
+    def _read(self):
+        mtime = os.path.getmtime(self._meta_path())
+        loaded = LoadedIndex(self.path)
+        loaded.set_search_params(self.nprobe, self.ef_search)
+        self._loaded = loaded
+        self._loaded_mtime = mtime
+
+    def _current(self):
+        """Returns the current LoadedIndex, after reloading it if another process has rebuilt the index."""
+        try:
+            mtime = os.path.getmtime(self._meta_path())
+        except OSError:
+            return self._loaded
+        if mtime > self._loaded_mtime:
+            with self._lock:
+                if mtime > self._loaded_mtime:
+                    self._read()
+        return self._loaded
+
+    def reload_if_stale(self):
+        """Reloads the index if another process has rebuilt it."""
+        self._current()
+
+    def __len__(self):
+        return self._loaded.index.ntotal
+
+    @property
+    def meta(self):
+        return self._loaded.meta
+
+    @property
+    def index_type(self):
+        return self._loaded.index_type
+
+    def set_search_params(self, nprobe=None, ef_search=None):
+        """Sets the number of probed IVF lists and the HNSW search depth."""
+        if nprobe:
+            self.nprobe = int(nprobe)
+        if ef_search:
+            self.ef_search = int(ef_search)
+        self._loaded.set_search_params(self.nprobe, self.ef_search)
+
+    def query_by_embedding(self, query_embedding, k, include_embeddings=True):
+        """
+        Nearest-neighbour search with an already computed query embedding.
+
+        :return: Tuple (ids, documents, metadatas, embeddings) for the k nearest chunks,
+                 in the same format as retrievers.query_vectorstore.
+        """
+        loaded = self._current()
+        query = normalize_rows(np.asarray(query_embedding, dtype=np.float32)[None, :])
+        if loaded.index_type in QUANTIZED_INDEX_TYPES and self.rerank_factor > 1:
+            _, rows = loaded.index.search(query, k * self.rerank_factor)
+            rows, embeddings = rerank_exact(query[0], [int(row) for row in rows[0] if row >= 0], loaded.vectors, k)
+        else:
+            _, rows = loaded.index.search(query, k)
+            rows = [int(row) for row in rows[0] if row >= 0]
+            embeddings = np.asarray(loaded.vectors[rows]) if rows else []
+        if not include_embeddings:
+            embeddings = []
+        return (
+            [loaded.ids[row] for row in rows],
+            [loaded.documents[row] for row in rows],
+            [loaded.metadata(row) for row in rows],
+            embeddings,
+        )
+
+    def get_chunks(self, ids):
+        """Returns (ids, documents, metadatas) of the given chunk IDs that exist in the index."""
+        loaded = self._current()
+        rows = [loaded.row_of[chunk_id] for chunk_id in ids if chunk_id in loaded.row_of]
+        return [loaded.ids[row] for row in rows], [loaded.documents[row] for row in rows], [loaded.metadata(row) for row in rows]
+
+    def get(self, include=None, limit=None, offset=0):
+        """
+        Pages through all chunks like Chroma's collection get (e.g. to build the BM25 index).
+
+        :param include: Any of "documents", "metadatas", "embeddings" (default: documents and metadatas).
+        :return: Dict with "ids" and the included fields of the rows offset to offset + limit.
+        """
+        loaded = self._current()
+        include = ("documents", "metadatas") if include is None else include
+        rows = range(offset, len(loaded.ids) if limit is None else min(offset + limit, len(loaded.ids)))
+        batch = {"ids": [loaded.ids[row] for row in rows]}
+        if "documents" in include:
+            batch["documents"] = [loaded.documents[row] for row in rows]
+        if "metadatas" in include:
+            batch["metadatas"] = [loaded.metadata(row) for row in rows]
+        if "embeddings" in include:
+            batch["embeddings"] = np.asarray(loaded.vectors[rows.start:rows.stop])
+        return batch
+
+    def stats(self):
+        loaded = self._loaded
+        return {
+            "index_type": loaded.index_type,
+            "vectors": loaded.index.ntotal,
+            "dim": loaded.meta["dim"],
+            "nprobe": self.nprobe,
+            "ef_search": self.ef_search,
+            "rerank_factor": self.rerank_factor if loaded.index_type in QUANTIZED_INDEX_TYPES else None,
+            "index_bytes": os.path.getsize(os.path.join(self.path, "index.faiss")),
+            "vector_bytes": int(loaded.vectors.nbytes),
+        }
+
+    @staticmethod
+    def build(path, ids, embeddings, documents, metadatas, index_type="flat", nlist=None, pq_m=None, hnsw_m=32):
+        """
+        Builds and saves a FAISS index folder. The folder is written next to the target and swapped in
+        at the end, so a running server never sees a half-written index.
+
+        :param embeddings: Array-like of shape (n, dim).
+        :param index_type: One of FAISS_INDEX_TYPES.
+        :param nlist: Number of IVF lists (default: about 4 * sqrt(n)).
+        :param pq_m: Number of PQ sub-quantizers (default: largest of 96, 64, ... that divides dim).
+        :param hnsw_m: Number of HNSW neighbours per node.
+        """
+        vectors = normalize_rows(embeddings)
+        count, dim = vectors.shape
+        index, index_type, description = create_index(vectors, index_type, nlist=nlist, pq_m=pq_m, hnsw_m=hnsw_m)
+
+        tmp = path.rstrip("/\\") + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        faiss.write_index(index, os.path.join(tmp, "index.faiss"))
+        np.save(os.path.join(tmp, "vectors.npy"), vectors)
+        StringColumn.write(os.path.join(tmp, "ids"), ids)
+        StringColumn.write(os.path.join(tmp, "documents"), documents)
+        StringColumn.write(os.path.join(tmp, "sources"), [(meta or {}).get("source", "unknown") for meta in metadatas])
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"index_type": index_type, "factory": description, "dim": dim, "count": count}, f)
+
+        old = path.rstrip("/\\") + ".old"
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.exists(path):
+            os.replace(path, old)
+        os.replace(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+        print(f"Built {index_type} FAISS index ({description}) with {count} vectors.")
+
+    @classmethod
+    def build_from_chroma(cls, path, vectorstore, index_type="flat", batch_size=5000, **kwargs):
+        """Exports all chunks and embeddings of the (langchain) Chroma vectorstore into a FAISS index folder."""
+        ids, documents, metadatas, embeddings = export_chroma(vectorstore, batch_size=batch_size)
+        if not ids:
+            print("The Chroma collection is empty, no FAISS index built.")
+            return
+        cls.build(path, ids, embeddings, documents, metadatas, index_type=index_type, **kwargs)
+
+
+def export_chroma(vectorstore, batch_size=5000, include_documents=True):
+    """Reads all chunks of the (langchain) Chroma vectorstore: (ids, documents, metadatas, embeddings array)."""
+    include = ["documents", "metadatas", "embeddings"] if include_documents else ["embeddings"]
+    ids, documents, metadatas, embeddings = [], [], [], []
+    offset = 0
+    while True:
+        batch = vectorstore._collection.get(include=include, limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            break
+        ids.extend(batch["ids"])
+        if include_documents:
+            documents.extend(batch["documents"])
+            metadatas.extend(batch["metadatas"])
+        embeddings.append(np.asarray(batch["embeddings"], dtype=np.float32))
+        offset += len(batch["ids"])
+    return ids, documents, metadatas, np.vstack(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32)
+
+
+def quantization_report(embeddings, k=10, n_queries=200, index_types=FAISS_INDEX_TYPES, rerank_factor=4, nprobe=16, ef_search=64, seed=0):
+    """
+    Compares the index types on a corpus: memory per vector and recall@k against an exact search,
+    without and with the full-precision re-ranking. n_queries vectors (at most a tenth of the corpus,
+    at least one) are held out of the index and used as queries.
+
+    :param embeddings: Array of shape (n, dim) with the corpus embeddings.
+    :return: List of dicts, one per index type.
+    """
+    vectors = normalize_rows(embeddings)
+    if len(vectors) < 2:
+        # At least one query and one indexed vector are needed
+        return []
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(vectors))
+    n_queries = max(1, min(n_queries, len(vectors) // 10))
+    queries, base = vectors[order[:n_queries]], vectors[order[n_queries:]]
+    k = min(k, len(base))
+    truth = np.argsort(-(queries @ base.T), axis=1)[:, :k]
+
+    def recall(found):
+        return float(np.mean([len(set(row) & set(expected)) / k for row, expected in zip(found, truth)]))
+
+    report = []
+    for index_type in index_types:
+        index, built_type, description = create_index(base, index_type)
+        if built_type != index_type:
+            continue
+        if built_type == "ivfpq":
+            faiss.extract_index_ivf(index).nprobe = nprobe
+        if built_type == "hnsw":
+            index.hnsw.efSearch = ef_search
+
+        started = time.perf_counter()
+        _, found = index.search(queries, k)
+        search_ms = (time.perf_counter() - started) * 1000 / n_queries
+        entry = {
+            "index_type": index_type,
+            "factory": description,
+            "bytes_per_vector": len(faiss.serialize_index(index)) / len(base),
+            f"recall@{k}": recall(found),
+            "ms_per_query": search_ms,
+        }
+        if index_type in QUANTIZED_INDEX_TYPES:
+            started = time.perf_counter()
+            _, candidates = index.search(queries, k * rerank_factor)
+            reranked = [rerank_exact(query, [int(row) for row in rows if row >= 0], base, k)[0] for query, rows in zip(queries, candidates)]
+            entry[f"recall@{k}_reranked"] = recall(reranked)
+            entry["ms_per_query_reranked"] = (time.perf_counter() - started) * 1000 / n_queries
+        report.append(entry)
+    return report
+
+
+if __name__ == "__main__":
+    # Usage: python faiss_store.py [--index-type TYPE] [--nlist N] [--pq-m M] [--hnsw-m M]
+    #        python faiss_store.py --report [--k 10] [--queries 200]
+    parser = argparse.ArgumentParser(description="Builds the server's FAISS index from the Chroma collection.")
+    parser.add_argument("--index-type", choices=FAISS_INDEX_TYPES, default=os.getenv("FAISS_INDEX_TYPE", "flat"))
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--pq-m", type=int, default=None)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--report", action="store_true", help="Compare recall@k and memory of all index types instead")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args(sys.argv[1:])
+
+    from langchain_chroma import Chroma
+    from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
+
+    chroma = Chroma(
+        persist_directory=os.path.join("data/indexes", "chroma"),
+        embedding_function=FastEmbedEmbeddings(model_name="BAAI/bge-base-en-v1.5"),
+    )
+    if args.report:
+        _, _, _, corpus = export_chroma(chroma, include_documents=False)
+        print(f"{len(corpus)} vectors of dimension {corpus.shape[1]}, recall@{args.k} on {args.queries} held-out queries")
+        for entry in quantization_report(corpus, k=args.k, n_queries=args.queries):
+            print(json.dumps(entry))
+    else:
+        FaissVectorStore.build_from_chroma(
+            os.path.join("data/indexes", "faiss"), chroma, index_type=args.index_type,
+            nlist=args.nlist, pq_m=args.pq_m, hnsw_m=args.hnsw_m,
+        )
@@ -0,0 +1,104 @@
+import os
+import json
+import pickle
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+HASH_CHUNK_SIZE = 1024 * 1024  # Bytes read per step when hashing a file
+
+
+def get_file_hash(file_path, chunk_size=HASH_CHUNK_SIZE):
+    """MD5 hash of a file, read in chunks so memory use does not depend on the file size."""
+    hasher = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+class FileManifest:
+    """
+    Persisted record of the indexed files: file name -> size, modification time and content hash.
+
+    A file is only hashed again when its size or modification time changed, so scanning an unchanged
+    archive costs one stat call per file. Hashing runs on a thread pool.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}  # file name -> {"size", "mtime_ns", "hash"}
+        self._pending = {}  # changed files, committed once they are indexed
+
+    @classmethod
+    def load(cls, path, legacy_file=None):
+        """
+        Loads the manifest. If there is none yet but a legacy processed_files.pkl (file name -> hash) exists,
+        its hashes are taken over; those files are hashed once more to fill in their size and mtime.
+        """
+        manifest = cls(path)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                manifest.files = json.load(f)["files"]
+        elif legacy_file and os.path.exists(legacy_file):
+            with open(legacy_file, "rb") as f:
+                manifest.files = {
+                    name: {"size": None, "mtime_ns": None, "hash": file_hash}
+                    for name, file_hash in pickle.load(f).items()
+                }
+        return manifest
+
+    def scan(self, folder, suffix=".pdf", workers=8):
+        """
+        Compares the files in the folder with the manifest.
+
+        :param folder: Folder with the input files.
+        :param suffix: File extension of the input files.
+        :param workers: Number of threads used for hashing.
+        :return: Tuple (paths of new or modified files, names of files that disappeared).
+        """
+        to_hash = []
+        seen = set()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.endswith(suffix):
+                    continue
+                seen.add(entry.name)
+                stat = entry.stat()
+                known = self.files.get(entry.name)
+                if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+                    continue  # Unchanged, no need to read the file
+                to_hash.append((entry.name, entry.path, stat))
+
+        changed = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            hashes = executor.map(lambda item: get_file_hash(item[1]), to_hash)
+            for (name, file_path, stat), file_hash in zip(to_hash, hashes):
+                record = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": file_hash}
+                known = self.files.get(name)
+                if known and known["hash"] == file_hash:
+                    self.files[name] = record  # Only touched, the content is the same
+                else:
+                    self._pending[name] = record
+                    changed.append(file_path)
+
+        removed = [name for name in self.files if name not in seen]
+        return changed, removed
+
+    def commit(self, file_paths):
+        """Records the given (successfully indexed) files in the manifest."""
+        for file_path in file_paths:
+            name = os.path.basename(file_path)
+            if name in self._pending:
+                self.files[name] = self._pending.pop(name)
+
+    def remove(self, names):
+        """Drops files from the manifest."""
+        for name in names:
+            self.files.pop(name, None)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files}, f)
+        os.replace(tmp, self.path)
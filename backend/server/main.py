@@ -1,15 +1,35 @@
+import time
+IMPORT_STARTED = time.perf_counter()
 from fastapi import FastAPI
-import chromadb  # Example vector database
-import requests
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 import os
+import json
+import asyncio
+import contextlib
 from fastapi.middleware.cors import CORSMiddleware
-from retrievers import hybrid_similarity_search
-from retrievers import semantic_search, refine_question_with_llm
-from config import ServerConfig
+from retrievers import ahybrid_similarity_search
+from retrievers import asemantic_search, aembed_query
+from config import ServerConfig, startup
+from startup import ComponentUnavailableError
+from cache import normalize_text, get_index_version
+from metrics import RequestTimer, registry, observe_prompt_tokens
+from answer_cache import AnswerCache
 from langdetect import detect
 
+startup.phases["import"] = round(time.perf_counter() - IMPORT_STARTED, 3)
 
-app = FastAPI()
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Models and indexes load in the background; the server answers /ready (503 until loaded) meanwhile
+    warmups = {"language_detection": lambda: detect("Warm up the language profiles.")}
+    if ServerConfig.reranker:
+        warmups["reranker"] = lambda: ServerConfig.reranker.model
+    startup.start(warmups)
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,48 +39,143 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
-# Initialize Vector Database (ChromaDB Example)
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
-collection = chroma_client.get_or_create_collection(name="pdf_data")
 
+@app.exception_handler(ComponentUnavailableError)
+async def component_unavailable(request, exc):
+    # A model or index failed to load; Startup retries it in the background
+    return JSONResponse({"detail": str(exc)}, status_code=503, headers={"Retry-After": str(int(startup.retry_backoff))})
 
-@app.post("/query")
-def query_llm(data: dict):
+
+async def retrieve_context(data: dict):
+    """
+    Runs the retrieval part of a query request without blocking the event loop.
+    The language of the question is detected concurrently with the retrieval.
+
+    :param data: The request body.
+    :return: Dict with the question, conversation history, question used for the search,
+             how it was refined, retrieved results, question language, index version, history key
+             of the answer cache and request timer.
+    """
+    # Requests that arrive during startup wait for the components instead of loading them on the event loop
+    await startup.wait()
+    timer = RequestTimer()
     question = data.get("message", "")
     conversation_history = data.get("content", "")
+    top_k = int(data.get("top_k") or ServerConfig.top_k)
+    fetch_k = int(data.get("fetch_k") or ServerConfig.fetch_k)
 
-    use_hybrid = ServerConfig.use_hybrid
-    llm_model = ServerConfig.llm_model
+    use_hybrid = data.get("use_hybrid")
+    if use_hybrid is None:
+        use_hybrid = ServerConfig.use_hybrid
+    # With the cross-encoder, more candidates are retrieved and re-ranked down to top_k
+    reranker = ServerConfig.reranker if data.get("rerank", True) else None
+    search_k = max(fetch_k, ServerConfig.rerank_fetch_k) if reranker else top_k
+    async_llm_model = ServerConfig.async_llm_model
     embed_model = ServerConfig.embed_model
     vectorstore = ServerConfig.vectorstore
     bm25_retriever = ServerConfig.bm25_retriever
+    embed_executor = ServerConfig.embed_executor
+    embed_batcher = ServerConfig.embed_batcher
+    embedding_cache = ServerConfig.embedding_cache
+    results_cache = ServerConfig.results_cache
+
+    index_version = get_index_version()
+
+    # Detect the language of the question while the documents are retrieved
+    def detect_language():
+        with timer("language_detection"):
+            return detect(question)
+    language_task = asyncio.create_task(asyncio.to_thread(detect_language))
 
     # Retrieve relevant documents
     if use_hybrid:
         # Hybrid-Suche (falls aktiviert)
-        # results = hybrid_similarity_search(
-        #     question, conversation_history, embed_model, vectorstore, bm25_retriever
-        # )
-        pass
+        search_question = question
+        refinement = "hybrid"
+        # The raw question is searched, so a follow-up only means the same thing within the same history
+        history_key = AnswerCache.history_key(conversation_history)
+        results_key = ("hybrid", normalize_text(question), normalize_text(str(conversation_history)), top_k, fetch_k, bool(reranker), index_version)
+        results = results_cache.get(results_key)
+        if results is None:
+            results = await ahybrid_similarity_search(
+                question, conversation_history, embed_model, vectorstore, bm25_retriever,
+                top_k=search_k, fetch_k=max(fetch_k, search_k), executor=embed_executor, batcher=embed_batcher, cache=embedding_cache,
+                timer=timer
+            )
+            if reranker:
+                with timer("rerank"):
+                    results = await asyncio.to_thread(reranker.rerank, question, results, top_k)
+            results_cache.set(results_key, results)
     else:
-        # Refine the question using the LLM
-        refined_question = refine_question_with_llm(question, conversation_history, llm_model)
-        print("Refined question:", refined_question)
+        # Refine the question using the LLM (skipped or cached depending on the refinement policy)
+        with timer("refinement"):
+            refined_question, refinement = await ServerConfig.question_refiner.refine(
+                question, conversation_history, async_llm_model, semaphore=ServerConfig.llm_semaphore
+            )
+        print(f"Refined question ({refinement}):", refined_question)
 
         # Perform semantic search using the refined question
-        results = semantic_search(refined_question, vectorstore, embed_model)
-
-    retrieved_sources = [result["source"] for result in results]
-    retrieved_content = [result["content"] for result in results]
-    content = " ".join(retrieved_content)  # Kontext für das LLM
+        search_question = refined_question
+        history_key = ""  # The refined question carries what it needs from the history
+        results_key = ("semantic", normalize_text(refined_question), top_k, fetch_k, bool(reranker), index_version)
+        results = results_cache.get(results_key)
+        if results is None:
+            results = await asemantic_search(
+                refined_question, vectorstore, embed_model, top_k=search_k, fetch_k=max(fetch_k, search_k),
+                executor=embed_executor, batcher=embed_batcher, cache=embedding_cache, timer=timer
+            )
+            if reranker:
+                with timer("rerank"):
+                    results = await asyncio.to_thread(reranker.rerank, refined_question, results, top_k)
+            results_cache.set(results_key, results)
 
-    # Generate response with llm on question and additional content
-    # Detect the language of the question
-    question_language = detect(question)
+    question_language = await language_task
     print("Question language:", question_language)
 
-    # System prompt to instruct the LLM
-    system_prompt = (
+    return {
+        "question": question,
+        "conversation_history": conversation_history,
+        "search_question": search_question,
+        "refinement": refinement,
+        "results": results,
+        "language": question_language,
+        "index_version": index_version,
+        "history_key": history_key,
+        "timer": timer,
+    }
+
+
+async def lookup_cached_answer(context):
+    """Returns a cached answer for a near-duplicate question with the same retrieved chunks (and history), or None."""
+    answer_cache = ServerConfig.answer_cache
+    if answer_cache is None:
+        return None
+    with context["timer"]("answer_cache"):
+        # The embedding of the search question is usually already in the embedding cache
+        context["search_embedding"] = await aembed_query(
+            context["search_question"], ServerConfig.embed_model, executor=ServerConfig.embed_executor,
+            batcher=ServerConfig.embed_batcher, cache=ServerConfig.embedding_cache
+        )
+        return await asyncio.to_thread(
+            answer_cache.lookup, context["search_embedding"], [result["id"] for result in context["results"]],
+            context["language"], context["index_version"], context["history_key"]
+        )
+
+
+async def store_answer(context, ai_message, retrieved_sources, retrieved_content):
+    """Stores a generated answer in the answer cache (if enabled)."""
+    answer_cache = ServerConfig.answer_cache
+    if answer_cache is None or not ai_message or "search_embedding" not in context:
+        return
+    await asyncio.to_thread(
+        answer_cache.store, context["search_question"], context["search_embedding"],
+        [result["id"] for result in context["results"]], context["language"], context["index_version"],
+        ai_message, retrieved_sources, retrieved_content, context["history_key"]
+    )
+
+
+def build_system_prompt(content, conversation_history, question_language):
+    return (
         f"You are an AI assistant that answers questions based on the provided context. "
         f"Respond in the same language as the user's question ({question_language}). "
         f"Your primary objective is to provide accurate answers using only the additional context. If the context does not fully address the question, politely inform the user and suggest rephrasing if necessary. Avoid using external knowledge or assumptions. "
@@ -70,36 +185,176 @@ def query_llm(data: dict):
         f"Respond in well-structured Markdown. Format headings, lists, and code blocks appropriately. "
         f"Use bullet points for lists and bold or italics for emphasis."
     )
+
+
+def build_conversation(question, conversation_history, results, question_language):
+    """
+    Builds the messages for the answer LLM call from the question, chat history and retrieved context,
+    keeping the prompt within the token budget (see ContextBuilder).
+
+    :return: Tuple (messages, results used in the prompt, dict with the token accounting).
+    """
+    counter = ServerConfig.token_counter
+    fixed_tokens = counter.messages([
+        {"role": "system", "content": build_system_prompt("", "", question_language)},
+        {"role": "user", "content": question},
+    ])
+    selected, history, tokens = ServerConfig.context_builder.build(results, conversation_history, fixed_tokens)
+    content = " ".join(result["content"] for result in selected)  # Kontext für das LLM
     # ---> Idea to use a parser or something like this to print llm response nicely
 
     # Conversation to send to the LLM
     conversation = [
-        {"role": "system", "content": system_prompt},
+        {"role": "system", "content": build_system_prompt(content, history, question_language)},
         {"role": "user", "content": question},
     ]
+    tokens["prompt_tokens"] = counter.messages(conversation)
+    print("Prompt tokens:", tokens)
+    return conversation, selected, tokens
 
-    chat_completion = llm_model.chat.completions.create(
-        model="llama3-8b-8192",
-        messages=conversation,
-    )
+
+@app.post("/query")
+async def query_llm(data: dict):
+    """
+    Answers a question. With "timings": true in the request, the response contains the duration
+    of every pipeline stage in ms (all stages are also exported at /metrics).
+    """
+    context = await retrieve_context(data)
+    timer = context["timer"]
+
+    # Near-duplicate question with the same context: skip the LLM
+    cached = await lookup_cached_answer(context)
+    if cached is not None:
+        timings = timer.finish()
+        response = {**cached, "cached": True, "refinement": context["refinement"], "prompt_tokens": 0}
+        return {**response, "timings": timings} if data.get("timings") else response
+
+    with timer("prompt_build"):
+        conversation, results, tokens = build_conversation(context["question"], context["conversation_history"], context["results"], context["language"])
+    observe_prompt_tokens("query", tokens["prompt_tokens"])
+    retrieved_sources = [result["source"] for result in results]
+    retrieved_content = [result["content"] for result in results]
+
+    # Generate response with llm on question and additional content
+    async with ServerConfig.llm_semaphore:
+        with timer("llm"):
+            chat_completion = await ServerConfig.async_llm_model.chat.completions.create(
+                model="llama3-8b-8192",
+                messages=conversation,
+                max_tokens=ServerConfig.answer_max_tokens,
+            )
 
     # ai_message = chat_completion.json()["choices"][0]["message"]["content"]
     ai_message = chat_completion.choices[0].message.content
     print("AI response:", ai_message)
+    await store_answer(context, ai_message, retrieved_sources, retrieved_content)
+    timings = timer.finish()
 
-    return {
+    response = {
         "response": ai_message,
         "sources": retrieved_sources,
-        "content": retrieved_content
+        "content": retrieved_content,
+        "cached": False,
+        "refinement": context["refinement"],
+        "prompt_tokens": tokens["prompt_tokens"],
     }
+    return {**response, "timings": timings} if data.get("timings") else response
+
+
+@app.post("/query/stream")
+async def query_llm_stream(data: dict):
+    """
+    Streaming variant of /query. Returns newline-delimited JSON events: first the retrieved
+    sources ({"type": "sources"}), then the LLM tokens as they arrive ({"type": "token"}),
+    and finally {"type": "done"} (or {"type": "error"}). With "timings": true in the request,
+    the done event contains the stage timings in ms.
+    """
+    context = await retrieve_context(data)
+    timer = context["timer"]
+    cached = await lookup_cached_answer(context)
+    with timer("prompt_build"):
+        conversation, results, tokens = build_conversation(context["question"], context["conversation_history"], context["results"], context["language"])
+    retrieved_sources = [result["source"] for result in results]
+    retrieved_content = [result["content"] for result in results]
+
+    def done_event():
+        timings = timer.finish()
+        return json.dumps({"type": "done", "timings": timings} if data.get("timings") else {"type": "done"}) + "\n"
+
+    async def event_stream():
+        if cached is not None:
+            yield json.dumps({"type": "sources", "sources": cached["sources"], "content": cached["content"], "cached": True, "refinement": context["refinement"], "prompt_tokens": 0}) + "\n"
+            yield json.dumps({"type": "token", "token": cached["response"]}) + "\n"
+            yield done_event()
+            return
+
+        observe_prompt_tokens("query_stream", tokens["prompt_tokens"])
+        yield json.dumps({"type": "sources", "sources": retrieved_sources, "content": retrieved_content, "cached": False, "refinement": context["refinement"], "prompt_tokens": tokens["prompt_tokens"]}) + "\n"
+        pieces = []  # Streamed parts of the answer
+        try:
+            async with ServerConfig.llm_semaphore:
+                with timer("llm"):
+                    llm_started = time.perf_counter()
+                    stream = await ServerConfig.async_llm_model.chat.completions.create(
+                        model="llama3-8b-8192",
+                        messages=conversation,
+                        max_tokens=ServerConfig.answer_max_tokens,
+                        stream=True,
+                    )
+                    async for chunk in stream:
+                        token = chunk.choices[0].delta.content if chunk.choices else None
+                        if token:
+                            if not pieces:
+                                timer.record("llm_first_token", time.perf_counter() - llm_started)
+                            pieces.append(token)
+                            yield json.dumps({"type": "token", "token": token}) + "\n"
+        except Exception as e:
+            print(f"Error streaming LLM response: {e}")
+            yield json.dumps({"type": "error", "error": str(e)}) + "\n"
+            return
+        yield done_event()
+        await store_answer(context, "".join(pieces), retrieved_sources, retrieved_content)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/config/models")
-def get_model_config():
+async def get_model_config():
     """Retrieve the current model configuration."""
+    await startup.wait()
     return {
         "use_hybrid": ServerConfig.use_hybrid,
         "llm_model": str(ServerConfig.llm_model.__class__.__name__),
         "embed_model": str(ServerConfig.embed_model.__class__.__name__),
-        "bm25_retriever": ServerConfig.bm25_retriever
+        "vectorstore": str(ServerConfig.vectorstore.__class__.__name__),
+        "bm25_retriever": str(ServerConfig.bm25_retriever.__class__.__name__),
+        "bm25_documents": len(ServerConfig.bm25_retriever)
     }
 
+@app.get("/metrics")
+def get_metrics():
+    """Stage latency and prompt token histograms in the Prometheus text format."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/ready")
+def get_readiness():
+    """Readiness probe: 200 once all required components are loaded, else 503; with per-component status and startup phase timings."""
+    status = startup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/stats")
+async def get_stats():
+    """Runtime metrics of the query pipeline."""
+    await startup.wait()
+    return {
+        "embedding": ServerConfig.embed_batcher.stats(),
+        "embedding_cache": ServerConfig.embedding_cache.stats(),
+        "results_cache": ServerConfig.results_cache.stats(),
+        "answer_cache": ServerConfig.answer_cache.stats() if ServerConfig.answer_cache else None,
+        "refinement": ServerConfig.question_refiner.stats(),
+        "vectorstore": ServerConfig.vectorstore.stats() if hasattr(ServerConfig.vectorstore, "stats") else None,
+        "reranker": ServerConfig.reranker.stats() if ServerConfig.reranker else None,
+    }
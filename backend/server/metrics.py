@@ -0,0 +1,116 @@
+import time
+import threading
+import contextlib
+
+# Upper bounds of the latency buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))
+TOKEN_BUCKETS = (256, 512, 1024, 2048, 4096, 6144, 8192, float("inf"))
+
+
+class Histogram:
+    """Thread-safe cumulative histogram in the Prometheus sense (bucket counts, sum and count)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+def format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+class MetricsRegistry:
+    """Histograms per label value, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._histograms = {}  # (metric name, label name, label value) -> Histogram
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, label, value, help_text="", buckets=LATENCY_BUCKETS):
+        key = (name, label, value)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(buckets))
+                self._help.setdefault(name, help_text)
+        return histogram
+
+    def render(self):
+        # Request threads add series while rendering, so both dicts are copied under the lock
+        with self._lock:
+            help_texts = dict(self._help)
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0][2])
+        lines = []
+        for name in sorted(help_texts):
+            lines.append(f"# HELP {name} {help_texts[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, label, value), histogram in histograms:
+                if metric != name:
+                    continue
+                counts, total, count = histogram.snapshot()
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{{label}="{value}",le="{format_bound(bound)}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{label}="{value}"}} {total}')
+                lines.append(f'{name}_count{{{label}="{value}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def observe_stage(stage, seconds):
+    registry.histogram("rag_stage_duration_seconds", "stage", stage, "Duration of the query pipeline stages.").observe(seconds)
+
+
+def observe_prompt_tokens(endpoint, tokens):
+    registry.histogram(
+        "rag_prompt_tokens", "endpoint", endpoint, "Prompt tokens of the answer LLM call.", buckets=TOKEN_BUCKETS
+    ).observe(tokens)
+
+
+class RequestTimer:
+    """
+    Collects the stage timings of one request. Calling the timer with a stage name returns a context
+    manager that records the duration in the request's timings (ms) and in the stage histogram.
+    Stages that run several times per request (e.g. concurrent embeddings) are summed.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+
+    @contextlib.contextmanager
+    def __call__(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def record(self, stage, seconds):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds * 1000
+        observe_stage(stage, seconds)
+
+    def finish(self, stage="total"):
+        """Records the time since the request started and returns the timings in ms."""
+        self.record(stage, time.perf_counter() - self.started)
+        return {name: round(ms, 2) for name, ms in self.timings.items()}
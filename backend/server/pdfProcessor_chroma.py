@@ -1,17 +1,18 @@
 import os
-import pickle
+import sys
+import json
 import hashlib
+import sqlite3
 import numpy as np
-from langchain_experimental.text_splitter import SemanticChunker
-from langchain_openai.embeddings import OpenAIEmbeddings
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_chroma import Chroma
-from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
-from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from dotenv import load_dotenv
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from config import ServerConfig
+from startup import DeferredEmbeddings
+from bm25_index import BM25Index
+from cache import bump_index_version
+from pdf_pipeline import IngestionPipeline
+from file_manifest import FileManifest
+from embedding_store import EmbeddingStore
 
 load_dotenv()
 SEM_CHUNK_API_KEY = os.getenv("SEM_CHUNK_API_KEY")
@@ -19,11 +20,29 @@ SEM_CHUNK_API_KEY = os.getenv("SEM_CHUNK_API_KEY")
 # paths
 INPUT_PDF_FOLDER = "data/archive/"
 INDEX_FOLDER = "data/indexes/"
-PROCESSED_FILES_FILE = os.path.join(INDEX_FOLDER, "processed_files.pkl")
+PROCESSED_FILES_FILE = os.path.join(INDEX_FOLDER, "processed_files.pkl")  # Legacy, migrated to the manifest
+MANIFEST_FILE = os.path.join(INDEX_FOLDER, "manifest.json")
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", 8))  # Threads for hashing changed files
+DELETE_BATCH_SIZE = 5000  # Chunk IDs per delete call
+BM25_COMPACT_RATIO = 0.25  # Compact the BM25 index once this fraction of its rows is dead
+
+# Ingestion pipeline settings
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", os.cpu_count() or 1))  # Parser processes
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", 256))  # Chunks per embedding call
+EMBEDDING_STORE_FOLDER = os.path.join(INDEX_FOLDER, "embeddings")  # Content-addressed cache of chunk embeddings
+EMBEDDING_STORE_DTYPE = os.getenv("EMBEDDING_STORE_DTYPE", "float32")  # "float32" or "float16"
+
+text_splitterSem = None  # Created on first use by get_semantic_splitter
+
+def get_semantic_splitter():
+    """SemanticChunker with OpenAI embeddings, created on first use (langchain_openai is slow to import)."""
+    global text_splitterSem
+    if text_splitterSem is None:
+        from langchain_experimental.text_splitter import SemanticChunker
+        from langchain_openai.embeddings import OpenAIEmbeddings
+        text_splitterSem = SemanticChunker(OpenAIEmbeddings(api_key=SEM_CHUNK_API_KEY))
+    return text_splitterSem
 
-# Initialize embedding model
-text_splitterSem = SemanticChunker(OpenAIEmbeddings(api_key=SEM_CHUNK_API_KEY))
-embed_model = ServerConfig.embed_model
 text_splitterRec = RecursiveCharacterTextSplitter(
     chunk_size=500,
     chunk_overlap=20,
@@ -34,76 +53,174 @@ text_splitterRec = RecursiveCharacterTextSplitter(
 
 # Chroma storage path
 CHROMA_DB_PATH = os.path.join(INDEX_FOLDER, "chroma")
-vectorstore = Chroma(persist_directory=CHROMA_DB_PATH, embedding_function=embed_model)
-
-def get_file_hash(file_path):
-    hasher = hashlib.md5()
-    with open(file_path, "rb") as f:
-        hasher.update(f.read())
-    return hasher.hexdigest()
-
-def process_batch(batch):
-    try:
-        vectorstore.add_documents(batch)
-    except Exception as e:
-        print(f"Error processing batch: {e}")
+_vectorstore = None  # Opened on first use by get_vectorstore
+
+def get_vectorstore():
+    """
+    The Chroma collection, opened on first use. Importing this module loads neither the index nor the
+    embedding model (ServerConfig.embed_model, resolved when chunks are embedded), which keeps the
+    import cheap, e.g. when the spawned parser processes of the pipeline import the main module.
+    """
+    global _vectorstore
+    if _vectorstore is None:
+        from langchain_chroma import Chroma
+        _vectorstore = Chroma(persist_directory=CHROMA_DB_PATH, embedding_function=DeferredEmbeddings(lambda: ServerConfig.embed_model))
+    return _vectorstore
+
+# BM25 keyword index, stored next to the Chroma index and updated with the same chunk IDs
+BM25_INDEX_PATH = os.path.join(INDEX_FOLDER, "bm25")
+# Optional FAISS index of the server (see faiss_store.py), rebuilt from Chroma by rebuild_faiss_index.
+# A rebuild costs as much for one changed PDF as for all of them, so by default ("manual") ingestion
+# only reports that the index is out of date; "auto" rebuilds it whenever chunks were added or deleted
+FAISS_INDEX_PATH = os.path.join(INDEX_FOLDER, "faiss")
+FAISS_REBUILD = os.getenv("FAISS_REBUILD", "manual")
+
+def make_chunk(file_path, ordinal, text):
+    """
+    Returns the chunk ID and metadata of a chunk. The ID is derived from the source, the chunk ordinal
+    and the content hash, so an unchanged chunk keeps its ID when its file is indexed again.
+    """
+    content_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    chunk_id = hashlib.sha1(f"{file_path}\x00{ordinal}\x00{content_hash}".encode("utf-8")).hexdigest()
+    return chunk_id, {"source": file_path, "chunk_id": chunk_id}
+
+def get_source_chunk_ids(file_path):
+    """IDs of all chunks stored for a source file."""
+    return set(get_vectorstore()._collection.get(where={"source": file_path}, include=[])["ids"])
+
+def delete_chunks(chunk_ids, bm25_index):
+    """Deletes chunks from the Chroma collection and the BM25 index in batches."""
+    chunk_ids = list(chunk_ids)
+    vectorstore = get_vectorstore()
+    for i in range(0, len(chunk_ids), DELETE_BATCH_SIZE):
+        vectorstore._collection.delete(ids=chunk_ids[i:i + DELETE_BATCH_SIZE])
+    bm25_index.delete(chunk_ids)
+
+def compact_index():
+    """
+    Reclaims the space of deleted chunks: drops their rows from the BM25 index and vacuums the Chroma
+    SQLite database. Chroma reuses the slots of deleted vectors in its HNSW index on later inserts.
+    """
+    bm25_index = BM25Index.load_or_build(BM25_INDEX_PATH, get_vectorstore())
+    print(f"Compacting BM25 index ({bm25_index.dead_ratio():.0%} dead rows)...")
+    bm25_index.compact()
+    bm25_index.save()
+
+    chroma_sqlite = os.path.join(CHROMA_DB_PATH, "chroma.sqlite3")
+    if os.path.exists(chroma_sqlite):
+        size_before = os.path.getsize(chroma_sqlite)
+        connection = sqlite3.connect(chroma_sqlite)
+        try:
+            connection.execute("VACUUM")
+        finally:
+            connection.close()
+        print(f"Vacuumed Chroma database: {size_before / 1e6:.1f} MB -> {os.path.getsize(chroma_sqlite) / 1e6:.1f} MB")
+
+    bump_index_version()
+
+def rebuild_faiss_index():
+    """
+    Rebuilds the FAISS index from the whole Chroma collection, with the index type it was built with.
+    The cost grows with the collection, not with the change: all chunks and embeddings are exported
+    into memory (4 bytes per dimension and chunk) and the quantized index types are trained again.
+    """
+    meta_path = os.path.join(FAISS_INDEX_PATH, "meta.json")
+    if not os.path.exists(meta_path):
+        print(f"No FAISS index in {FAISS_INDEX_PATH}; build one with `python faiss_store.py --index-type TYPE`.")
+        return
+    from faiss_store import FaissVectorStore
+    with open(meta_path, "r", encoding="utf-8") as f:
+        faiss_index_type = json.load(f)["index_type"]
+    FaissVectorStore.build_from_chroma(FAISS_INDEX_PATH, get_vectorstore(), index_type=faiss_index_type)
+    bump_index_version()
 
 def process_pdfs_and_create_index():
-    if os.path.exists(PROCESSED_FILES_FILE):
-        with open(PROCESSED_FILES_FILE, "rb") as f:
-            processed_files = pickle.load(f)
-    else:
-        processed_files = {}
-    
-    new_files = []
-    for file_name in os.listdir(INPUT_PDF_FOLDER):
-        if file_name.endswith(".pdf"):
-            file_path = os.path.join(INPUT_PDF_FOLDER, file_name)
-            file_hash = get_file_hash(file_path)
-            if file_name not in processed_files or processed_files[file_name] != file_hash:
-                new_files.append(file_path)
-                processed_files[file_name] = file_hash
-
-    if not new_files:
+    # Only files whose size or mtime changed are hashed
+    manifest = FileManifest.load(MANIFEST_FILE, legacy_file=PROCESSED_FILES_FILE)
+    new_files, removed_files = manifest.scan(INPUT_PDF_FOLDER, workers=HASH_WORKERS)
+
+    if not new_files and not removed_files:
+        manifest.save()
         print("No new PDFs to process.")
         return
 
-    print(f"Processing {len(new_files)} new/modified PDFs...")
-
-    # Process new files
-    new_chunks = []
-    for file_path in new_files:
-        # Load and combine PDF content
-        loader = PyPDFLoader(file_path)
-        documents = loader.load()
-        combined_text = "\n".join([doc.page_content for doc in documents])  # Combine all pages
-
-        # Split into chunks
-        chunks = text_splitterRec.create_documents([combined_text])
-        for chunk in chunks:
-            chunk.metadata["source"] = file_path  # Add source metadata
-        
-        new_chunks.extend(chunks)
-        print(f"Reading of {file_path} done!")
-
-    # Add new chunks to the Chroma vector store
-    batch_size = 1000
-    if new_chunks:
-        batches = [new_chunks[i:i+batch_size] for i in range(0, len(new_chunks), batch_size)]
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            futures = [executor.submit(process_batch, batch) for batch in batches]
-            for future in as_completed(futures):
-                future.result()
-                # print(f"{i} chunks added of total {len(new_chunks)} chunks ...")
-        
-        print(f"Added {len(new_chunks)} chunks to the vector store.")
-
-    # Save the updated processed files list
-    with open(PROCESSED_FILES_FILE, "wb") as f:
-        pickle.dump(processed_files, f)
-
-    print(f"Updated processed files list with {len(new_files)} PDFs.")
+    print(f"Processing {len(new_files)} new/modified PDFs and {len(removed_files)} removed PDFs...")
+
+    embed_model = ServerConfig.embed_model
+    vectorstore = get_vectorstore()
+    bm25_index = BM25Index.load_or_build(BM25_INDEX_PATH, vectorstore)
+
+    # Source file -> chunks of removed PDFs and chunks that no longer exist in modified PDFs
+    stale_ids_by_file = {}
+    for file_name in removed_files:
+        file_path = os.path.join(INPUT_PDF_FOLDER, file_name)
+        stale_ids_by_file[file_path] = get_source_chunk_ids(file_path)
+
+    def prepare_file(file_path, chunk_ids):
+        stored_ids = get_source_chunk_ids(file_path)
+        stale_ids_by_file[file_path] = stored_ids.difference(chunk_ids)
+        # Unchanged chunks keep their ID and are not embedded again
+        return stored_ids.intersection(chunk_ids)
+
+    def write_batch(ids, texts, metadatas, embeddings):
+        # The chunks are already embedded, so they are written to the collection directly
+        vectorstore._collection.upsert(ids=ids, embeddings=embeddings, documents=texts, metadatas=metadatas)
+        # Only tokenize the chunks that were stored in the vector store
+        bm25_index.add_documents(ids, texts, metadatas)
+
+    # Chunk texts that were embedded before (e.g. unchanged parts of an edited PDF) are read from the store
+    embedding_store = EmbeddingStore(EMBEDDING_STORE_FOLDER, embed_model.model_name, dtype=EMBEDDING_STORE_DTYPE)
+
+    # Parse, split, embed and store the new files as a stream of bounded batches
+    pipeline = IngestionPipeline(
+        embed_model,
+        write_batch,
+        make_chunk,
+        prepare_file=prepare_file,
+        embedding_store=embedding_store,
+        parse_workers=PARSE_WORKERS,
+        embed_batch_size=EMBED_BATCH_SIZE,
+    )
+    stats = pipeline.run(new_files)
+    print(f"Added {stats['chunks']} chunks to the vector store ({stats['chunks_per_second']:.1f} chunks/s), "
+          f"{stats['skipped_chunks']} unchanged chunks kept.")
+    store_stats = embedding_store.stats()
+    print(f"Embedding store: {store_stats['hits']} cached, {store_stats['misses']} newly embedded chunks.")
+
+    # Remove the stale chunks once the new ones are stored. A file whose new chunks could not be
+    # stored keeps its old ones until it is indexed again
+    failed_files = set(pipeline.failed_paths)
+    stale_ids = set().union(*(ids for file_path, ids in stale_ids_by_file.items() if file_path not in failed_files))
+    if stale_ids:
+        delete_chunks(stale_ids, bm25_index)
+        print(f"Deleted {len(stale_ids)} stale chunks.")
+        if bm25_index.dead_ratio() > BM25_COMPACT_RATIO:
+            bm25_index.compact()
+
+    if stats["chunks"] or stale_ids:
+        bm25_index.save()
+        if os.path.exists(FAISS_INDEX_PATH):
+            if FAISS_REBUILD == "auto":
+                rebuild_faiss_index()
+            else:
+                print(f"The FAISS index in {FAISS_INDEX_PATH} is out of date ({stats['chunks']} chunks added, "
+                      f"{len(stale_ids)} deleted); rebuild it with `python pdfProcessor_chroma.py faiss`.")
+        # Invalidate cached retrieval results of running servers
+        bump_index_version()
+
+    # Save the updated manifest; failed files stay unrecorded and are retried on the next run
+    indexed_files = [file_path for file_path in new_files if file_path not in failed_files]
+    manifest.commit(indexed_files)
+    manifest.remove(removed_files)
+    manifest.save()
+
+    print(f"Updated manifest with {len(indexed_files)} PDFs.")
 
 
 if __name__ == "__main__":
-    process_pdfs_and_create_index()
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "compact":
+        compact_index()
+    elif len(sys.argv) > 1 and sys.argv[1] == "faiss":
+        rebuild_faiss_index()
+    else:
+        process_pdfs_and_create_index()
\ No newline at end of file
@@ -0,0 +1,194 @@
+import os
+import time
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# Splitter of the current worker process, created on first use
+_splitter = None
+
+
+def _get_splitter(chunk_size, chunk_overlap):
+    global _splitter
+    if _splitter is None:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        _splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len,
+            is_separator_regex=True,
+            separators=["\n", " ", ".", ","]
+        )
+    return _splitter
+
+
+def parse_and_split(file_path, chunk_size=500, chunk_overlap=20):
+    """
+    Process-pool worker: loads a PDF, combines its pages and splits the text into chunks.
+
+    :param file_path: Path of the PDF.
+    :return: Tuple (file_path, list of chunk texts).
+    """
+    from langchain_community.document_loaders import PyPDFLoader
+
+    documents = PyPDFLoader(file_path).load()
+    combined_text = "\n".join([doc.page_content for doc in documents])  # Combine all pages
+    return file_path, _get_splitter(chunk_size, chunk_overlap).split_text(combined_text)
+
+
+class IngestionPipeline:
+    """
+    Streaming PDF ingestion in four stages: parse -> split -> embed -> upsert.
+
+    PDFs are parsed and split in a process pool, at most max_pending_files at a time. The workers are
+    spawned (not forked) and only import this module, so they neither inherit the threads and the
+    embedding runtime of the parent nor load the model themselves. The chunks flow
+    through bounded queues to an embedding thread, which embeds them in large batches, and on to a
+    writer thread, which stores every batch as soon as it is ready. Because every stage is bounded,
+    peak memory does not depend on the size of the archive.
+    """
+
+    _DONE = object()
+
+    def __init__(self, embed_model, write_batch, make_chunk, prepare_file=None, embedding_store=None, parse_workers=None,
+                 embed_batch_size=256, max_pending_files=None, queue_size=4, chunk_size=500, chunk_overlap=20):
+        """
+        :param embed_model: Embedding model with embed_documents.
+        :param write_batch: Callable (ids, texts, metadatas, embeddings) that stores one batch.
+        :param make_chunk: Callable (file_path, ordinal, text) -> (chunk ID, metadata) for every chunk.
+        :param prepare_file: Optional callable (file_path, chunk IDs) -> set of chunk IDs that are already
+                             stored; those chunks are neither embedded nor written again.
+        :param embedding_store: Optional EmbeddingStore; only chunk texts it does not contain are embedded.
+        :param parse_workers: Number of parser processes (default: number of CPUs).
+        :param embed_batch_size: Number of chunks embedded per forward pass.
+        :param max_pending_files: Maximum number of PDFs being parsed or waiting to be embedded.
+        :param queue_size: Capacity of the queues between the stages.
+        """
+        self.embed_model = embed_model
+        self.write_batch = write_batch
+        self.make_chunk = make_chunk
+        self.prepare_file = prepare_file
+        self.embedding_store = embedding_store
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.embed_batch_size = embed_batch_size
+        self.max_pending_files = max_pending_files or 2 * self.parse_workers
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self._chunk_queue = queue.Queue(maxsize=queue_size)
+        self._write_queue = queue.Queue(maxsize=queue_size)
+        self.stats = {"files": 0, "failed_files": 0, "chunks": 0, "skipped_chunks": 0, "failed_batches": 0, "seconds": 0.0}
+        self.failed_paths = []  # PDFs that could not be read or stored
+
+    def run(self, file_paths):
+        """
+        Ingests the given PDFs.
+
+        :return: Dict with the number of files and chunks, failures, duration and throughput.
+        """
+        started = time.perf_counter()
+        # The pool is created before the stage threads start
+        executor = ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=multiprocessing.get_context("spawn"))
+        embed_thread = threading.Thread(target=self._embed_stage, name="ingest-embed", daemon=True)
+        write_thread = threading.Thread(target=self._write_stage, name="ingest-write", daemon=True)
+        embed_thread.start()
+        write_thread.start()
+
+        try:
+            with executor:
+                self._parse_stage(executor, file_paths)
+        finally:
+            self._chunk_queue.put(self._DONE)
+            embed_thread.join()
+            write_thread.join()
+            if self.embedding_store is not None:
+                self.embedding_store.save()
+
+        self.stats["seconds"] = time.perf_counter() - started
+        self.stats["chunks_per_second"] = self.stats["chunks"] / self.stats["seconds"] if self.stats["seconds"] else 0.0
+        return self.stats
+
+    def _parse_stage(self, executor, file_paths):
+        file_paths = iter(file_paths)
+        pending = set()
+        while True:
+            # Keep at most max_pending_files PDFs in flight (backpressure from the embedding stage)
+            for file_path in file_paths:
+                future = executor.submit(parse_and_split, file_path, self.chunk_size, self.chunk_overlap)
+                future.file_path = file_path
+                pending.add(future)
+                if len(pending) >= self.max_pending_files:
+                    break
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    file_path, texts = future.result()
+                except Exception as e:
+                    print(f"Error reading PDF {future.file_path}: {e}")
+                    self.stats["failed_files"] += 1
+                    self.failed_paths.append(future.file_path)
+                    continue
+                self._chunk_queue.put((file_path, texts))  # Blocks while the embedding stage is busy
+                self.stats["files"] += 1
+                print(f"Reading of {file_path} done!")
+
+    def _embed_stage(self):
+        ids, texts, metadatas = [], [], []
+        while True:
+            item = self._chunk_queue.get()
+            if item is self._DONE:
+                break
+            file_path, file_texts = item
+            chunks = [self.make_chunk(file_path, ordinal, text) for ordinal, text in enumerate(file_texts)]
+            stored = set()
+            if self.prepare_file is not None:
+                try:
+                    stored = self.prepare_file(file_path, [chunk_id for chunk_id, _ in chunks])
+                except Exception as e:
+                    print(f"Error preparing {file_path}: {e}")
+            for (chunk_id, metadata), text in zip(chunks, file_texts):
+                if chunk_id in stored:
+                    self.stats["skipped_chunks"] += 1
+                    continue
+                ids.append(chunk_id)
+                texts.append(text)
+                metadatas.append(metadata)
+                if len(ids) >= self.embed_batch_size:
+                    self._embed_batch(ids, texts, metadatas)
+                    ids, texts, metadatas = [], [], []
+        if ids:
+            self._embed_batch(ids, texts, metadatas)
+        self._write_queue.put(self._DONE)
+
+    def _embed_batch(self, ids, texts, metadatas):
+        try:
+            if self.embedding_store is not None:
+                embeddings = self.embedding_store.embed(texts, self.embed_model.embed_documents).tolist()
+            else:
+                embeddings = self.embed_model.embed_documents(texts)
+        except Exception as e:
+            print(f"Error embedding batch: {e}")
+            self._batch_failed(metadatas)
+            return
+        self._write_queue.put((ids, texts, metadatas, embeddings))
+
+    def _write_stage(self):
+        while True:
+            item = self._write_queue.get()
+            if item is self._DONE:
+                break
+            ids, texts, metadatas, embeddings = item
+            try:
+                self.write_batch(ids, texts, metadatas, embeddings)
+                self.stats["chunks"] += len(ids)
+            except Exception as e:
+                print(f"Error processing batch: {e}")
+                self._batch_failed(metadatas)
+
+    def _batch_failed(self, metadatas):
+        self.stats["failed_batches"] += 1
+        # The files of a failed batch are not recorded as indexed, so they are retried on the next run
+        self.failed_paths.extend({metadata["source"] for metadata in metadatas} - set(self.failed_paths))
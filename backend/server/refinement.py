@@ -0,0 +1,88 @@
+import re
+import hashlib
+from cache import normalize_text
+from retrievers import arefine_question_with_llm
+
+REFINEMENT_POLICIES = ("always", "history", "heuristic")
+
+# Words that usually refer back to earlier messages (English and German)
+CONTEXT_REFERENCES = {
+    "it", "its", "this", "that", "these", "those", "they", "them", "their", "he", "she", "him", "her",
+    "there", "above", "previous", "former", "latter", "same", "also", "else", "more", "again",
+    "es", "dies", "diese", "dieser", "dieses", "das", "dazu", "davon", "darüber", "damit", "dort",
+    "sie", "ihr", "ihm", "ihn", "ihre", "oben", "vorher", "auch", "noch",
+}
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def is_self_contained(question, min_words=4):
+    """
+    Cheap heuristic: a question is self-contained if it is not too short and contains no words
+    that refer back to the conversation (pronouns, demonstratives, "also", ...).
+    """
+    words = WORD_PATTERN.findall(question.lower())
+    return len(words) >= min_words and not any(word in CONTEXT_REFERENCES for word in words)
+
+
+class QuestionRefiner:
+    """
+    Decides whether the user's question is refined by the LLM before the semantic search.
+
+    Policies:
+    - "always": every question is refined.
+    - "history": questions without conversation history are used as they are.
+    - "heuristic": additionally, self-contained questions (see is_self_contained) are used as they are.
+    Refinements are cached by (history hash, question), so a repeated question costs no LLM call.
+    """
+
+    def __init__(self, policy="heuristic", cache=None):
+        if policy not in REFINEMENT_POLICIES:
+            raise ValueError(f"Unknown refinement policy '{policy}', expected one of {REFINEMENT_POLICIES}")
+        self.policy = policy
+        self.cache = cache
+        self.counts = {"llm": 0, "cache_hit": 0, "skipped_no_history": 0, "skipped_self_contained": 0}
+
+    def _skip_reason(self, question, conversation_history):
+        if self.policy == "always":
+            return None
+        has_history = bool(conversation_history.strip() if isinstance(conversation_history, str) else conversation_history)
+        if not has_history:
+            return "skipped_no_history"
+        if self.policy == "heuristic" and is_self_contained(question):
+            return "skipped_self_contained"
+        return None
+
+    async def refine(self, question, conversation_history, llm_client, semaphore=None):
+        """
+        Returns the question to search with and how it was obtained
+        ("llm", "cache_hit", "skipped_no_history" or "skipped_self_contained").
+        """
+        reason = self._skip_reason(question, conversation_history)
+        if reason:
+            self.counts[reason] += 1
+            return question, reason
+
+        key = None
+        if self.cache is not None:
+            history_hash = hashlib.sha1(str(conversation_history).encode("utf-8")).hexdigest()
+            key = ("refinement", history_hash, normalize_text(question))
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.counts["cache_hit"] += 1
+                return cached, "cache_hit"
+
+        refined_question = await arefine_question_with_llm(question, conversation_history, llm_client, semaphore=semaphore)
+        self.counts["llm"] += 1
+        if key is not None:
+            self.cache.set(key, refined_question)
+        return refined_question, "llm"
+
+    def stats(self):
+        total = sum(self.counts.values())
+        skipped = total - self.counts["llm"]
+        return {
+            "policy": self.policy,
+            **self.counts,
+            "total": total,
+            "llm_calls_avoided_rate": skipped / total if total else 0.0,
+        }
@@ -0,0 +1,89 @@
+import time
+import threading
+
+
+class CrossEncoderReranker:
+    """
+    Re-ranks retrieved candidates with a small cross-encoder (fastembed TextCrossEncoder, ONNX on CPU).
+
+    All candidates are scored in one batched call. To stay within max_latency_ms, the number of
+    candidates is capped using the measured per-candidate latency (the first-stage order decides which
+    are dropped), and scoring stops early once the budget is used up; candidates that were not scored
+    keep their first-stage order behind the scored ones.
+    """
+
+    def __init__(self, model_name="Xenova/ms-marco-MiniLM-L-6-v2", max_latency_ms=150, batch_size=32, threads=None):
+        self.model_name = model_name
+        self.max_latency_ms = max_latency_ms
+        self.batch_size = batch_size
+        self.threads = threads
+        self._model = None
+        self._lock = threading.Lock()
+        self._ms_per_candidate = None  # Moving average of the scoring latency
+        self.calls = 0
+        self.candidates = 0
+        self.scored = 0
+        self.total_ms = 0.0
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from fastembed.rerank.cross_encoder import TextCrossEncoder
+                    self._model = TextCrossEncoder(model_name=self.model_name, threads=self.threads)
+        return self._model
+
+    def _candidate_limit(self, count):
+        if self._ms_per_candidate is None or not self.max_latency_ms:
+            return count
+        return max(min(count, int(self.max_latency_ms / self._ms_per_candidate)), 1)
+
+    def rerank(self, query, results, top_k=5):
+        """
+        :param query: The search question.
+        :param results: First-stage results ({"id", "content", "source", "score"}), best first.
+        :param top_k: Number of results to return.
+        :return: The top_k results ordered by cross-encoder score; "score" holds the cross-encoder score
+                 and "retrieval_score" the first-stage score.
+        """
+        if not results:
+            return []
+        started = time.perf_counter()
+        limit = self._candidate_limit(len(results))
+
+        scores = []
+        documents = [result["content"] for result in results[:limit]]
+        for start in range(0, len(documents), self.batch_size):
+            scores.extend(self.model.rerank(query, documents[start:start + self.batch_size], batch_size=self.batch_size))
+            if self.max_latency_ms and (time.perf_counter() - started) * 1000 > self.max_latency_ms:
+                break  # Budget used up, the remaining candidates keep their first-stage order
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        per_candidate = elapsed_ms / len(scores)
+        self._ms_per_candidate = per_candidate if self._ms_per_candidate is None else 0.8 * self._ms_per_candidate + 0.2 * per_candidate
+        self.calls += 1
+        self.candidates += len(results)
+        self.scored += len(scores)
+        self.total_ms += elapsed_ms
+
+        scored = sorted(
+            ({**result, "retrieval_score": result["score"], "score": float(score)} for result, score in zip(results, scores)),
+            key=lambda result: result["score"],
+            reverse=True,
+        )
+        lowest = scored[-1]["score"]
+        unscored = [
+            {**result, "retrieval_score": result["score"], "score": lowest - 1.0 - i}
+            for i, result in enumerate(results[len(scores):])
+        ]
+        return (scored + unscored)[:top_k]
+
+    def stats(self):
+        return {
+            "model": self.model_name,
+            "calls": self.calls,
+            "mean_candidates": self.candidates / self.calls if self.calls else 0.0,
+            "scored_rate": self.scored / self.candidates if self.candidates else 0.0,
+            "mean_latency_ms": self.total_ms / self.calls if self.calls else 0.0,
+        }
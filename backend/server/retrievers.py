@@ -1,25 +1,81 @@
-from rank_bm25 import BM25Okapi
-from nltk.tokenize import word_tokenize
+import asyncio
+import contextlib
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 
 
 class BM25Retriever:
-    def __init__(self, bm25, documents):
-        self.bm25 = bm25
-        self.documents = documents
+    """
+    Keyword retriever on top of the persisted BM25Index. The index only holds chunk IDs,
+    the content of the hits is looked up in the vectorstore.
+    """
+
+    def __init__(self, bm25_index, vectorstore):
+        self.index = bm25_index
+        self.vectorstore = vectorstore
+
+    def __len__(self):
+        return len(self.index)
+
+    def search(self, query, top_k=5):
+        """Returns (chunk ID, score, source) tuples for the query, best first."""
+        return self.index.search(query, top_k=top_k)
 
     def get_relevant_documents(self, query, top_k=5):
-        tokenized_query = word_tokenize(query.lower())
-        scores = self.bm25.get_scores(tokenized_query)
-        top_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
+        return self.get_relevant_documents_batch([query], top_k=top_k)[0]
+
+    def get_relevant_documents_batch(self, queries, top_k=5):
+        """
+        Retrieves the relevant documents for several queries, scored in one sparse matrix product.
+
+        :param queries: List of query strings.
+        :param top_k: Number of documents per query.
+        :return: One list of documents per query.
+        """
+        hits = self.index.search_batch(queries, top_k=top_k)
+        found = get_chunks(self.vectorstore, list({doc_id for query_hits in hits for doc_id, _, _ in query_hits}))
         return [
-            {"page_content": self.documents[i]["content"], "metadata": self.documents[i].get("metadata", {})}
-            for i in top_indices
+            [
+                {"id": doc_id, "page_content": found[doc_id][0], "metadata": found[doc_id][1], "score": score}
+                for doc_id, score, _ in query_hits
+                if doc_id in found
+            ]
+            for query_hits in hits
         ]
 
 
+def get_chunks(vectorstore, ids):
+    """
+    Looks up the content and metadata of chunks by ID.
+
+    :param vectorstore: The (langchain) Chroma vectorstore or a FaissVectorStore.
+    :param ids: List of chunk IDs.
+    :return: Dict chunk ID -> (document, metadata) for the IDs that exist.
+    """
+    if not ids:
+        return {}
+    if hasattr(vectorstore, "get_chunks"):
+        found_ids, documents, metadatas = vectorstore.get_chunks(ids)
+    else:
+        stored = vectorstore._collection.get(ids=ids, include=["documents", "metadatas"])
+        found_ids, documents, metadatas = stored["ids"], stored["documents"], stored["metadatas"]
+    return {doc_id: (doc, meta or {}) for doc_id, doc, meta in zip(found_ids, documents, metadatas)}
+
+
+def timed_stage(timer, stage):
+    """Context manager that times a pipeline stage with the request's timer (see metrics.RequestTimer), if any."""
+    return timer(stage) if timer else contextlib.nullcontext()
+
+
+async def atimed(timer, stage, awaitable):
+    with timed_stage(timer, stage):
+        return await awaitable
+
+
 def weighted_query_embedding(question, conversation_history, embed_model, weight_decay=0.5):
+    # The server receives the chat history as one string, the desktop app as a list of messages
+    if isinstance(conversation_history, str):
+        conversation_history = [{"role": "user", "content": conversation_history}] if conversation_history.strip() else []
+
     question_embedding = embed_model.embed_query(question)
     combined_embedding = np.array(question_embedding) * 1.0
 
@@ -34,42 +90,145 @@ def weighted_query_embedding(question, conversation_history, embed_model, weight
     return combined_embedding
 
 
-def hybrid_similarity_search(question, conversation_history, embed_model, vectorstore, bm25_retriever, top_k=5):
-    query_embedding = weighted_query_embedding(question, conversation_history, embed_model)
+def embedding_cache_key(text, embed_model):
+    """Cache key of a query embedding: the embedding model name and the whitespace-normalized text."""
+    return getattr(embed_model, "model_name", embed_model.__class__.__name__), " ".join(text.split())
+
+
+async def aembed_query(text, embed_model, executor=None, batcher=None, cache=None):
+    """
+    Embeds a query without blocking the event loop: through the micro-batching EmbeddingBatcher if given,
+    otherwise on the given (embedding) executor. With a cache (LRUCache), repeated texts are not embedded again.
+    """
+    if cache is not None:
+        key = embedding_cache_key(text, embed_model)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    if batcher is not None:
+        vector = await batcher.embed_query(text)
+    else:
+        vector = await asyncio.get_running_loop().run_in_executor(executor, embed_model.embed_query, text)
+    vector = np.asarray(vector, dtype=np.float32)
+
+    if cache is not None:
+        cache.set(key, vector)
+    return vector
+
+
+async def aweighted_query_embedding(question, conversation_history, embed_model, weight_decay=0.5, executor=None, batcher=None, cache=None):
+    """
+    Async variant of weighted_query_embedding; the question and history turns are embedded concurrently.
+    With an embedding cache, earlier turns are not embedded again on every new turn.
+    """
+    if isinstance(conversation_history, str):
+        conversation_history = [{"role": "user", "content": conversation_history}] if conversation_history.strip() else []
+    history = [entry["content"] for entry in reversed(conversation_history) if entry["role"] == "user"]
+
+    embeddings = await asyncio.gather(
+        *(aembed_query(text, embed_model, executor=executor, batcher=batcher, cache=cache) for text in [question] + history)
+    )
+
+    combined_embedding = np.array(embeddings[0]) * 1.0
+    weight = 1.0
+    for history_embedding in embeddings[1:]:
+        weight *= weight_decay
+        combined_embedding += np.array(history_embedding) * weight
+
+    return combined_embedding / np.linalg.norm(combined_embedding)
+
 
-    vector_results = vectorstore.similarity_search_by_vector(query_embedding, k=top_k)
-    bm25_results = bm25_retriever.get_relevant_documents(question)[:top_k]
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuses several rankings of document IDs with reciprocal-rank fusion.
+
+    :param rankings: List of rankings, each a list of document IDs (best first).
+    :param k: Damping constant of the fusion (default: 60).
+    :return: List of (document ID, fused score) tuples, best first.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
 
-    combined_results = vector_results + bm25_results
-    scored_results = []
-    for res in combined_results:
-        page_content = res.page_content if hasattr(res, 'page_content') else res.get('page_content', '')
-        result_embedding = embed_model.embed_query(page_content)
-        score = cosine_similarity([query_embedding], [result_embedding])[0][0]
-        scored_results.append((res, score))
 
-    scored_results.sort(key=lambda x: x[1], reverse=True)
-    formatted_results = [
+def fuse_hybrid_results(vectorstore, vector_hits, bm25_hits, top_k=5, rrf_k=60):
+    """
+    Fuses vector and BM25 hits with reciprocal-rank fusion and looks up the content of BM25-only hits.
+
+    :param vectorstore: The vectorstore instance.
+    :param vector_hits: Tuple (ids, documents, metadatas, embeddings) as returned by query_vectorstore.
+    :param bm25_hits: List of (chunk ID, score, source) tuples as returned by BM25Retriever.search.
+    :param top_k: Number of top results to return (default: 5).
+    :param rrf_k: Damping constant of the reciprocal-rank fusion (default: 60).
+    :return: List of relevant documents with their fused scores.
+    """
+    vector_ids, documents, metadatas, _ = vector_hits
+    fused = reciprocal_rank_fusion([vector_ids, [hit[0] for hit in bm25_hits]], k=rrf_k)[:top_k]
+
+    # Vector hits come with their content, BM25-only hits are looked up in the vectorstore by ID
+    found = {doc_id: (doc, meta) for doc_id, doc, meta in zip(vector_ids, documents, metadatas)}
+    found.update(get_chunks(vectorstore, [doc_id for doc_id, _ in fused if doc_id not in found]))
+
+    return [
         {
-            "text": res[0].page_content if hasattr(res[0], 'page_content') else res[0].get('page_content', ''),
-            "source": res[0].metadata.get("source", "unknown") if hasattr(res[0], 'metadata') else res[0].get('metadata', {}).get("source", "unknown"),
-            "score": res[1],
+            "id": doc_id,
+            "content": found[doc_id][0],
+            "source": found[doc_id][1].get("source", "unknown"),
+            "score": score,
         }
-        for res in scored_results[:top_k]
+        for doc_id, score in fused
+        if doc_id in found
     ]
 
-    return formatted_results
 
+def hybrid_similarity_search(question, conversation_history, embed_model, vectorstore, bm25_retriever, top_k=5, fetch_k=None, rrf_k=60):
+    """
+    Performs a hybrid search: vector search on the weighted query embedding and BM25 keyword search,
+    fused with reciprocal-rank fusion.
 
-def refine_question_with_llm(question, conversation_history, llm_client):
+    :param question: The user's current question.
+    :param conversation_history: Chat history (string or list of messages) used to weight the query embedding.
+    :param embed_model: The embedding model for generating query vectors.
+    :param vectorstore: The vectorstore instance.
+    :param bm25_retriever: The BM25Retriever instance.
+    :param top_k: Number of top results to return (default: 5).
+    :param fetch_k: Number of candidates fetched from each retriever before fusion (default: top_k).
+    :param rrf_k: Damping constant of the reciprocal-rank fusion (default: 60).
+    :return: List of relevant documents with their fused scores.
     """
-    Uses an LLM to refine the user's question based on the last two exchanges in the conversation history.
+    fetch_k = max(fetch_k or top_k, top_k)
+    query_embedding = weighted_query_embedding(question, conversation_history, embed_model)
 
-    :param question: The current user question.
-    :param conversation_history: List of conversation history entries.
-    :param llm_client: The LLM client instance for generating the refined question.
-    :return: Refined question as a string.
+    vector_hits = query_vectorstore(vectorstore, query_embedding, fetch_k, include_embeddings=False)
+    bm25_hits = bm25_retriever.search(question, top_k=fetch_k)
+
+    return fuse_hybrid_results(vectorstore, vector_hits, bm25_hits, top_k=top_k, rrf_k=rrf_k)
+
+
+async def ahybrid_similarity_search(question, conversation_history, embed_model, vectorstore, bm25_retriever, top_k=5, fetch_k=None, rrf_k=60, executor=None, batcher=None, cache=None, timer=None):
     """
+    Async variant of hybrid_similarity_search. The query embedding runs through the embedding batcher
+    (or executor) while the BM25 search runs concurrently on the default thread pool.
+    The optional timer records the embedding, bm25, vector_search and fusion stages.
+    """
+    fetch_k = max(fetch_k or top_k, top_k)
+
+    query_embedding, bm25_hits = await asyncio.gather(
+        atimed(timer, "embedding", aweighted_query_embedding(question, conversation_history, embed_model, executor=executor, batcher=batcher, cache=cache)),
+        atimed(timer, "bm25", asyncio.to_thread(bm25_retriever.search, question, fetch_k)),
+    )
+    with timed_stage(timer, "vector_search"):
+        vector_hits = await asyncio.to_thread(query_vectorstore, vectorstore, query_embedding, fetch_k, False)
+
+    with timed_stage(timer, "fusion"):
+        return await asyncio.to_thread(fuse_hybrid_results, vectorstore, vector_hits, bm25_hits, top_k, rrf_k)
+
+
+def build_refinement_messages(question, conversation_history):
+    """Builds the LLM messages for refining the user's question based on the conversation history."""
     # Prepare the LLM conversation messages
     messages = []
 
@@ -95,6 +254,19 @@ def refine_question_with_llm(question, conversation_history, llm_client):
 
     # Debugging: Print the messages to ensure correctness
     # print("Prepared Messages for LLM:", messages)
+    return messages
+
+
+def refine_question_with_llm(question, conversation_history, llm_client):
+    """
+    Uses an LLM to refine the user's question based on the last two exchanges in the conversation history.
+
+    :param question: The current user question.
+    :param conversation_history: List of conversation history entries.
+    :param llm_client: The LLM client instance for generating the refined question.
+    :return: Refined question as a string.
+    """
+    messages = build_refinement_messages(question, conversation_history)
 
     # Generate the refined question using the LLM
     chat_completion = llm_client.chat.completions.create(
@@ -109,30 +281,119 @@ def refine_question_with_llm(question, conversation_history, llm_client):
     return refined_question.strip()
 
 
-def semantic_search(question, vectorstore, embed_model, top_k=5):
+async def arefine_question_with_llm(question, conversation_history, llm_client, semaphore=None):
+    """
+    Async variant of refine_question_with_llm for an async LLM client (e.g. AsyncGroq).
+
+    :param semaphore: Optional asyncio.Semaphore that caps the number of in-flight LLM calls.
+    """
+    messages = build_refinement_messages(question, conversation_history)
+
+    async with semaphore or contextlib.nullcontext():
+        chat_completion = await llm_client.chat.completions.create(
+            model="llama3-8b-8192",
+            messages=messages,
+        )
+    return chat_completion.choices[0].message.content.strip()
+
+
+def cosine_scores(query_embedding, embeddings):
     """
-    Performs semantic search using similarity_search_by_vector and cosine similarity.
+    Computes cosine similarities between one query vector and a matrix of stored vectors in a single step.
+
+    :param query_embedding: The query vector.
+    :param embeddings: Array-like of shape (n, dim) with the stored vectors.
+    :return: numpy array of shape (n,) with the cosine similarities.
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.size == 0:
+        return np.zeros(0, dtype=np.float32)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query_norm = np.linalg.norm(query) or 1.0
+    row_norms = np.linalg.norm(matrix, axis=1)
+    row_norms[row_norms == 0] = 1.0
+    return (matrix @ query) / (row_norms * query_norm)
+
+
+def query_vectorstore(vectorstore, query_embedding, k, include_embeddings=True):
+    """
+    Queries the Chroma collection (or a FaissVectorStore) and returns the hits together with their
+    stored embeddings, so that no hit has to be embedded again.
+
+    :param vectorstore: The (langchain) Chroma vectorstore or a FaissVectorStore.
+    :param query_embedding: The query vector.
+    :param k: Number of candidates to fetch.
+    :param include_embeddings: Whether to return the stored embeddings of the hits.
+    :return: Tuple (ids, documents, metadatas, embeddings) for the k nearest chunks.
+    """
+    if hasattr(vectorstore, "query_by_embedding"):
+        return vectorstore.query_by_embedding(query_embedding, k, include_embeddings=include_embeddings)
+    query_embedding = np.asarray(query_embedding, dtype=np.float32).tolist()
+    include = ["documents", "metadatas", "embeddings"] if include_embeddings else ["documents", "metadatas"]
+    result = vectorstore._collection.query(query_embeddings=[query_embedding], n_results=k, include=include)
+    ids = result["ids"][0] if result["ids"] else []
+    documents = result["documents"][0] if result["documents"] else []
+    metadatas = result["metadatas"][0] if result["metadatas"] else []
+    embeddings = result["embeddings"][0] if result.get("embeddings") is not None and len(result["embeddings"]) else []
+    return ids, documents, [meta or {} for meta in metadatas], embeddings
+
+
+def search_by_embedding(query_embedding, vectorstore, top_k=5, fetch_k=None):
+    """
+    Searches the vectorstore with an already computed query embedding and scores the hits by cosine similarity.
+    The hits are scored against the embeddings stored in Chroma, so no hit is embedded again.
+
+    :param query_embedding: The query vector.
+    :param vectorstore: The vectorstore instance.
+    :param top_k: Number of top results to return (default: 5).
+    :param fetch_k: Number of candidates to fetch from the vectorstore before scoring (default: top_k).
+    :return: List of relevant documents with their similarity scores.
+    """
+    fetch_k = max(fetch_k or top_k, top_k)
+
+    # Fetch the candidates together with their stored vectors
+    ids, documents, metadatas, embeddings = query_vectorstore(vectorstore, query_embedding, fetch_k)
+    if not ids:
+        return []
+
+    # Score all candidates at once and keep the best top_k
+    scores = cosine_scores(query_embedding, embeddings)
+    order = np.argsort(-scores)[:top_k]
+
+    return [
+        {
+            "id": ids[i],
+            "content": documents[i],
+            "source": metadatas[i].get("source", "unknown"),
+            "score": float(scores[i]),
+        }
+        for i in order
+    ]
+
+
+def semantic_search(question, vectorstore, embed_model, top_k=5, fetch_k=None):
+    """
+    Performs semantic search on the vectorstore and scores the hits by cosine similarity.
+    Only the question is embedded; the hits are scored against their stored embeddings.
 
     :param question: The question to search for.
     :param vectorstore: The vectorstore instance.
     :param embed_model: The embedding model for generating query vectors.
     :param top_k: Number of top results to return (default: 5).
+    :param fetch_k: Number of candidates to fetch from the vectorstore before scoring (default: top_k).
     :return: List of relevant documents with their similarity scores.
     """
-    # Generate the query embedding
     query_embedding = embed_model.embed_query(question)
+    return search_by_embedding(query_embedding, vectorstore, top_k=top_k, fetch_k=fetch_k)
 
-    # Perform similarity search using vectorstore
-    search_results = vectorstore.similarity_search_by_vector(query_embedding, k=top_k)
 
-    # Re-score results with cosine similarity for additional precision
-    results_with_scores = []
-    for result in search_results:
-        result_embedding = embed_model.embed_query(result.page_content)
-        score = cosine_similarity([query_embedding], [result_embedding])[0][0]
-        results_with_scores.append({"content": result.page_content, "source": result.metadata["source"], "score": score})
-        # print("source: " + result.metadata["source"])
-
-    # Sort results by similarity score in descending order
-    results_with_scores.sort(key=lambda x: x["score"], reverse=True)
-    return results_with_scores
\ No newline at end of file
+async def asemantic_search(question, vectorstore, embed_model, top_k=5, fetch_k=None, executor=None, batcher=None, cache=None, timer=None):
+    """
+    Async variant of semantic_search. The CPU-bound query embedding runs through the embedding batcher
+    (or on the given executor), the vector search on the default thread pool, so the event loop is never blocked.
+    The optional timer records the embedding and vector_search stages.
+    """
+    with timed_stage(timer, "embedding"):
+        query_embedding = await aembed_query(question, embed_model, executor=executor, batcher=batcher, cache=cache)
+    with timed_stage(timer, "vector_search"):
+        return await asyncio.to_thread(search_by_embedding, query_embedding, vectorstore, top_k, fetch_k)
@@ -0,0 +1,207 @@
+import time
+import asyncio
+import threading
+import contextlib
+
+
+def on_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class ComponentUnavailableError(RuntimeError):
+    """Raised when a component is read that is not loaded (yet or anymore); the server answers 503."""
+
+
+class LazyComponent:
+    """
+    Class attribute of ServerConfig that is created by its loader on first access (or in the background
+    by Startup) and then kept. Assigning the attribute on the class (update_config) replaces the
+    component, which is then never loaded.
+
+    Once Startup manages the component, reading it never runs the loader again: on the event loop a
+    component that is not ready raises ComponentUnavailableError, and a failed component raises it
+    everywhere until Startup has loaded it again in the background.
+    """
+
+    def __init__(self, loader, required=True):
+        self.loader = loader
+        self.required = required  # Readiness waits for required components only
+        self.name = None
+        self.owner = None
+        self.value = None
+        self.state = "pending"
+        self.seconds = None
+        self.error = None
+        self.attempts = 0
+        self.managed = False  # Set by Startup.start
+        self._lock = threading.Lock()
+
+    def __set_name__(self, owner, name):
+        self.owner = owner
+        self.name = name
+
+    def __get__(self, instance, owner):
+        return self.get()
+
+    def get(self):
+        if self.state != "ready":
+            # Never blocks the event loop: neither on the loader nor on a load in another thread
+            if self.managed and on_event_loop():
+                raise ComponentUnavailableError(f"{self.name} is {self.state}")
+            with self._lock:
+                if self.state != "ready":
+                    if self.managed and self.state == "failed":
+                        raise ComponentUnavailableError(f"{self.name} failed to load: {self.error}")
+                    self._load()
+        return self.value
+
+    def reload(self):
+        """Loads the component again if it is not ready (Startup's retry; runs in a worker thread)."""
+        with self._lock:
+            if self.state != "ready":
+                self._load()
+        return self.value
+
+    def _load(self):
+        self.state = "loading"
+        self.attempts += 1
+        started = time.perf_counter()
+        try:
+            self.value = self.loader()
+        except Exception as e:
+            self.state = "failed"
+            self.error = repr(e)
+            raise
+        finally:
+            self.seconds = round(time.perf_counter() - started, 3)
+        self.state = "ready"
+        self.error = None
+        print(f"Loaded {self.name} in {self.seconds:.2f} s")
+
+    @property
+    def overridden(self):
+        return self.owner.__dict__.get(self.name) is not self
+
+    def status(self):
+        if self.overridden:
+            return {"state": "ready", "overridden": True}
+        return {"state": self.state, "seconds": self.seconds, "error": self.error, "attempts": self.attempts}
+
+
+class DeferredEmbeddings:
+    """Embeddings that resolve the model on first use, so that a vectorstore can be opened while the model loads."""
+
+    def __init__(self, resolve):
+        self.resolve = resolve
+
+    def embed_documents(self, texts):
+        return self.resolve().embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.resolve().embed_query(text)
+
+
+class Startup:
+    """
+    Loads the lazy components of a config class concurrently, each in a thread (components that use
+    another one simply wait for it), and records the duration of every startup phase. Components that
+    failed are loaded again in the background, retry_backoff seconds after the failure, doubling up to
+    max_retry_backoff, so that requests get 503 meanwhile instead of loading them inline.
+    """
+
+    def __init__(self, owner, retry_backoff=5.0, max_retry_backoff=300.0):
+        self.owner = owner
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self.phases = {}  # Phase -> seconds (imports, component loads, warm-ups)
+        self.started = time.perf_counter()
+        self.ready_seconds = None
+        self._task = None
+        self._retry_task = None
+        # Taken before update_config can replace any of them
+        self.components = {
+            name: value for klass in reversed(owner.__mro__) for name, value in vars(klass).items()
+            if isinstance(value, LazyComponent)
+        }
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.perf_counter() - started, 3)
+
+    async def _load(self, warmups):
+        async def load(component):
+            if component.overridden:
+                return
+            try:
+                await asyncio.to_thread(component.get)
+            except Exception as e:
+                print(f"Loading {component.name} failed: {e!r}")
+            self.phases[f"load_{component.name}"] = component.seconds
+
+        async def warm_up(name, function):
+            try:
+                with self.phase(f"warmup_{name}"):
+                    await asyncio.to_thread(function)
+            except Exception as e:
+                print(f"Warm-up {name} failed: {e!r}")
+
+        await asyncio.gather(
+            *(load(component) for component in self.components.values()),
+            *(warm_up(name, function) for name, function in warmups.items()),
+        )
+        self.ready_seconds = round(time.perf_counter() - self.started, 3)
+        print(f"Startup complete after {self.ready_seconds:.2f} s: {self.phases}")
+        if self.failed():
+            self._retry_task = asyncio.create_task(self._retry())
+
+    def failed(self):
+        return [component for component in self.components.values() if not component.overridden and component.state == "failed"]
+
+    async def _retry(self):
+        delay = self.retry_backoff
+        while self.failed():
+            await asyncio.sleep(delay)
+
+            async def reload(component):
+                try:
+                    await asyncio.to_thread(component.reload)
+                except Exception as e:
+                    print(f"Loading {component.name} failed again: {e!r}")
+
+            # Components that use a failed one are retried with it and wait for it
+            await asyncio.gather(*(reload(component) for component in self.failed()))
+            delay = min(delay * 2, self.max_retry_backoff)
+
+    def start(self, warmups=None):
+        """Starts loading in the background (from the running event loop); warmups maps names to callables."""
+        if self._task is None:
+            for component in self.components.values():
+                component.managed = True
+            self._task = asyncio.create_task(self._load(warmups or {}))
+        return self._task
+
+    async def wait(self):
+        """Waits until loading has finished, so that request handlers never load a component on the event loop."""
+        await asyncio.shield(self.start())
+
+    def ready(self):
+        return all(
+            component.overridden or component.state == "ready"
+            for component in self.components.values() if component.required
+        )
+
+    def status(self):
+        return {
+            "ready": self.ready(),
+            "ready_seconds": self.ready_seconds,
+            "components": {name: component.status() for name, component in self.components.items()},
+            "phases": self.phases,
+        }
@@ -65,7 +65,7 @@ class RAGChatApp(tk.Tk):
             # Perform semantic search using the refined question
             results = semantic_search(refined_question, self.vectorstore, self.embed_model)
 
-        context = " ".join([res["text"] for res in results])
+        context = " ".join([res["content"] for res in results])
 
         # Generate a response using the context
         response = self.generate_response(question, context)
@@ -1,9 +1,8 @@
 import os
 from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
 from langchain_chroma import Chroma
-from rank_bm25 import BM25Okapi
-from nltk.tokenize import word_tokenize
 from dotenv import load_dotenv
+from backend.server.bm25_index import BM25Index
 from backend.server.retrievers import BM25Retriever
 from groq import Groq
 
@@ -26,17 +25,9 @@ def initialize_models(index_folder="data/indexes"):
     chroma_db_path = os.path.join(index_folder, "chroma")
     vectorstore = Chroma(persist_directory=chroma_db_path, embedding_function=embed_model)
 
-    # Load metadata and documents
-    all_data = vectorstore.get(include=["metadatas", "documents"])
-    documents = [
-        {"content": doc, "metadata": meta}
-        for doc, meta in zip(all_data["documents"], all_data["metadatas"])
-    ]
-
-    # Initialize BM25 retriever
-    tokenized_corpus = [word_tokenize(doc["content"].lower()) for doc in documents]
-    bm25 = BM25Okapi(tokenized_corpus)
-    bm25_retriever = BM25Retriever(bm25, documents)
+    # Load the persisted BM25 index (only built from the vectorstore if it does not exist yet)
+    bm25_index = BM25Index.load_or_build(os.path.join(index_folder, "bm25"), vectorstore)
+    bm25_retriever = BM25Retriever(bm25_index, vectorstore)
 
     llm_client = Groq(api_key=API_KEY)
 
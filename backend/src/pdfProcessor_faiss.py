@@ -1,18 +1,14 @@
 import os
+import time
 import faiss
 import pickle
-import hashlib
-from sentence_transformers import SentenceTransformer
-from llama_index.core import SimpleDirectoryReader
 import numpy as np
-from langchain_experimental.text_splitter import SemanticChunker
-from langchain_openai.embeddings import OpenAIEmbeddings
 from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
-from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from backend.server.file_manifest import FileManifest
+from backend.server.embedding_store import EmbeddingStore
 
 load_dotenv()
 SEM_CHUNK_API_KEY = os.getenv("SEM_CHUNK_API_KEY")
@@ -20,15 +16,36 @@ SEM_CHUNK_API_KEY = os.getenv("SEM_CHUNK_API_KEY")
 # paths
 INPUT_PDF_FOLDER = "data/input_pdf"
 INDEX_FOLDER = "data/indexes"
-PROCESSED_FILES_FILE = os.path.join(INDEX_FOLDER, "processed_files.pkl")
+PROCESSED_FILES_FILE = os.path.join(INDEX_FOLDER, "processed_files.pkl")  # Legacy, migrated to the manifest
+MANIFEST_FILE = os.path.join(INDEX_FOLDER, "manifest_faiss.json")
 FAISS_INDEX_FILE = os.path.join(INDEX_FOLDER, "faiss_index")
 METADATA_FILE = os.path.join(INDEX_FOLDER, "metadata.pkl")
+EMBEDDING_STORE_FOLDER = os.path.join(INDEX_FOLDER, "embeddings")  # Content-addressed cache of chunk embeddings
+EMBEDDING_STORE_DTYPE = os.getenv("EMBEDDING_STORE_DTYPE", "float32")  # "float32" or "float16"
+ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", 256))  # Chunks per encode call
+ENCODE_WORKERS = int(os.getenv("ENCODE_WORKERS", 2))  # Threads running encode calls concurrently
+
+text_splitterSem = None  # Created on first use by get_semantic_splitter
+
+def get_semantic_splitter():
+    """SemanticChunker with OpenAI embeddings, created on first use (langchain_openai is slow to import)."""
+    global text_splitterSem
+    if text_splitterSem is None:
+        from langchain_experimental.text_splitter import SemanticChunker
+        from langchain_openai.embeddings import OpenAIEmbeddings
+        text_splitterSem = SemanticChunker(OpenAIEmbeddings(api_key=SEM_CHUNK_API_KEY))
+    return text_splitterSem
 
-# Initialize embedding model
 EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"  # Small and fast model
-embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
-text_splitterSem = SemanticChunker(OpenAIEmbeddings(api_key=SEM_CHUNK_API_KEY))
-embed_model = FastEmbedEmbeddings(model_name="BAAI/bge-base-en-v1.5")
+embedding_model = None  # Created on first use by get_embedding_model (or replaced, e.g. by the benchmark)
+
+def get_embedding_model():
+    """SentenceTransformer model, loaded on first use (importing sentence_transformers loads torch)."""
+    global embedding_model
+    if embedding_model is None:
+        from sentence_transformers import SentenceTransformer
+        embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    return embedding_model
 text_splitterRec = RecursiveCharacterTextSplitter(
     chunk_size=1000,
     chunk_overlap=0,
@@ -36,11 +53,38 @@ text_splitterRec = RecursiveCharacterTextSplitter(
     is_separator_regex=False
 )
 
-def get_file_hash(file_path):
-    hasher = hashlib.md5()
-    with open(file_path, "rb") as f:
-        hasher.update(f.read())
-    return hasher.hexdigest()
+def encode_in_batches(texts, batch_size=ENCODE_BATCH_SIZE, workers=ENCODE_WORKERS, out=None, rows=None):
+    """
+    Encodes the texts in batches of batch_size on a thread pool and writes the vectors straight into
+    a preallocated float32 array. Progress and throughput are reported after every batch.
+
+    :param out: Array to write into (default: a new array of shape (len(texts), dim)).
+    :param rows: Rows of out for the texts (default: 0 to len(texts) - 1).
+    :return: The array the vectors were written into.
+    """
+    model = get_embedding_model()
+    if out is None:
+        out = np.empty((len(texts), model.get_sentence_embedding_dimension()), dtype=np.float32)
+    if not texts:
+        return out
+    rows = None if rows is None else np.asarray(rows)
+
+    started = time.perf_counter()
+    done = 0
+
+    def encode_batch(start):
+        end = min(start + batch_size, len(texts))
+        target = slice(start, end) if rows is None else rows[start:end]
+        out[target] = model.encode(texts[start:end], batch_size=batch_size, convert_to_numpy=True)
+        return end - start
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for count in executor.map(encode_batch, range(0, len(texts), batch_size)):
+            done += count
+            elapsed = time.perf_counter() - started
+            print(f"Embedded {done}/{len(texts)} chunks ({done / elapsed:.1f} chunks/s)")
+    return out
+
 
 def process_pdfs_and_create_index():
     # Load existing index, metadata, and processed files
@@ -52,75 +96,46 @@ def process_pdfs_and_create_index():
         faiss_index = None
         metadata = []
 
-    if os.path.exists(PROCESSED_FILES_FILE):
-        with open(PROCESSED_FILES_FILE, "rb") as f:
-            processed_files = pickle.load(f)
-    else:
-        processed_files = {}
-    
-    new_files = []
-    for file_name in os.listdir(INPUT_PDF_FOLDER):
-        if file_name.endswith(".pdf"):
-            file_path = os.path.join(INPUT_PDF_FOLDER, file_name)
-            file_hash = get_file_hash(file_path)
-            if file_name not in processed_files or processed_files[file_name] != file_hash:
-                new_files.append(file_path)
-                processed_files[file_name] = file_hash
+    # Only files whose size or mtime changed are hashed
+    manifest = FileManifest.load(MANIFEST_FILE, legacy_file=PROCESSED_FILES_FILE)
+    new_files, _ = manifest.scan(INPUT_PDF_FOLDER)
 
     if not new_files:
+        manifest.save()
         print("No new PDFs to process.")
         return
 
     print(f"Processing {len(new_files)} new/modified PDFs...")
 
-    new_embeddings = []
-    new_metadata = []
-    
-    """  
-    reader = SimpleDirectoryReader(input_files=new_files)
-    documents = reader.load_data()
-
-    # Process each document
-    for doc in documents:
-        # Break the document into smaller chunks if necessary
-        text_chunks = doc.text.split("\n\n")  # Simple chunking by paragraph (can be improved)
-        for chunk in text_chunks:
-            chunk_embedding = embedding_model.encode(chunk)
-            new_embeddings.append(chunk_embedding)
-            new_metadata.append({
-                "text": chunk,
-                "source": doc.extra_info.get("file_name", "unknown")
-            })
+    # Chunk texts that were embedded before (e.g. unchanged parts of an edited PDF) are read from the store
+    embedding_store = EmbeddingStore(EMBEDDING_STORE_FOLDER, EMBEDDING_MODEL_NAME, dtype=EMBEDDING_STORE_DTYPE)
 
-    """
-    combined_documents = []
+    new_texts = []
+    new_metadata = []
     for file_path in new_files:
         loader = PyPDFLoader(file_path)
         documents = loader.load()
         combined_text = "\n".join([doc.page_content for doc in documents])  # Combine all pages
-        combined_documents.append(Document(page_content=combined_text, metadata={"source": file_path}))
-    
-    idx = 0
-    for doc in combined_documents:
-        print(idx)
-        idx = idx + 1
-        # chunks = text_splitterSem.create_documents(doc.page_content)
-        chunks = text_splitterRec.create_documents(doc.page_content)
-
-        for chunk in chunks:
-            chunk_embedding = embedding_model.encode(chunk.page_content)
-            new_embeddings.append(chunk_embedding)
-            new_metadata.append({
-                "text": chunk.page_content,
-                # "source": chunks.extra_info.get("file_name", "unknown")
-                "source": os.path.basename(file_path)
-            })
-        # semantic_chunk_vectorstore = Chroma.from_documents(chunks, embedding=embed_model)
-
+        # chunks = get_semantic_splitter().create_documents(combined_text)
+        chunks = text_splitterRec.split_text(combined_text)
+        new_texts.extend(chunks)
+        new_metadata.extend({"text": chunk, "source": os.path.basename(file_path)} for chunk in chunks)
+        print(f"Reading of {file_path} done!")
+
+    # Only the chunks that are not in the embedding store are encoded, in large batches
+    new_embeddings, missing = embedding_store.get_many(new_texts)
+    if new_embeddings is None:
+        new_embeddings = np.empty((len(new_texts), get_embedding_model().get_sentence_embedding_dimension()), dtype=np.float32)
+    print(f"{len(new_texts) - len(missing)} of {len(new_texts)} chunks found in the embedding store.")
+    if missing:
+        missing_texts = [new_texts[i] for i in missing]
+        # The batches are written directly into their final rows
+        encode_in_batches(missing_texts, out=new_embeddings, rows=missing)
+        embedding_store.put_many(missing_texts, new_embeddings if len(missing) == len(new_texts) else new_embeddings[missing])
+        embedding_store.save()
 
     # Update FAISS index
-    if new_embeddings:
-        new_embeddings = np.array(new_embeddings)
+    if len(new_embeddings):
         if faiss_index is None:
             embedding_dim = new_embeddings.shape[1]
             faiss_index = faiss.IndexFlatL2(embedding_dim)
@@ -133,11 +148,11 @@ def process_pdfs_and_create_index():
         with open(METADATA_FILE, "wb") as f:
             pickle.dump(metadata, f)
 
-        # Update processed files list
-        with open(PROCESSED_FILES_FILE, "wb") as f:
-            pickle.dump(processed_files, f)
+    # Update the manifest, also when the PDFs had no extractable text, so they are not parsed again
+    manifest.commit(new_files)
+    manifest.save()
 
-        print(f"Updated FAISS index with {len(new_files)} new PDFs.")
+    print(f"Updated FAISS index with {len(new_files)} new PDFs.")
 
 
 if __name__ == "__main__":
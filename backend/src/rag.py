@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 import numpy as np
 from groq import Groq
 from dotenv import load_dotenv
@@ -51,14 +52,29 @@ class BM25Retriever:
     def __init__(self, bm25, documents):
         self.bm25 = bm25
         self.documents = documents
+        # Query string -> tokens, so repeated questions are not tokenized again
+        self._tokenize = lru_cache(maxsize=4096)(lambda query: tuple(word_tokenize(query.lower())))
+
+    def _top_indices(self, scores, top_k):
+        # Partial selection of the top_k scores instead of sorting the whole corpus
+        scores = np.asarray(scores)
+        if len(scores) > top_k:
+            candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            candidates = np.arange(len(scores))
+        return candidates[np.argsort(-scores[candidates], kind="stable")]
 
     def get_relevant_documents(self, query, top_k=5):
-        tokenized_query = word_tokenize(query.lower())
-        scores = self.bm25.get_scores(tokenized_query)
-        top_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
+        return self.get_relevant_documents_batch([query], top_k=top_k)[0]
+
+    def get_relevant_documents_batch(self, queries, top_k=5):
+        scores = np.vstack([self.bm25.get_scores(list(self._tokenize(query))) for query in queries]) if queries else np.zeros((0, 0))
         return [
-            {"page_content": self.documents[i]["content"], "metadata": self.documents[i].get("metadata", {})}
-            for i in top_indices
+            [
+                {"page_content": self.documents[i]["content"], "metadata": self.documents[i].get("metadata", {})}
+                for i in self._top_indices(query_scores, top_k)
+            ]
+            for query_scores in scores
         ]
 
 bm25_retriever = BM25Retriever(bm25, documents)
@@ -0,0 +1,10 @@
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The server and the local proxy import their modules by file name
+for folder in ("server", "local"):
+    path = os.path.join(BACKEND_DIR, folder)
+    if path not in sys.path:
+        sys.path.insert(0, path)
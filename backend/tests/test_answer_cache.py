@@ -0,0 +1,92 @@
+import sqlite3
+import numpy as np
+import pytest
+from answer_cache import AnswerCache
+
+ANSWER = ("The answer", ["a.pdf"], ["paragraph"])
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return AnswerCache(str(tmp_path / "answers.db"), threshold=0.95, max_entries=3)
+
+
+def store(cache, embedding, chunk_ids=("c1", "c2"), language="en", index_version=1, history=""):
+    cache.store("question", embedding, list(chunk_ids), language, index_version, *ANSWER, history=history)
+
+
+def test_hit_for_near_duplicate_question_with_the_same_chunks(cache):
+    store(cache, [1.0, 0.0, 0.0])
+    cached = cache.lookup([0.99, 0.05, 0.0], ["c2", "c1"], "en", 1)  # Chunk order does not matter
+    assert cached == {"response": "The answer", "sources": ["a.pdf"], "content": ["paragraph"]}
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.parametrize("embedding, chunk_ids, language", [
+    ([0.0, 1.0, 0.0], ["c1", "c2"], "en"),  # Different question
+    ([1.0, 0.0, 0.0], ["c1", "c3"], "en"),  # Different context
+    ([1.0, 0.0, 0.0], ["c1", "c2"], "de"),  # Different language
+])
+def test_miss_when_a_key_part_differs(cache, embedding, chunk_ids, language):
+    store(cache, [1.0, 0.0, 0.0])
+    assert cache.lookup(embedding, chunk_ids, language, 1) is None
+
+
+def test_history_is_part_of_the_key(cache):
+    first_chat = AnswerCache.history_key("Compare the two contracts. The first one ends in May.")
+    other_chat = AnswerCache.history_key("List the tariffs of 2023.")
+    store(cache, [1.0, 0.0, 0.0], history=first_chat)
+
+    assert cache.lookup([1.0, 0.0, 0.0], ["c1", "c2"], "en", 1, first_chat) is not None
+    assert cache.lookup([1.0, 0.0, 0.0], ["c1", "c2"], "en", 1, other_chat) is None
+    assert cache.lookup([1.0, 0.0, 0.0], ["c1", "c2"], "en", 1) is None
+
+
+def test_history_key():
+    assert AnswerCache.history_key("") == AnswerCache.history_key(None) == ""
+    assert AnswerCache.history_key("a  b\n") == AnswerCache.history_key("a b")
+    assert AnswerCache.history_key("a b") != AnswerCache.history_key("a c")
+
+
+def test_answers_of_an_older_index_version_are_dropped(cache):
+    store(cache, [1.0, 0.0, 0.0], index_version=1)
+    assert cache.lookup([1.0, 0.0, 0.0], ["c1", "c2"], "en", 2) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_answers_are_evicted(cache):
+    for i in range(3):
+        store(cache, np.eye(4)[i], chunk_ids=[f"c{i}"])
+    assert cache.lookup(np.eye(4)[0], ["c0"], "en", 1) is not None  # Used, so kept
+    store(cache, np.eye(4)[3], chunk_ids=["c3"])
+
+    assert cache.stats()["entries"] == 3
+    assert cache.lookup(np.eye(4)[1], ["c1"], "en", 1) is None
+    assert cache.lookup(np.eye(4)[0], ["c0"], "en", 1) is not None
+
+
+def test_answers_survive_a_restart(tmp_path):
+    path = str(tmp_path / "answers.db")
+    store(AnswerCache(path), [1.0, 0.0])
+    assert AnswerCache(path).lookup([1.0, 0.0], ["c1", "c2"], "en", 1) is not None
+
+
+def test_cache_without_history_column_is_migrated(tmp_path):
+    path = str(tmp_path / "answers.db")
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE answers (id INTEGER PRIMARY KEY AUTOINCREMENT, question TEXT NOT NULL, embedding BLOB NOT NULL, "
+        "chunk_ids TEXT NOT NULL, language TEXT, index_version INTEGER NOT NULL, response TEXT NOT NULL, "
+        "sources TEXT NOT NULL, content TEXT NOT NULL, last_used REAL NOT NULL)"
+    )
+    connection.execute(
+        "INSERT INTO answers (question, embedding, chunk_ids, language, index_version, response, sources, content, last_used) "
+        "VALUES ('q', ?, '[\"c1\"]', 'en', 1, 'old answer', '[]', '[]', 0)",
+        (np.array([1.0, 0.0], dtype=np.float32).tobytes(),),
+    )
+    connection.commit()
+    connection.close()
+
+    cache = AnswerCache(path)
+    assert cache.lookup([1.0, 0.0], ["c1"], "en", 1)["response"] == "old answer"
+    assert cache.lookup([1.0, 0.0], ["c1"], "en", 1, AnswerCache.history_key("some chat")) is None
@@ -0,0 +1,176 @@
+import math
+import os
+import time
+import threading
+import pytest
+from bm25_index import BM25Index, tokenize
+from retrievers import reciprocal_rank_fusion, fuse_hybrid_results
+
+DOCS = {
+    "a": "The cat sat on the mat.",
+    "b": "A dog chased the cat around the garden, the dog barked.",
+    "c": "Dogs and cats: a short guide to pets",
+    "d": "Quantum computing uses qubits",
+    "e": "the the the cat",
+}
+QUERIES = ["cat", "the dog", "dog dog garden", "qubits computing", "pets guide cats", "unknown words"]
+
+
+def reference_scores(docs, query, k1=1.5, b=0.75):
+    """Plain BM25 (idf = ln(1 + (N - df + 0.5) / (df + 0.5))), one term occurrence of the query at a time."""
+    tokenized = [tokenize(doc) for doc in docs]
+    avgdl = sum(len(doc) for doc in tokenized) / len(tokenized)
+    scores = []
+    for doc in tokenized:
+        score = 0.0
+        for term in tokenize(query):
+            df = sum(term in other for other in tokenized)
+            if not df:
+                continue
+            idf = math.log(1 + (len(tokenized) - df + 0.5) / (df + 0.5))
+            tf = doc.count(term)
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(doc) / avgdl))
+        scores.append(score)
+    return scores
+
+
+def build(path, docs=DOCS):
+    index = BM25Index(str(path))
+    index.add_documents(list(docs), list(docs.values()), [{"source": f"{doc_id}.pdf"} for doc_id in docs])
+    return index
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_scores_match_reference(tmp_path, query):
+    index = build(tmp_path)
+    assert list(index.get_scores(query)) == pytest.approx(reference_scores(list(DOCS.values()), query), rel=1e-5, abs=1e-6)
+
+
+def test_deleted_and_replaced_documents_are_excluded(tmp_path):
+    index = build(tmp_path)
+    index.delete(["d"])
+    index.add_documents(["a"], ["A bird on the mat"], [{"source": "a.pdf"}])
+    live = {**{k: v for k, v in DOCS.items() if k != "d"}, "a": "A bird on the mat"}
+    scores = index.get_scores("the cat bird")
+
+    assert len(index) == 4
+    assert scores[0] == 0 and scores[3] == 0  # Replaced and deleted rows
+    expected = dict(zip(live, reference_scores(list(live.values()), "the cat bird")))
+    rows = {doc_id: index.row_of[doc_id] for doc_id in live}
+    assert {doc_id: scores[row] for doc_id, row in rows.items()} == pytest.approx(expected, rel=1e-5)
+
+
+def test_search_returns_best_first_with_sources(tmp_path):
+    index = build(tmp_path)
+    hits = index.search("dog", top_k=2)
+    assert hits == [("b", pytest.approx(reference_scores(list(DOCS.values()), "dog")[1]), "b.pdf")]  # "dogs" is another term
+    assert index.search("unknown words") == []
+
+
+def test_save_load_and_compact_keep_scores(tmp_path):
+    index = build(tmp_path)
+    index.delete(["b"])
+    before = {hit[0]: hit[1] for hit in index.search("the cat", top_k=10)}
+    index.save()
+
+    loaded = BM25Index.load(str(tmp_path))
+    assert {hit[0]: hit[1] for hit in loaded.search("the cat", top_k=10)} == pytest.approx(before)
+
+    loaded.compact()
+    assert loaded.dead_ratio() == 0.0
+    assert len(loaded.ids) == 4
+    assert {hit[0]: hit[1] for hit in loaded.search("the cat", top_k=10)} == pytest.approx(before)
+
+
+def test_reload_if_stale_picks_up_saves_of_other_writers(tmp_path):
+    build(tmp_path).save()
+    reader = BM25Index.load(str(tmp_path))
+    assert reader.search("parrot") == []
+
+    writer = BM25Index.load(str(tmp_path))
+    writer.add_documents(["f"], ["a parrot"], [{"source": "f.pdf"}])
+    writer.save()
+    # A later modification time than the reader's, also on file systems with coarse timestamps
+    os.utime(os.path.join(str(tmp_path), BM25Index.META_FILE), ns=(time.time_ns() + 10**9,) * 2)
+
+    assert [hit[0] for hit in reader.search("parrot")] == ["f"]
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]], k=60)
+    scores = dict(fused)
+    assert [doc_id for doc_id, _ in fused] == ["a", "c", "b"]
+    assert scores["a"] == pytest.approx(1 / 61 + 1 / 62)
+    assert scores["c"] == pytest.approx(1 / 63 + 1 / 61)
+    assert scores["b"] == pytest.approx(1 / 62)
+
+
+class FakeVectorStore:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.requested = []
+
+    def get_chunks(self, ids):
+        self.requested.extend(ids)
+        found = [chunk_id for chunk_id in ids if chunk_id in self.chunks]
+        return found, [self.chunks[chunk_id] for chunk_id in found], [{"source": f"{chunk_id}.pdf"} for chunk_id in found]
+
+
+def test_fuse_hybrid_results_looks_up_only_bm25_hits():
+    vectorstore = FakeVectorStore({"x": "bm25 only text"})
+    vector_hits = (["a", "b"], ["text a", "text b"], [{"source": "a.pdf"}, {"source": "b.pdf"}], [])
+    bm25_hits = [("x", 3.0, "x.pdf"), ("a", 2.0, "a.pdf"), ("gone", 1.0, "gone.pdf")]
+
+    results = fuse_hybrid_results(vectorstore, vector_hits, bm25_hits, top_k=4)
+
+    assert [result["id"] for result in results] == ["a", "x", "b"]  # "gone" no longer exists
+    assert results[1] == {"id": "x", "content": "bm25 only text", "source": "x.pdf", "score": pytest.approx(1 / 61)}
+    assert sorted(vectorstore.requested) == ["gone", "x"]
+
+
+def test_batch_scoring_matches_single_queries(tmp_path):
+    index = build(tmp_path)
+    batch = index.get_scores_batch(QUERIES)
+    assert batch.shape == (len(DOCS), len(QUERIES))
+    for q, query in enumerate(QUERIES):
+        assert list(batch[:, q]) == pytest.approx(list(index.get_scores(query)), rel=1e-6, abs=1e-7)
+    assert index.search_batch(QUERIES, top_k=3) == [index.search(query, top_k=3) for query in QUERIES]
+    assert index.search_batch([]) == []
+
+
+def test_top_k_is_a_partial_sort_of_the_positive_scores(tmp_path):
+    docs = {f"doc{i}": "word " * (i % 7 + 1) + "filler " * i for i in range(40)}
+    index = build(tmp_path, docs)
+    scores = index.get_scores("word")
+    expected = sorted((i for i in range(len(docs)) if scores[i] > 0), key=lambda i: -scores[i])[:5]
+
+    hits = index.search("word", top_k=5)
+    assert [hit[0] for hit in hits] == [f"doc{i}" for i in expected]
+    assert [hit[1] for hit in hits] == sorted((hit[1] for hit in hits), reverse=True)
+
+
+def test_query_term_cache_is_cleared_when_the_vocabulary_changes(tmp_path):
+    index = build(tmp_path)
+    assert index.search("parrot") == []
+    index.add_documents(["f"], ["a parrot"], [{"source": "f.pdf"}])
+    assert [hit[0] for hit in index.search("parrot")] == ["f"]
+
+
+def test_search_while_documents_are_added(tmp_path):
+    index = build(tmp_path)
+    errors = []
+
+    def search():
+        try:
+            for _ in range(200):
+                index.search_batch(["cat", "new words"], top_k=3)
+                index.search("new")
+        except Exception as e:  # Reported below, threads swallow exceptions
+            errors.append(e)
+
+    searcher = threading.Thread(target=search)
+    searcher.start()
+    for i in range(200):
+        index.add_documents([f"n{i}"], [f"new words {i}"])
+    searcher.join()
+    assert errors == []
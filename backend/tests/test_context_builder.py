@@ -0,0 +1,38 @@
+import pytest
+from context_builder import TokenCounter, CHARS_PER_TOKEN
+
+
+@pytest.fixture
+def counter():
+    return TokenCounter()  # Character estimate, no tokenizer
+
+
+def test_estimate_is_at_least_one_token_per_three_characters(counter):
+    text = "Die Geschwindigkeitsbegrenzung auf Autobahnen ist umstritten."
+    assert counter.count(text) == -(-len(text) // CHARS_PER_TOKEN)
+    assert counter.count("") == 0
+
+
+def test_dense_text_is_counted_per_pretoken(counter):
+    # Every digit group and punctuation mark is a token of its own
+    assert counter.count("1,2,3,4,5,6") == 11
+    assert counter.count("1234567") == 3
+
+
+@pytest.mark.parametrize("text", ["word " * 1000, "a1, " * 500, "Donaudampfschifffahrtsgesellschaft " * 100])
+def test_tail_fits_into_the_budget_and_keeps_the_end(counter, text):
+    tail = counter.tail(text, 100)
+    assert 0 < counter.count(tail) <= 100
+    assert text.endswith(tail)
+    # Nearly the whole budget is used, also for dense text
+    assert counter.count(tail) >= 90
+
+
+def test_tail_of_text_within_budget_is_the_text(counter):
+    assert counter.tail("short text", 100) == "short text"
+    assert counter.tail("short text", 0) == ""
+
+
+def test_messages_add_the_template_overhead(counter):
+    messages = [{"role": "system", "content": "abcdef"}, {"role": "user", "content": "abc"}]
+    assert counter.messages(messages) == 2 + 1 + 2 * 4
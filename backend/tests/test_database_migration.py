@@ -0,0 +1,172 @@
+import json
+import sqlite3
+import importlib
+import pytest
+from sqlalchemy import create_engine
+
+V0_SCHEMA = """
+    CREATE TABLE chat_history (
+        id INTEGER NOT NULL PRIMARY KEY, chat_id VARCHAR, title VARCHAR, sender VARCHAR, message TEXT,
+        sources TEXT, content TEXT, timestamp DATETIME
+    );
+    CREATE INDEX ix_chat_history_id ON chat_history (id);
+    CREATE INDEX ix_chat_history_chat_id ON chat_history (chat_id);
+"""
+
+V1_SCHEMA = """
+    PRAGMA user_version = 1;
+    CREATE TABLE chats (id VARCHAR NOT NULL PRIMARY KEY, title VARCHAR, created_at DATETIME, last_activity DATETIME);
+    CREATE INDEX ix_chats_last_activity ON chats (last_activity);
+    CREATE TABLE chat_history (
+        id INTEGER NOT NULL PRIMARY KEY, chat_id VARCHAR NOT NULL REFERENCES chats (id) ON DELETE CASCADE,
+        sender VARCHAR, message TEXT, sources TEXT, content TEXT, timestamp DATETIME
+    );
+    CREATE INDEX ix_chat_history_chat_id_timestamp ON chat_history (chat_id, timestamp);
+"""
+
+V2_SCHEMA = """
+    PRAGMA user_version = 2;
+    CREATE TABLE chats (id VARCHAR NOT NULL PRIMARY KEY, title VARCHAR, created_at DATETIME, last_activity DATETIME);
+    CREATE INDEX ix_chats_last_activity ON chats (last_activity);
+    CREATE TABLE chat_history (
+        id INTEGER NOT NULL PRIMARY KEY, chat_id VARCHAR NOT NULL REFERENCES chats (id) ON DELETE CASCADE,
+        sender VARCHAR, message TEXT, sources TEXT, chunk_ids TEXT, timestamp DATETIME
+    );
+    CREATE INDEX ix_chat_history_chat_id_timestamp ON chat_history (chat_id, timestamp);
+    CREATE TABLE chunks (id INTEGER NOT NULL PRIMARY KEY, digest VARCHAR NOT NULL, text TEXT, UNIQUE (digest));
+"""
+
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    # Importing the module creates and migrates storage/chat_database.db in the working directory
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(tmp_path_factory.mktemp("local"))
+        return importlib.import_module("database")
+
+
+def create_database(path, schema, rows):
+    connection = sqlite3.connect(path)
+    connection.executescript(schema)
+    for table, values in rows:
+        placeholders = ", ".join("?" * len(values))
+        connection.execute(f"INSERT INTO {table} VALUES ({placeholders})", values)
+    connection.commit()
+    connection.close()
+
+
+def query(path, sql):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute(sql).fetchall()
+    finally:
+        connection.close()
+
+
+def columns(path, table):
+    return [row[1] for row in query(path, f"PRAGMA table_info({table})")]
+
+
+def chunk_texts(path):
+    """Message ID -> texts of its chunks, in the stored order."""
+    chunks = dict(query(path, "SELECT id, text FROM chunks"))
+    return {
+        message_id: [chunks[chunk_id] for chunk_id in json.loads(chunk_ids)]
+        for message_id, chunk_ids in query(path, "SELECT id, chunk_ids FROM chat_history WHERE chunk_ids IS NOT NULL")
+    }
+
+
+@pytest.fixture
+def v0_database(tmp_path):
+    path = str(tmp_path / "chat_database.db")
+    create_database(path, V0_SCHEMA, [
+        ("chat_history", (1, "a", "First title", "User", "hello", None, None, "2024-01-01 10:00:00.000000")),
+        ("chat_history", (2, "a", "Renamed", "AI", "hi", '["doc.pdf"]', '["p1", "p2"]', "2024-01-01 10:00:05.000000")),
+        ("chat_history", (5, "b", "Other chat", "User", "question", None, None, "2024-01-02 09:00:00.000000")),
+        ("chat_history", (7, "b", "Other chat", "AI", "answer", '["doc.pdf"]', '["p2", "p3"]', "2024-01-02 09:30:00.000000")),
+        ("chat_history", (8, None, "Orphan", "User", "lost", None, None, "2024-01-03 09:00:00.000000")),
+    ])
+    return path
+
+
+def test_v0_database_is_migrated_to_the_current_schema(database, v0_database):
+    database.migrate(create_engine(f"sqlite:///{v0_database}"))
+
+    assert query(v0_database, "PRAGMA user_version") == [(database.SCHEMA_VERSION,)]
+    assert query(v0_database, "SELECT id, title, created_at, last_activity FROM chats ORDER BY id") == [
+        ("a", "First title", "2024-01-01 10:00:00.000000", "2024-01-01 10:00:05.000000"),
+        ("b", "Other chat", "2024-01-02 09:00:00.000000", "2024-01-02 09:30:00.000000"),
+    ]
+    # Message IDs are kept, messages without a chat are dropped
+    assert query(v0_database, "SELECT id, chat_id, sender, message, sources FROM chat_history ORDER BY id") == [
+        (1, "a", "User", "hello", None),
+        (2, "a", "AI", "hi", '["doc.pdf"]'),
+        (5, "b", "User", "question", None),
+        (7, "b", "AI", "answer", '["doc.pdf"]'),
+    ]
+    assert "title" not in columns(v0_database, "chat_history")
+    assert "content" not in columns(v0_database, "chat_history")
+    assert query(v0_database, "SELECT name FROM sqlite_master WHERE name = 'chat_history_v0'") == []
+
+    # The paragraph both answers retrieved is stored once
+    assert chunk_texts(v0_database) == {2: ["p1", "p2"], 7: ["p2", "p3"]}
+    assert query(v0_database, "SELECT COUNT(*) FROM chunks") == [(3,)]
+
+
+def test_migration_runs_only_once(database, v0_database):
+    engine = create_engine(f"sqlite:///{v0_database}")
+    database.migrate(engine)
+    before = query(v0_database, "SELECT * FROM chat_history ORDER BY id"), query(v0_database, "SELECT * FROM chunks ORDER BY id")
+    database.migrate(engine)
+    after = query(v0_database, "SELECT * FROM chat_history ORDER BY id"), query(v0_database, "SELECT * FROM chunks ORDER BY id")
+    assert after == before
+
+
+def test_v1_content_is_moved_to_chunks(database, tmp_path):
+    path = str(tmp_path / "chat_database.db")
+    create_database(path, V1_SCHEMA, [
+        ("chats", ("a", "Title", "2024-01-01 10:00:00.000000", "2024-01-01 10:00:05.000000")),
+        ("chat_history", (1, "a", "User", "hello", None, None, "2024-01-01 10:00:00.000000")),
+        ("chat_history", (2, "a", "AI", "hi", '["doc.pdf"]', '["p1", "p1", "p2"]', "2024-01-01 10:00:05.000000")),
+    ])
+    database.migrate(create_engine(f"sqlite:///{path}"))
+
+    assert query(path, "PRAGMA user_version") == [(database.SCHEMA_VERSION,)]
+    assert "content" not in columns(path, "chat_history")
+    assert query(path, "SELECT id, title FROM chats") == [("a", "Title")]
+    assert chunk_texts(path) == {2: ["p1", "p1", "p2"]}
+    assert query(path, "SELECT COUNT(*) FROM chunks") == [(2,)]
+
+
+def test_new_database_gets_the_current_schema(database, tmp_path):
+    path = str(tmp_path / "chat_database.db")
+    database.migrate(create_engine(f"sqlite:///{path}"))
+    assert query(path, "PRAGMA user_version") == [(database.SCHEMA_VERSION,)]
+    assert columns(path, "chat_history") == ["id", "chat_id", "sender", "message", "sources", "chunk_ids", "timestamp"]
+    assert query(path, "SELECT COUNT(*) FROM chats") == [(0,)]
+
+
+def test_v2_chunks_are_rebuilt_without_losing_ids(database, tmp_path):
+    path = str(tmp_path / "chat_database.db")
+    create_database(path, V2_SCHEMA, [
+        ("chats", ("a", "Title", "2024-01-01 10:00:00.000000", "2024-01-01 10:00:05.000000")),
+        ("chat_history", (2, "a", "AI", "hi", '["doc.pdf"]', "[4, 9]", "2024-01-01 10:00:05.000000")),
+        ("chunks", (4, "digest-p1", "p1")),
+        ("chunks", (9, "digest-p2", "p2")),
+    ])
+    database.migrate(create_engine(f"sqlite:///{path}"))
+
+    assert query(path, "PRAGMA user_version") == [(database.SCHEMA_VERSION,)]
+    assert chunk_texts(path) == {2: ["p1", "p2"]}
+    assert "AUTOINCREMENT" in query(path, "SELECT sql FROM sqlite_master WHERE name = 'chunks'")[0][0]
+    assert query(path, "SELECT name FROM sqlite_master WHERE name = 'chunks_v2'") == []
+
+
+def test_ids_of_deleted_chunks_are_not_reused(database, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'chat_database.db'}")
+    database.migrate(engine)
+    with engine.begin() as connection:
+        [old_id] = database.store_chunks(connection, ["old paragraph"])
+        database.delete_unreferenced_chunks(connection)
+        [new_id] = database.store_chunks(connection, ["new different paragraph"])
+    assert new_id > old_id
@@ -0,0 +1,97 @@
+import os
+import pickle
+import pytest
+import file_manifest
+from file_manifest import FileManifest, get_file_hash
+
+
+@pytest.fixture
+def archive(tmp_path):
+    folder = tmp_path / "archive"
+    folder.mkdir()
+    for name in ("a.pdf", "b.pdf"):
+        (folder / name).write_bytes(name.encode() * 100)
+    (folder / "notes.txt").write_text("not a pdf")
+    return folder
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    """Records the files that are hashed."""
+    calls = []
+
+    def counting_hash(file_path):
+        calls.append(os.path.basename(file_path))
+        return get_file_hash(file_path)
+    monkeypatch.setattr(file_manifest, "get_file_hash", counting_hash)
+    return calls
+
+
+def indexed_manifest(tmp_path, archive):
+    manifest = FileManifest(str(tmp_path / "manifest.json"))
+    changed, _ = manifest.scan(str(archive))
+    manifest.commit(changed)
+    manifest.save()
+    return FileManifest.load(manifest.path)
+
+
+def touch(path, seconds=10):
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 10**9))
+
+
+def test_new_files_are_reported_until_committed(tmp_path, archive):
+    manifest = FileManifest(str(tmp_path / "manifest.json"))
+    changed, removed = manifest.scan(str(archive))
+    assert sorted(os.path.basename(path) for path in changed) == ["a.pdf", "b.pdf"]
+    assert removed == []
+
+    manifest.commit([path for path in changed if path.endswith("a.pdf")])  # b.pdf failed
+    manifest.save()
+    changed, _ = FileManifest.load(manifest.path).scan(str(archive))
+    assert [os.path.basename(path) for path in changed] == ["b.pdf"]
+
+
+def test_unchanged_files_are_not_hashed(tmp_path, archive, hashed):
+    manifest = indexed_manifest(tmp_path, archive)
+    hashed.clear()
+    assert manifest.scan(str(archive)) == ([], [])
+    assert hashed == []
+
+
+def test_touched_file_with_the_same_content_is_not_reported(tmp_path, archive, hashed):
+    manifest = indexed_manifest(tmp_path, archive)
+    touch(archive / "a.pdf")
+    hashed.clear()
+
+    assert manifest.scan(str(archive)) == ([], [])
+    assert hashed == ["a.pdf"]
+    # The new mtime is recorded, so the next scan does not hash it again
+    hashed.clear()
+    assert manifest.scan(str(archive)) == ([], [])
+    assert hashed == []
+
+
+def test_modified_and_removed_files(tmp_path, archive):
+    manifest = indexed_manifest(tmp_path, archive)
+    (archive / "a.pdf").write_bytes(b"new content")
+    (archive / "b.pdf").unlink()
+
+    changed, removed = manifest.scan(str(archive))
+    assert changed == [str(archive / "a.pdf")]
+    assert removed == ["b.pdf"]
+
+    manifest.remove(removed)
+    assert set(manifest.files) == {"a.pdf"}
+
+
+def test_legacy_processed_files_are_taken_over(tmp_path, archive, hashed):
+    legacy = tmp_path / "processed_files.pkl"
+    with open(legacy, "wb") as f:
+        pickle.dump({"a.pdf": get_file_hash(str(archive / "a.pdf")), "b.pdf": "outdated hash"}, f)
+
+    manifest = FileManifest.load(str(tmp_path / "manifest.json"), legacy_file=str(legacy))
+    changed, removed = manifest.scan(str(archive))
+    assert changed == [str(archive / "b.pdf")]
+    assert removed == []
+    assert manifest.files["a.pdf"]["size"] == (archive / "a.pdf").stat().st_size
@@ -0,0 +1,160 @@
+import types
+import asyncio
+import httpx
+import pytest
+import server_client
+from server_client import CircuitBreaker, CircuitOpenError, ServerClient
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    # Only the breaker's clock: asyncio keeps using the real time.monotonic
+    monkeypatch.setattr(server_client, "time", types.SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def make_client(handler, **kwargs):
+    """ServerClient on a MockTransport; handler(request) returns a Response or raises."""
+    options = {"max_retries": 2, "backoff": 0.0, "failure_threshold": 2, "reset_timeout": 30.0, **kwargs}
+    client = ServerClient("http://server", **options)
+    client._client = httpx.AsyncClient(base_url="http://server", transport=httpx.MockTransport(handler))
+    return client
+
+
+def test_breaker_opens_after_consecutive_failures_and_lets_one_trial_through(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    clock.now += 30
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()  # Only one trial at a time
+
+    breaker.record_failure()  # Failed trial: open again
+    assert breaker.state == "open"
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+
+
+def test_successful_call_resets_the_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+@pytest.mark.parametrize("method, error, attempts", [
+    ("GET", httpx.ReadTimeout, 3),
+    ("GET", httpx.ConnectError, 3),
+    ("POST", httpx.ConnectError, 3),
+    ("POST", httpx.ConnectTimeout, 3),
+    ("POST", httpx.ReadTimeout, 1),  # The server may already be running the request
+    ("POST", httpx.RemoteProtocolError, 1),
+])
+def test_transport_errors_are_retried_only_when_safe(method, error, attempts):
+    calls = []
+
+    def handler(request):
+        calls.append(request.method)
+        raise error("failed", request=request)
+
+    client = make_client(handler)
+    call = client.get("/config/models") if method == "GET" else client.post("/query", json={"message": "hi"})
+    with pytest.raises(error):
+        asyncio.run(call)
+    assert calls == [method] * attempts
+    assert client.breaker.failures == 1
+
+
+def test_unavailable_responses_are_retried_for_posts():
+    responses = [httpx.Response(503), httpx.Response(502), httpx.Response(200, json={"response": "ok"})]
+    client = make_client(lambda request: responses.pop(0))
+    assert asyncio.run(client.post("/query", json={})) == {"response": "ok"}
+    assert responses == []
+
+
+def test_server_errors_count_as_failures_but_client_errors_do_not(clock):
+    status = {"code": 404}
+    client = make_client(lambda request: httpx.Response(status["code"]), max_retries=0)
+    for _ in range(3):
+        with pytest.raises(httpx.HTTPStatusError):
+            asyncio.run(client.get("/missing"))
+    assert client.breaker.state == "closed"
+
+    status["code"] = 500
+    for _ in range(2):
+        with pytest.raises(httpx.HTTPStatusError):
+            asyncio.run(client.get("/broken"))
+    assert client.breaker.state == "open"
+
+
+def test_open_circuit_fails_fast(clock):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        raise httpx.ConnectError("down", request=request)
+
+    client = make_client(handler, max_retries=0)
+    for _ in range(2):
+        with pytest.raises(httpx.ConnectError):
+            asyncio.run(client.get("/config/models"))
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(client.get("/config/models"))
+    assert len(calls) == 2
+
+
+def test_cancelled_trial_does_not_keep_the_circuit_open(clock):
+    mode = {"hang": False, "fail": True}
+
+    async def handler(request):
+        if mode["hang"]:
+            await asyncio.sleep(10)
+        if mode["fail"]:
+            raise httpx.ConnectError("down", request=request)
+        return httpx.Response(200, json={"ok": True})
+
+    client = make_client(handler, max_retries=0)
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(httpx.ConnectError):
+                await client.get("/config/models")
+        clock.now += 30
+        mode.update(hang=True, fail=False)
+        trial = asyncio.create_task(client.get("/config/models"))
+        await asyncio.sleep(0.01)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+        mode["hang"] = False
+        return await client.get("/config/models")
+
+    assert asyncio.run(scenario()) == {"ok": True}
+    assert client.breaker.state == "closed"
+
+
+def test_stream_yields_the_response_lines():
+    client = make_client(lambda request: httpx.Response(200, content=b'{"type": "token"}\n{"type": "done"}\n'))
+
+    async def read():
+        async with client.stream("/query/stream", json={}) as response:
+            return [line async for line in response.aiter_lines()]
+
+    assert asyncio.run(read()) == ['{"type": "token"}', '{"type": "done"}']
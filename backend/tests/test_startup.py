@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import pytest
+from startup import LazyComponent, Startup, ComponentUnavailableError
+
+
+class FlakyLoader:
+    """Raises for the first `failures` calls, then returns value; records the threads it ran on."""
+
+    def __init__(self, failures=0, value="model"):
+        self.failures = failures
+        self.value = value
+        self.threads = []
+
+    def __call__(self):
+        self.threads.append(threading.current_thread())
+        if len(self.threads) <= self.failures:
+            raise OSError("download failed")
+        return self.value
+
+
+def make_config(**loaders):
+    return type("Config", (), {name: LazyComponent(loader) for name, loader in loaders.items()})
+
+
+def test_component_loads_once_on_first_access_without_startup():
+    loader = FlakyLoader()
+    Config = make_config(model=loader)
+    assert Config.model == "model"
+    assert Config.model == "model"
+    assert len(loader.threads) == 1
+
+
+def test_components_wait_for_the_ones_they_use():
+    Config = make_config(model=FlakyLoader(), batcher=lambda: f"batcher of {Config.model}")
+    startup = Startup(Config)
+
+    async def run():
+        await startup.wait()
+        return Config.batcher
+
+    assert asyncio.run(run()) == "batcher of model"
+    assert startup.ready()
+    assert set(startup.phases) == {"load_model", "load_batcher"}
+
+
+def test_failed_component_is_not_loaded_again_on_access():
+    loader = FlakyLoader(failures=10)
+    Config = make_config(model=loader, batcher=lambda: f"batcher of {Config.model}")
+    startup = Startup(Config, retry_backoff=60)
+
+    async def run():
+        await startup.wait()
+        with pytest.raises(ComponentUnavailableError):
+            Config.model  # On the event loop
+        with pytest.raises(ComponentUnavailableError):
+            await asyncio.to_thread(lambda: Config.model)
+        with pytest.raises(ComponentUnavailableError):
+            Config.batcher
+
+    asyncio.run(run())
+    assert len(loader.threads) == 1
+    assert threading.main_thread() not in loader.threads
+    assert not startup.ready()
+    assert startup.status()["components"]["batcher"]["state"] == "failed"
+
+
+def test_failed_components_are_retried_in_the_background():
+    loader = FlakyLoader(failures=2)
+    Config = make_config(model=loader, batcher=lambda: f"batcher of {Config.model}")
+    startup = Startup(Config, retry_backoff=0.01, max_retry_backoff=0.02)
+
+    async def run():
+        await startup.wait()
+        assert not startup.ready()
+        await asyncio.wait_for(startup._retry_task, timeout=5)
+        return Config.batcher
+
+    assert asyncio.run(run()) == "batcher of model"
+    assert startup.ready()
+    assert Config.__dict__["model"].attempts == 3
+    assert threading.main_thread() not in loader.threads
+
+
+def test_replaced_component_is_never_loaded():
+    loader = FlakyLoader(failures=10)
+    Config = make_config(model=loader)
+    startup = Startup(Config)
+    Config.model = "replacement"
+
+    asyncio.run(startup.wait())
+    assert Config.model == "replacement"
+    assert loader.threads == []
+    assert startup.ready()
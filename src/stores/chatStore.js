@@ -4,12 +4,15 @@ import axios from 'axios'
 import { v4 as uuidv4 } from 'uuid' // For generating new chat IDs
 
 const LOCAL_API = 'http://127.0.0.1:8000'
+const PAGE_SIZE = 50 // Messages loaded per page
 
 export const useChatStore = defineStore('chat', () => {
   const chatId = ref(null) // Current chat ID
   const messages = ref([]) // Messages for active chat
   const chatHistory = ref([]) // List of past chats
   const shownFile = ref(null) // Current File shown
+  const hasOlderMessages = ref(false) // More messages before the first loaded one
+  const chunkTexts = new Map() // Retrieved paragraphs by chunk ID, loaded on demand
 
   // Load chat history for sidebar
   const fetchChatHistory = async () => {
@@ -17,14 +20,15 @@ export const useChatStore = defineStore('chat', () => {
     chatHistory.value = res.data
   }
 
-  // Load messages for selected chat
+  // Load the latest messages for selected chat
   const fetchMessages = async (id) => {
     chatId.value = id
     try {
       console.log('Fetching messages for chat ID:', id) // Debug log
-      const res = await axios.get(`${LOCAL_API}/chats/${id}`)
+      const res = await axios.get(`${LOCAL_API}/chats/${id}`, { params: { limit: PAGE_SIZE } })
       console.log('Fetched messages:', res.data) // Debug log
       messages.value = res.data // Ensure messages are properly updated
+      hasOlderMessages.value = res.data.length === PAGE_SIZE
     } catch (error) {
       console.error('Failed to fetch messages:', error)
       messages.value.push({
@@ -34,6 +38,33 @@ export const useChatStore = defineStore('chat', () => {
     }
   }
 
+  // Load the page of messages before the first loaded one
+  const fetchOlderMessages = async () => {
+    const first = messages.value.find((msg) => msg.id !== undefined)
+    if (!first) return
+    try {
+      const res = await axios.get(`${LOCAL_API}/chats/${chatId.value}`, {
+        params: { before: first.id, limit: PAGE_SIZE },
+      })
+      messages.value = [...res.data, ...messages.value]
+      hasOlderMessages.value = res.data.length === PAGE_SIZE
+    } catch (error) {
+      console.error('Failed to fetch older messages:', error)
+    }
+  }
+
+  // Text of the i-th retrieved paragraph of a message (streamed messages have it, stored ones load it by ID)
+  const getContent = async (msg, i) => {
+    if (msg.content) return msg.content[i]
+    const id = msg.chunk_ids?.[i]
+    if (id === undefined) return null
+    if (!chunkTexts.has(id)) {
+      const res = await axios.get(`${LOCAL_API}/chunks/${id}`)
+      chunkTexts.set(id, res.data.text)
+    }
+    return chunkTexts.get(id)
+  }
+
   // Send new message
   const sendMessage = async (message, router) => {
     if (!message.trim()) return
@@ -57,31 +88,50 @@ export const useChatStore = defineStore('chat', () => {
     // Add user's message instantly to the chat
     messages.value.push({ sender: 'User', message })
 
+    // Placeholder for the AI response, filled while the answer streams in
+    messages.value.push({ sender: 'AI', message: '', sources: [], content: [] })
+    const aiMessage = messages.value[messages.value.length - 1]
+
     try {
-      // Send message to local backend, which handles RAG & LLM processing
-      // console.log(message.trim())
-      const res = await axios.post(`${LOCAL_API}/chats/${chatId.value}`, {
-        sender: 'User',
-        message: message.trim(),
+      // Send message to local backend, which handles RAG & LLM processing and streams the answer
+      const res = await fetch(`${LOCAL_API}/chats/${chatId.value}/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ sender: 'User', message: message.trim() }),
       })
-
-      // Extract AI response, sources & content
-      const aiMessage = {
-        sender: 'AI',
-        message: res.data.message,
-        sources: res.data.sources || [], // File paths
-        content: res.data.content || [], // Extracted paragraphs
+      if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`)
+
+      // Read newline-delimited JSON events: sources first, then tokens
+      const reader = res.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ''
+      for (;;) {
+        const { done, value } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+        const lines = buffer.split('\n')
+        buffer = lines.pop()
+        for (const line of lines) {
+          if (!line.trim()) continue
+          const event = JSON.parse(line)
+          if (event.type === 'sources') {
+            aiMessage.sources = event.sources || [] // File paths
+            aiMessage.content = event.content || [] // Extracted paragraphs
+          } else if (event.type === 'token') {
+            aiMessage.message += event.token
+          } else if (event.type === 'error' && !aiMessage.message) {
+            aiMessage.message = event.error
+          }
+        }
       }
 
-      // Store AI response locally
-      messages.value.push(aiMessage)
-
       // Fetch updated chat history
       await fetchChatHistory()
     } catch (error) {
       console.error('API Error:', error)
 
       // Display user-friendly error message in the chat
+      messages.value.splice(messages.value.indexOf(aiMessage), 1)
       messages.value.push({
         sender: 'System',
         message: 'Error: Unable to reach the AI. Please try again later.',
@@ -123,8 +173,11 @@ export const useChatStore = defineStore('chat', () => {
     messages,
     chatHistory,
     shownFile,
+    hasOlderMessages,
     fetchChatHistory,
     fetchMessages,
+    fetchOlderMessages,
+    getContent,
     sendMessage,
     deleteChat,
     changeTitle,